@@ -0,0 +1,128 @@
+import collections
+import datetime
+import math
+
+from tornado import gen
+from tornado.concurrent import Future
+
+from settings import app_settings
+
+
+class Overloaded(Exception):
+
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class Admission:
+
+    def __init__(self, controller, weight):
+        self.controller = controller
+        self.weight = weight
+
+    async def __aenter__(self):
+        await self.controller.acquire(self.weight)
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self.controller.release(self.weight)
+
+
+class AdmissionController:
+    """
+    Bounds the evaluations running at the same time.
+
+    An evaluation costs one unit per ``lines_per_unit`` lines of its data set.
+    Evaluations which do not fit in ``capacity`` wait in a FIFO queue of at most
+    ``max_queue`` entries for ``queue_timeout`` seconds; beyond that they are
+    rejected with ``Overloaded`` instead of piling up.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.capacity = kwargs.get('capacity', app_settings['admission_capacity'])
+        self.lines_per_unit = kwargs.get('lines_per_unit', app_settings['admission_lines_per_unit'])
+        self.max_queue = kwargs.get('max_queue', app_settings['admission_max_queue'])
+        self.queue_timeout = kwargs.get('queue_timeout', app_settings['admission_queue_timeout'])
+        self.retry_after = kwargs.get('retry_after', app_settings['admission_retry_after'])
+        self.in_use = 0
+        self.in_flight = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self._waiters = collections.deque()
+
+    def weight(self, lines):
+        units = math.ceil(lines / self.lines_per_unit) if lines else 1
+        return min(max(units, 1), self.capacity)
+
+    def admit(self, lines):
+        """
+        :type lines: int
+        :rtype: Admission
+        :return: async context manager holding the units of an evaluation
+        """
+        return Admission(self, self.weight(lines))
+
+    def _fits(self, weight):
+        return self.in_use + weight <= self.capacity
+
+    def _take(self, weight):
+        self.in_use += weight
+        self.in_flight += 1
+        self.admitted += 1
+
+    async def acquire(self, weight):
+        if not self._waiters and self._fits(weight):
+            self._take(weight)
+            return
+        if len(self._waiters) >= self.max_queue:
+            self.rejected += 1
+            raise Overloaded('queue is full', self.retry_after)
+
+        waiter = Future()
+        entry = (weight, waiter)
+        self._waiters.append(entry)
+        try:
+            await gen.with_timeout(datetime.timedelta(seconds=self.queue_timeout), waiter)
+        except gen.TimeoutError:
+            if waiter.done():
+                # admitted just before the deadline
+                return
+            self._waiters.remove(entry)
+            self.timed_out += 1
+            self._wake()
+            raise Overloaded('queue deadline exceeded', self.retry_after)
+        except BaseException:
+            # cancelled, e.g. the job of the evaluation: give back what it holds
+            if waiter.done():
+                self.release(weight)
+            else:
+                self._waiters.remove(entry)
+                self._wake()
+            raise
+
+    def release(self, weight):
+        self.in_use -= weight
+        self.in_flight -= 1
+        self._wake()
+
+    def _wake(self):
+        # strictly in order, a large evaluation is not overtaken by small ones
+        while self._waiters and self._fits(self._waiters[0][0]):
+            weight, waiter = self._waiters.popleft()
+            self._take(weight)
+            waiter.set_result(None)
+
+    def stats(self):
+        return {
+            'capacity': self.capacity,
+            'in_use': self.in_use,
+            'in_flight': self.in_flight,
+            'queued': len(self._waiters),
+            'max_queue': self.max_queue,
+            'admitted': self.admitted,
+            'rejected': self.rejected,
+            'timed_out': self.timed_out,
+        }
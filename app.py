@@ -1,91 +1,183 @@
-import copy
+import asyncio
+import functools
 import json
 import logging
+import os
+import re
+import signal
+import tempfile
+import time
 from urllib.parse import urlsplit
 
 import tornado
 from tornado import gen
 import tornado.escape
 import tornado.httputil
-from tornado.httpclient import AsyncHTTPClient, HTTPRequest
+from tornado.httpclient import HTTPRequest
 from tornado.httpserver import HTTPServer
-from tornado.ioloop import IOLoop
+from tornado.ioloop import IOLoop, PeriodicCallback
+from tornado.netutil import bind_sockets
 from tornado.web import Application, RequestHandler
+import numpy as np
 
+from admission import AdmissionController, Overloaded
+from coalescing import RequestCoalescer
+from jobs import FINISHED, JobScheduler, QueueFull
+from json_codec import JsonTemplate, json_decode, json_encode
+import metrics
+from metrics import STAGE_SECONDS
+from schema import Field, SchemaError, compile_schema
+from scoring import ScoringEngine, ScoringServer
+from sequential import SequentialEstimate
 from settings import app_settings, proxy_path
-from storage import Manager
-from utils import score_translation, split
+from storage import DataSet, DataSetStream, Manager, Snapshot
+from supervisor import Supervisor, notify_ready
+from translation_cache import CACHE_BYPASS, CACHE_MODES, CACHE_USE, TranslationCache
+from upstream import UpstreamClient
+from utils import (SCORERS, add_statistics, corpus_scores, get_scorer, match_lines,
+                   merge_statistics, segment_scores, split, stratified_order, summed_scores,
+                   take_statistics, worst_segments)
 
 LOGGING_FORMAT = '%(asctime)s - %(message)s'
 logging.basicConfig(level=logging.INFO, format=LOGGING_FORMAT)
 
 EVALUATE_URL = '/ai/text/evaluate_provider'
+STATS_URL = '/stats'
+METRICS_URL = '/metrics'
+READY_URL = '/ready'
+RESULTS_HISTORY_URL = '/results/history'
+RESULTS_LATEST_URL = '/results/latest'
+LEADERBOARD_URL = '/results/leaderboard'
+RESULT_URL = r'/results/([0-9]+)'
+JOB_URL = r'/jobs/([0-9a-f]+)'
+DATA_SET_URL = r'/data_sets/([0-9]+)'
+NDJSON_CONTENT_TYPE = 'application/x-ndjson'
 
 
 class ValidationMixin:
     VALIDATION_STRUCTURE = {
         'context': {
-            'data_set_id': 'number',
-            'score_type': 'text'
-        }
+            'data_set_id': Field('integer', minimum=0),
+            'score_type': Field(('text', 'list'), choices=tuple(SCORERS),
+                                items=Field('text', choices=tuple(SCORERS)), min_items=1),
+            'cache': Field('text', required=False, choices=CACHE_MODES),
+            'stream': Field('boolean', required=False),
+            'segments': Field('boolean', required=False),
+            'worst': Field('integer', required=False, minimum=0,
+                           maximum=app_settings['worst_segments_max']),
+            'job': Field('boolean', required=False),
+            'priority': Field('integer', required=False, minimum=0,
+                              maximum=app_settings['jobs_max_priority']),
+            'sequential': Field('boolean', required=False),
+            'ci_width': Field('number', required=False, minimum=0),
+            'confidence': Field('number', required=False, minimum=0.5, maximum=0.999),
+            'max_lines': Field('integer', required=False, minimum=1),
+            'max_chars': Field('integer', required=False, minimum=1),
+            'seed': Field('integer', required=False, minimum=0),
+            'incremental': Field('boolean', required=False),
+        },
+        'service': {
+            'provider': Field(('text', 'list'), items=Field('text'), min_items=1),
+        },
     }
 
+    @classmethod
+    def _get_validator(cls):
+        # compiled on first use, once per class
+        validator = cls.__dict__.get('_validator')
+        if validator is None:
+            validator = compile_schema(cls.VALIDATION_STRUCTURE)
+            cls._validator = validator
+        return validator
+
     @classmethod
     def _validate_json(cls, data, validation_structure=None):
         if validation_structure is None:
-            validation_structure = cls.VALIDATION_STRUCTURE
-
-        for key in validation_structure.keys():
-            try:
-                value = data[key]
-                if isinstance(value, dict):
-                    cls._validate_json(value, validation_structure[key])
-            except KeyError as e:
-                error_text = 'Not valid data structure, key not found: {}'.format(e.args[0])
-                raise tornado.web.HTTPError(400, error_text)
+            validator = cls._get_validator()
+        else:
+            validator = compile_schema(validation_structure)
+        try:
+            validator(data)
+        except SchemaError as exc:
+            error_text = 'Not valid data structure, {}: {}'.format(exc.path, exc.message)
+            raise tornado.web.HTTPError(400, error_text)
 
     @classmethod
     def validate_request_payload(cls, request_body):
         try:
-            request_payload = tornado.escape.json_decode(request_body)
+            request_payload = json_decode(request_body)
         except json.decoder.JSONDecodeError:
             raise tornado.web.HTTPError(400)
         cls._validate_json(request_payload)
         return request_payload
 
 
+class JsonErrorMixin:
+
+    def write_error(self, status_code, **kwargs):
+        exc = kwargs.get('exc_info', (None, None))[1]
+        if isinstance(exc, tornado.web.HTTPError) and status_code < 500 and exc.log_message:
+            # the client learns which part of the request is wrong
+            self.set_header('Content-Type', 'application/json; charset=UTF-8')
+            self.finish(json_encode({'status': 'error', 'detail': exc.log_message}))
+            return
+        super().write_error(status_code, **kwargs)
+
+
 class ProxyRequestMixin:
 
     def _set_header(self, request):
-        request.headers = self.request.headers
+        request.headers = tornado.httputil.HTTPHeaders(self.request.headers)
+        # the body is re-encoded, its length is set by the client
+        request.headers.pop('Content-Length', None)
         request.headers['Host'] = urlsplit(proxy_path[EVALUATE_URL]).netloc
 
     def create_proxy_request(self, payload_data=None):
+        """
+        :type payload_data: dict or bytes
+        :param payload_data: payload, or the payload already encoded
+        """
         url = proxy_path[EVALUATE_URL]
+        if payload_data and not isinstance(payload_data, bytes):
+            payload_data = json_encode(payload_data)
         req = HTTPRequest(
             url=url,
             method=self.request.method,
-            body=tornado.escape.json_encode(payload_data) if payload_data else None,
+            body=payload_data or None,
         )
         self._set_header(req)
         return req
 
 
-class EvaluateProviderHandler(ProxyRequestMixin, ValidationMixin, RequestHandler):
+class EvaluateProviderHandler(JsonErrorMixin, ProxyRequestMixin, ValidationMixin,
+                              RequestHandler):
+    # lines of a chunk of a sequential evaluation and of a data set read in the
+    # background, and the batch size a provider starts with
+    CHUNK_SIZE = 100
 
     def initialize(self, *args, **kwargs):
         self.manager = kwargs.pop('data_store_manager')
+        self.scoring_engine = kwargs.pop('scoring_engine')
+        self.translation_cache = kwargs.pop('translation_cache')
+        self.upstream_client = kwargs.pop('upstream_client')
+        self.admission_controller = kwargs.pop('admission_controller')
+        self.coalescer = kwargs.pop('coalescer')
+        self.job_scheduler = kwargs.pop('job_scheduler')
+        # the job this request runs, if any
+        self.job = None
 
-    @staticmethod
-    def create_payload(data_set, payload_data):
-        new_payload = copy.copy(payload_data)
-        del new_payload['context']['data_set_id']
-        del new_payload['context']['score_type']
-        #
-        new_payload['context']['to'] = data_set.lang_to
+    # request options of this service, not sent upstream
+    LOCAL_CONTEXT_KEYS = ('data_set_id', 'score_type', 'stream', 'cache', 'segments', 'worst',
+                          'job', 'priority', 'sequential', 'ci_width', 'confidence', 'max_lines',
+                          'max_chars', 'seed', 'incremental')
 
-        # new_payload['context']['text'] = data_set.original
-        return new_payload
+    @classmethod
+    def create_payload(cls, data_set, payload_data):
+        # a new context, the request payload is left as it is
+        context = {key: value for key, value in payload_data['context'].items()
+                   if key not in cls.LOCAL_CONTEXT_KEYS}
+        context['to'] = data_set.lang_to
+        return dict(payload_data, context=context)
 
     @staticmethod
     def _get_data_set_id(payload):
@@ -96,27 +188,205 @@ class EvaluateProviderHandler(ProxyRequestMixin, ValidationMixin, RequestHandler
         return payload['context']['score_type']
 
     @staticmethod
-    def _evaluate_single(response_data, data_set, evaluation_type):
-        evaluation_value = score_translation(
-            response_data['results'], data_set.original, evaluation_type
+    def _score_types(evaluation_type):
+        if isinstance(evaluation_type, str):
+            return [evaluation_type]
+        # the order of the request, without repetitions
+        return list(dict.fromkeys(evaluation_type))
+
+    @staticmethod
+    def _format_score(evaluation_type, scores):
+        """
+        :type scores: dict
+        :return: one score for a score type, a list of scores for a list of them
+        """
+        if isinstance(evaluation_type, str):
+            return {'type': evaluation_type, 'value': scores[evaluation_type]}
+        return [{'type': name, 'value': value} for name, value in scores.items()]
+
+    @staticmethod
+    def _get_segment_options(payload):
+        """
+        :return: whether the score of every segment is requested, and the number
+            of worst segments requested
+        """
+        context = payload['context']
+        return bool(context.get('segments')), int(context.get('worst', 0))
+
+    def _get_sequential_options(self, payload):
+        """
+        :return: options of ``sequential.SequentialEstimate``, None unless a
+            sequential evaluation is requested
+        """
+        context = payload['context']
+        if not context.get('sequential'):
+            return
+        providers = payload['service']['provider']
+        if isinstance(providers, list) and len(providers) != 2:
+            raise tornado.web.HTTPError(400, 'Sequential evaluation compares two providers')
+        if self._is_streaming(payload) or any(self._get_segment_options(payload)):
+            raise tornado.web.HTTPError(
+                400, 'Sequential evaluation returns neither a stream nor segments'
+            )
+        options = {}
+        for key, option, type_ in (('ci_width', 'width', float),
+                                   ('confidence', 'confidence', float),
+                                   ('max_lines', 'max_lines', int), ('max_chars', 'max_chars', int),
+                                   ('seed', 'seed', int)):
+            if context.get(key) is not None:
+                options[option] = type_(context[key])
+        return options
+
+    def _is_incremental(self, payload):
+        """
+        Whether only the lines changed since the last evaluation of the provider
+        on the data set are translated and scored.
+        """
+        context = payload['context']
+        if not context.get('incremental'):
+            return False
+        if isinstance(payload['service']['provider'], list):
+            raise tornado.web.HTTPError(400, 'Incremental evaluation supports a single provider')
+        if self._is_streaming(payload) or context.get('sequential'):
+            raise tornado.web.HTTPError(
+                400, 'Incremental evaluation is neither streamed nor sequential'
+            )
+        return True
+
+    @staticmethod
+    def _get_references(data_set, start=0, stop=None):
+        if stop is None:
+            stop = len(data_set.translation)
+        if data_set.reference_ngrams is not None:
+            return data_set.reference_ngrams.slice(start, stop)
+        return data_set.translation[start:stop]
+
+    @staticmethod
+    def _get_cache_mode(payload):
+        cache_mode = payload['context'].get('cache', CACHE_USE)
+        if cache_mode not in CACHE_MODES:
+            raise tornado.web.HTTPError(400, 'Not valid cache mode: {}'.format(cache_mode))
+        return cache_mode
+
+    def _is_streaming(self, payload):
+        if payload['context'].get('stream'):
+            return True
+        return NDJSON_CONTENT_TYPE in self.request.headers.get('Accept', '')
+
+    @staticmethod
+    def _segment_report(data_set, translations, stats, segment_options):
+        """
+        Scores of every segment and the worst segments, from the statistics the
+        corpus score was computed from.
+
+        :type stats: dict
+        :return: None when neither was requested
+        """
+        with_scores, worst = segment_options
+        if not with_scores and not worst:
+            return
+        scores = segment_scores(stats)
+        report = {}
+        if with_scores:
+            report['scores'] = {name: values.tolist() for name, values in scores.items()}
+        if worst:
+            # ranked by the first score type of the request
+            ranked_by = next(iter(stats))
+            report['worst'] = [
+                {
+                    'index': idx,
+                    'source': data_set.original[idx],
+                    'reference': data_set.translation[idx],
+                    'hypothesis': translations[idx],
+                    'scores': {name: float(values[idx]) for name, values in scores.items()},
+                }
+                for idx in worst_segments(scores[ranked_by], worst,
+                                          get_scorer(ranked_by).lower_is_better).tolist()
+            ]
+        return report
+
+    async def _evaluate_single(self, response_data, data_set, evaluation_type,
+                               segment_options=(False, 0)):
+        references = data_set.translation
+        if data_set.reference_ngrams is not None:
+            references = data_set.reference_ngrams
+        stats = await self.scoring_engine.statistics(
+            references, response_data['results'], self._score_types(evaluation_type)
         )
-        response_data['score'] = {'type': evaluation_type, 'value': evaluation_value}
+        response_data['score'] = self._format_score(evaluation_type, corpus_scores(stats))
+        report = self._segment_report(data_set, response_data['results'], stats, segment_options)
+        if report is not None:
+            response_data['segments'] = report
         return response_data
 
-    def evaluate(self, response_data, data_set, evaluation_type):
+    async def evaluate(self, response_data, data_set, evaluation_type, segment_options=(False, 0)):
         if isinstance(response_data, list):
-
-            for idx, _ in enumerate(response_data):
-                response_data[idx] = self._evaluate_single(
-                    response_data[idx],
-                    data_set,
-                    evaluation_type
-                )
+            # every provider is scored against the same tokenized references
+            await gen.multi([
+                self._evaluate_single(provider_response, data_set, evaluation_type,
+                                      segment_options)
+                for provider_response in response_data
+                if provider_response.get('status') != 'error'
+            ])
             return response_data
-        return self._evaluate_single(response_data, data_set, evaluation_type)
+        return await self._evaluate_single(response_data, data_set, evaluation_type,
+                                           segment_options)
+
+    async def save_versioned_result(self, data_set_id, proxy_response_data, data_set=None,
+                                    version=None):
+        """
+        Save the result with the version of the data set it was computed on, which
+        the file of the data set may no longer have.
+
+        :type version: storage.DataSetVersion
+        """
+        if version is None and data_set is not None:
+            try:
+                version = await self.manager.get_version_of(data_set_id, data_set)
+            except Exception:
+                logging.exception('cannot hash data set %s', data_set_id)
+        return await self.manager.save(data_set_id, proxy_response_data, version)
+
+    def save_result(self, data_set_id, proxy_response_data, data_set=None, version=None):
+        # batched by the results writer, the response does not wait for it
+        IOLoop.current().spawn_callback(self.save_versioned_result, data_set_id,
+                                        proxy_response_data, data_set, version)
+
+    @staticmethod
+    def _stores_segment_scores(response_data):
+        return (len(response_data.get('results') or ()) > app_settings['segment_scores_inline_max']
+                and 'scores' in response_data.get('segments', {}))
+
+    async def store_result(self, data_set_id, proxy_response_data, data_set=None, version=None):
+        """
+        Save the result; per-segment scores of large results are only stored, the
+        response refers to the stored result instead.
+
+        :param data_set: the data set evaluated, or ``version`` of it
+        :return: the response data to send
+        """
+        multi = isinstance(proxy_response_data, list)
+        responses = proxy_response_data if multi else [proxy_response_data]
+        if not any(map(self._stores_segment_scores, responses)):
+            self.save_result(data_set_id, proxy_response_data, data_set, version)
+            return proxy_response_data
 
-    def save_result(self, data_set_id, proxy_response_data):
-        self.manager.save(data_set_id, proxy_response_data)
+        record_ids = await self.save_versioned_result(data_set_id, proxy_response_data, data_set,
+                                                      version)
+        record_ids = iter(record_ids if multi else [record_ids])
+        detached = []
+        for response_data in responses:
+            if response_data.get('status') == 'error':
+                detached.append(response_data)
+                continue
+            record_id = next(record_ids)
+            if self._stores_segment_scores(response_data):
+                segments = {key: value for key, value in response_data['segments'].items()
+                            if key != 'scores'}
+                segments['result_id'] = record_id
+                response_data = dict(response_data, segments=segments)
+            detached.append(response_data)
+        return detached if multi else detached[0]
 
     # No success with Future which is not working with new await, though this was fixed
     # in new version: 5.0.1
@@ -127,29 +397,242 @@ class EvaluateProviderHandler(ProxyRequestMixin, ValidationMixin, RequestHandler
         data_set = self.manager.get_data_set(data_set_id)
         return (yield data_set)
 
-    def _split_request_in_multiple(self, data_set, proxy_request_payload):
-        threshold = 100
-        splited_arrays = split(data_set.original, threshold)
+    @staticmethod
+    def _chunk_payload(proxy_request_payload, texts):
+        # every chunk needs its own context, the payload is shared otherwise
+        chunk_payload = dict(proxy_request_payload)
+        chunk_payload['context'] = dict(proxy_request_payload['context'], text=list(texts))
+        return chunk_payload
+
+    def _split_request_in_multiple(self, data_set, proxy_request_payload, chunk_size=None):
+        """
+        Chunks of the data set, of ``chunk_size`` lines or as the batch planner
+        of the provider plans them.
+        """
+        if chunk_size is None:
+            planner = self.upstream_client.get_planner(
+                str(proxy_request_payload['service']['provider']), self.CHUNK_SIZE
+            )
+            splited_arrays = [data_set.original[start:stop]
+                              for start, stop in planner.plan(data_set.original)] or [[]]
+        else:
+            splited_arrays = split(data_set.original, chunk_size)
         results_array = [None] * len(splited_arrays)
 
         proxy_request_payloads = []
 
         for array in splited_arrays:
-            proxy_request_payload['context']['text'] = array
-            proxy_request_payloads.append(proxy_request_payload)
+            proxy_request_payloads.append(self._chunk_payload(proxy_request_payload, array))
         return results_array, proxy_request_payloads
 
-    async def _send_request_gather_response(self, results_array, proxy_request_payloads):
-        client = AsyncHTTPClient()
-        logging.info('start _send_request_gather_response request %s', self.request)
-        waiter = gen.WaitIterator(
-            *[client.fetch(self.create_proxy_request(proxy_request_payload))
-              for proxy_request_payload in proxy_request_payloads]
+    async def _stream_request_payloads(self, data_set_stream, proxy_request_payload):
+        # the chunks of ``storage.iter_chunks`` have the sizes of ``split``
+        async for chunk in data_set_stream.chunks():
+            yield self._chunk_payload(proxy_request_payload, [source for source, _ in chunk])
+
+    def _cache_keys(self, proxy_request_payload):
+        provider_id = proxy_request_payload['service']['provider']
+        lang_to = proxy_request_payload['context']['to']
+        return [self.translation_cache.make_key(provider_id, lang_to, text)
+                for text in proxy_request_payload['context']['text'] + [None]]
+
+    async def _read_cache(self, proxy_request_payloads):
+        """
+        Cached translations of every chunk, None for misses; nothing is used
+        unless the provider response envelope is cached too.
+        """
+        keys = [self._cache_keys(payload) for payload in proxy_request_payloads]
+        values = await self.translation_cache.get_many([key for chunk in keys for key in chunk])
+        cached, envelope, position = [], None, 0
+        for chunk_keys in keys:
+            cached.append(values[position:position + len(chunk_keys) - 1])
+            envelope = envelope or values[position + len(chunk_keys) - 1]
+            position += len(chunk_keys)
+        if envelope is None:
+            return [[None] * len(chunk) for chunk in cached], None
+        return cached, json_decode(envelope)
+
+    def _write_cache(self, proxy_request_payload, chunk_response):
+        keys = self._cache_keys(proxy_request_payload)
+        items = dict(zip(keys, chunk_response['results']))
+        envelope = {key: value for key, value in chunk_response.items() if key != 'results'}
+        items[keys[-1]] = json_encode(envelope).decode()
+        # the disk write stays off the request path
+        IOLoop.current().spawn_callback(self.translation_cache.put_many, items)
+
+    @staticmethod
+    async def _payload_batches(proxy_request_payloads):
+        if isinstance(proxy_request_payloads, list):
+            yield proxy_request_payloads
+            return
+        async for proxy_request_payload in proxy_request_payloads:
+            yield [proxy_request_payload]
+
+    async def _fetch_chunk(self, proxy_request_payload, cached, template,
+                           cache_mode=CACHE_BYPASS, envelope=None):
+        """
+        Send the texts of a chunk which are not ``cached`` upstream.
+
+        :param cached: translation of every text of the chunk, or None
+        :param envelope: cached response envelope, for a chunk which is cached
+        :return: decoded upstream response, with the translations of every text
+        """
+        misses = [pos for pos, value in enumerate(cached) if value is None]
+        if not misses:
+            return dict(envelope, results=cached)
+        texts = proxy_request_payload['context']['text']
+        miss_payload = dict(proxy_request_payload)
+        miss_payload['context'] = dict(proxy_request_payload['context'],
+                                       text=[texts[pos] for pos in misses])
+        # the misses are sent in batches under the limits of the provider
+        batches = await self.upstream_client.fetch_batches(
+            str(miss_payload['service']['provider']), miss_payload['context']['text'],
+            lambda batch: self.create_proxy_request(template.render(batch)), self.CHUNK_SIZE
         )
+        batch_responses = [json_decode(response.body) for _, response in batches]
+        chunk_response = batch_responses[0]
+        chunk_response['results'] = [translation for batch_response in batch_responses
+                                     for translation in batch_response['results']]
+        if cache_mode != CACHE_BYPASS:
+            self._write_cache(miss_payload, chunk_response)
+        for pos, translation in zip(misses, chunk_response['results']):
+            cached[pos] = translation
+        chunk_response['results'] = cached
+        return chunk_response
+
+    @staticmethod
+    def _is_cached(cached):
+        return all(value is not None for value in cached)
 
-        while not waiter.done():
-            response = await waiter.next()
-            results_array[waiter.current_index] = tornado.escape.json_decode(response.body)
+    async def _iter_chunk_responses(self, proxy_request_payloads, cache_mode=CACHE_BYPASS):
+        """
+        Yield (chunk index, decoded upstream response) in order of completion.
+
+        ``proxy_request_payloads`` is a list, or an async iterator of the chunks
+        of a data set which is still being read; their requests start as they
+        arrive. Segments found in the translation cache are not sent upstream,
+        they are stitched back into the chunk responses.
+        """
+        template = None
+        fetches, fetched = [], []
+        idx = 0
+        try:
+            async for batch in self._payload_batches(proxy_request_payloads):
+                if template is None:
+                    if isinstance(batch[0]['service']['provider'], list):
+                        cache_mode = CACHE_BYPASS
+                    # chunks differ only in their text, the rest is encoded once
+                    template = JsonTemplate(batch[0], ('context', 'text'))
+                if cache_mode == CACHE_USE:
+                    cached, envelope = await self._read_cache(batch)
+                else:
+                    cached = [[None] * len(payload['context']['text']) for payload in batch]
+                    envelope = None
+
+                if self.job is not None:
+                    self.job.add_progress(total=len(batch))
+                for proxy_request_payload, chunk_cached in zip(batch, cached):
+                    idx += 1
+                    if self._is_cached(chunk_cached):
+                        self._chunk_completed()
+                        # the empty chunk of an empty data set has no envelope
+                        yield idx - 1, dict(envelope or {}, results=chunk_cached)
+                        continue
+                    fetches.append(gen.convert_yielded(self._fetch_chunk(
+                        proxy_request_payload, chunk_cached, template, cache_mode
+                    )))
+                    fetched.append(idx - 1)
+
+            if not fetches:
+                return
+            waiter = gen.WaitIterator(*fetches)
+            while not waiter.done():
+                chunk_response = await waiter.next()
+                self._chunk_completed()
+                yield fetched[waiter.current_index], chunk_response
+        finally:
+            self._cancel_fetches(fetches)
+
+    async def _iter_sequential_responses(self, provider_payloads, order, can_start,
+                                         cache_mode=CACHE_BYPASS):
+        """
+        Yield (chunk index, response of every provider) in order of completion.
+
+        The chunks are requested in ``order``, at most ``sequential_window`` at a
+        time and while ``can_start`` accepts the texts they send upstream. The
+        chunks in flight when the caller stops are cancelled.
+
+        :type provider_payloads: list
+        :param provider_payloads: chunk payloads of every provider
+        """
+        caches = []
+        for proxy_request_payloads in provider_payloads:
+            if cache_mode == CACHE_USE:
+                caches.append(await self._read_cache(proxy_request_payloads))
+            else:
+                caches.append(([[None] * len(payload['context']['text'])
+                                for payload in proxy_request_payloads], None))
+        templates = [JsonTemplate(proxy_request_payloads[0], ('context', 'text'))
+                     for proxy_request_payloads in provider_payloads]
+        order = iter(order)
+        pending = {}
+        try:
+            while True:
+                while len(pending) < app_settings['sequential_window']:
+                    idx = next(order, None)
+                    if idx is None:
+                        break
+                    texts = [text
+                             for proxy_request_payloads, (cached, _) in zip(provider_payloads,
+                                                                            caches)
+                             for text, value in zip(proxy_request_payloads[idx]['context']['text'],
+                                                    cached[idx])
+                             if value is None]
+                    if not can_start(texts):
+                        order = iter(())
+                        break
+                    if self.job is not None:
+                        self.job.add_progress(total=1)
+                    pending[asyncio.gather(*[
+                        self._fetch_chunk(proxy_request_payloads[idx], cached[idx], template,
+                                          cache_mode, envelope)
+                        for proxy_request_payloads, (cached, envelope), template
+                        in zip(provider_payloads, caches, templates)
+                    ])] = idx
+                if not pending:
+                    return
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    idx = pending.pop(future)
+                    chunk_responses = future.result()
+                    self._chunk_completed()
+                    yield idx, chunk_responses
+        finally:
+            for future in pending:
+                future.cancel()
+
+    def _chunk_completed(self):
+        if self.job is not None:
+            self.job.add_progress(completed=1)
+
+    @staticmethod
+    def _cancel_fetches(fetches):
+        # stop the chunks which are still running when one of them failed
+        for fetch in fetches:
+            if not fetch.done():
+                fetch.cancel()
+            elif not fetch.cancelled():
+                fetch.exception()
+
+    async def _send_request_gather_response(self, results_array, proxy_request_payloads,
+                                            cache_mode=CACHE_BYPASS):
+        logging.info('start _send_request_gather_response request %s', self.request)
+        async for idx, chunk_response in self._iter_chunk_responses(proxy_request_payloads,
+                                                                    cache_mode):
+            if idx >= len(results_array):
+                # the number of chunks of a data set stream is known at its end
+                results_array.extend([None] * (idx + 1 - len(results_array)))
+            results_array[idx] = chunk_response
 
         logging.info('gathering requests %s', self.request)
         final_result = []
@@ -161,64 +644,863 @@ class EvaluateProviderHandler(ProxyRequestMixin, ValidationMixin, RequestHandler
         logging.info('stop _send_request_gather_response request %s', self.request)
         return response_data
 
-    async def fetch_and_handle(self, proxy_request_payload, data_set):
-        results_array, proxy_request_payloads = self._split_request_in_multiple(data_set,
-                                                                                proxy_request_payload)
+    async def fetch_and_handle(self, proxy_request_payload, data_set, cache_mode=CACHE_BYPASS):
+        if isinstance(data_set, DataSetStream):
+            results_array = []
+            proxy_request_payloads = self._stream_request_payloads(data_set, proxy_request_payload)
+        else:
+            results_array, proxy_request_payloads = self._split_request_in_multiple(
+                data_set, proxy_request_payload
+            )
 
         response_data = await self._send_request_gather_response(results_array,
-                                                                 proxy_request_payloads)
+                                                                 proxy_request_payloads,
+                                                                 cache_mode)
 
         return response_data
 
-    async def post(self, *args, **kwargs):
-        logging.info('handle request %s', self.request)
-        # validate request:
-        request_payload = self.validate_request_payload(self.request.body)
+    async def _fetch_provider(self, provider_id, proxy_request_payload, data_set, cache_mode):
+        provider_payload = dict(proxy_request_payload)
+        provider_payload['service'] = dict(proxy_request_payload['service'], provider=provider_id)
+        started = time.monotonic()
+        try:
+            response_data = await self.fetch_and_handle(provider_payload, data_set, cache_mode)
+        except Exception as exc:
+            # a failing provider must not cancel the others
+            logging.info('exception during request to %s: %s %s', provider_id, exc, self.request)
+            response_data = {
+                'status': 'error',
+                'detail': getattr(exc, 'message', None) or str(exc),
+                'service': {'provider': {'id': provider_id}},
+            }
+        response_data['wall_time'] = time.monotonic() - started
+        return response_data
+
+    async def fetch_and_handle_multi(self, proxy_request_payload, data_set,
+                                     cache_mode=CACHE_BYPASS):
+        """
+        Translate the data set with every provider of the list concurrently.
+
+        :rtype: list
+        :return: response of every provider, in the order of the list
+        """
+        return await gen.multi([
+            self._fetch_provider(provider_id, proxy_request_payload, data_set, cache_mode)
+            for provider_id in proxy_request_payload['service']['provider']
+        ])
+
+    async def fetch_and_handle_sequential(self, proxy_request_payload, data_set, evaluation_type,
+                                          options, cache_mode=CACHE_BYPASS):
+        """
+        Translate and score chunks in a stratified random order until the
+        confidence interval or the budget stops the evaluation, see ``sequential``.
+
+        :return: response of the provider, or a list with the responses of both
+            providers of a pair; the translations of the lines left out are None
+        """
+        providers = proxy_request_payload['service']['provider']
+        multi = isinstance(providers, list)
+        provider_ids = providers if multi else [providers]
+        score_types = self._score_types(evaluation_type)
+        provider_payloads = []
+        for provider_id in provider_ids:
+            provider_payload = dict(proxy_request_payload)
+            provider_payload['service'] = dict(proxy_request_payload['service'],
+                                               provider=provider_id)
+            # the chunks are the units of the bootstrap, the same for both providers
+            provider_payloads.append(
+                self._split_request_in_multiple(data_set, provider_payload, self.CHUNK_SIZE)[1]
+            )
+        chunk_count = len(provider_payloads[0])
+        estimate = SequentialEstimate(score_types[0], len(provider_ids), **options)
+        order = stratified_order(chunk_count, app_settings['sequential_strata'], estimate.rng)
+        responses = self._iter_sequential_responses(provider_payloads, order, estimate.can_start,
+                                                    cache_mode)
+        translations = [[None] * len(data_set.original) for _ in provider_ids]
+        envelopes = [None] * len(provider_ids)
+        try:
+            async for idx, chunk_responses in responses:
+                start = idx * self.CHUNK_SIZE
+                lines = len(chunk_responses[0]['results'])
+                references = self._get_references(data_set, start, start + lines)
+                stats = await gen.multi([
+                    self.scoring_engine.statistics(references, chunk_response['results'],
+                                                   score_types)
+                    for chunk_response in chunk_responses
+                ])
+                for provider, chunk_response in enumerate(chunk_responses):
+                    translations[provider][start:start + lines] = chunk_response['results']
+                    envelopes[provider] = chunk_response
+                estimate.add(idx, lines, stats)
+                if estimate.should_stop(chunk_count - len(estimate.chunks)):
+                    break
+        finally:
+            await responses.aclose()
+        estimate.finish()
+        if not estimate.chunks:
+            raise tornado.web.HTTPError(400, 'The budget does not cover one chunk')
+
+        response_data = []
+        for provider, envelope in enumerate(envelopes):
+            provider_response = dict(envelope, results=translations[provider])
+            provider_response['score'] = self._format_score(evaluation_type,
+                                                            estimate.scores(provider))
+            provider_response['sequential'] = estimate.report(
+                len(data_set.original), provider, provider_ids[1 - provider] if multi else None
+            )
+            response_data.append(provider_response)
+        return response_data if multi else response_data[0]
+
+    async def fetch_and_handle_incremental(self, data_set_id, proxy_request_payload, data_set,
+                                           version, evaluation_type, cache_mode=CACHE_BYPASS,
+                                           segment_options=(False, 0)):
+        """
+        Translate and score the lines added or changed since the snapshot of the
+        last evaluation of the provider on the data set; the translations and
+        statistics of the other lines are taken from the snapshot, wherever they
+        moved. The snapshot is replaced by the one of this evaluation.
+
+        :type version: storage.DataSetVersion
+        :return: response of the provider
+        """
+        provider_id = proxy_request_payload['service']['provider']
+        score_types = self._score_types(evaluation_type)
+        snapshot = None
+        if cache_mode == CACHE_USE:
+            # refresh and bypass evaluate everything again
+            snapshot = await self.manager.load_snapshot(data_set_id, provider_id)
+        if snapshot is None:
+            matched = np.full(len(data_set.original), -1, dtype=np.int64)
+        else:
+            matched = match_lines(version.hashes, snapshot.hashes)
+        reused = np.flatnonzero(matched >= 0)
+        changed = np.flatnonzero(matched < 0)
+
+        translations = [None] * len(data_set.original)
+        for idx, previous in zip(reused.tolist(), matched[reused].tolist()):
+            translations[idx] = snapshot.translations[previous]
+        envelope = snapshot.envelope if snapshot is not None else None
+        changed_set = DataSet(original=[data_set.original[idx] for idx in changed.tolist()],
+                              translation=[data_set.translation[idx] for idx in changed.tolist()],
+                              lang_from=data_set.lang_from, lang_to=data_set.lang_to)
+        if len(changed):
+            with STAGE_SECONDS.time('upstream'):
+                response_data = await self.fetch_and_handle(proxy_request_payload, changed_set,
+                                                            cache_mode)
+            for idx, translation in zip(changed.tolist(), response_data['results']):
+                translations[idx] = translation
+            envelope = {key: value for key, value in response_data.items() if key != 'results'}
+
+        with STAGE_SECONDS.time('scoring'):
+            if snapshot is not None and all(name in snapshot.stats for name in score_types):
+                parts = [take_statistics({name: snapshot.stats[name] for name in score_types},
+                                         matched[reused])]
+                if len(changed):
+                    parts.append(await self.scoring_engine.statistics(
+                        changed_set.translation, response_data['results'], score_types
+                    ))
+                # back to the order of the lines
+                order = np.argsort(np.concatenate([reused, changed]), kind='stable')
+                stats = take_statistics(merge_statistics(parts), order)
+                scored = len(changed)
+            else:
+                stats = await self.scoring_engine.statistics(self._get_references(data_set),
+                                                             translations, score_types)
+                scored = len(translations)
+
+        response_data = dict(envelope, results=translations)
+        response_data['score'] = self._format_score(evaluation_type, corpus_scores(stats))
+        report = self._segment_report(data_set, translations, stats, segment_options)
+        if report is not None:
+            response_data['segments'] = report
+        response_data['incremental'] = {
+            'data_set_version': version.version,
+            'previous_version': snapshot.version if snapshot is not None else None,
+            'translated': len(changed),
+            'scored': scored,
+        }
+        if cache_mode != CACHE_BYPASS:
+            await self.manager.save_snapshot(data_set_id, provider_id, Snapshot(
+                version=version.version, hashes=version.hashes, translations=translations,
+                envelope=envelope, stats=stats
+            ))
+        return response_data
+
+    def _write_record(self, record):
+        self.write(json_encode(record) + b'\n')
+        return self.flush()
+
+    async def stream_and_handle(self, data_set_id, data_set, evaluation_type,
+                                proxy_request_payload, cache_mode=CACHE_BYPASS,
+                                segment_options=(False, 0)):
+        """
+        Score every chunk as soon as its translation arrives and stream NDJSON records.
+
+        Chunk records carry the translations and the score of the chunks completed so
+        far, the final record the exact corpus score.
+        """
+        score_types = self._score_types(evaluation_type)
+        results_array, proxy_request_payloads = self._split_request_in_multiple(
+            data_set, proxy_request_payload
+        )
+        starts = [0]
+        for payload in proxy_request_payloads:
+            starts.append(starts[-1] + len(payload['context']['text']))
+        chunk_stats, totals = {}, None
+        self.set_header('Content-Type', NDJSON_CONTENT_TYPE)
+        try:
+            async for idx, chunk_response in self._iter_chunk_responses(proxy_request_payloads,
+                                                                        cache_mode):
+                start = starts[idx]
+                translations = chunk_response['results']
+                chunk_stats[idx] = await self.scoring_engine.statistics(
+                    self._get_references(data_set, start, start + len(translations)),
+                    translations, score_types
+                )
+                results_array[idx] = chunk_response
+                # the running score adds the sums of the chunk, not all chunks again
+                totals = add_statistics(totals, chunk_stats[idx])
+                running_scores = summed_scores(totals)
+                await self._write_record({
+                    'type': 'chunk',
+                    'index': idx,
+                    'start': start,
+                    'completed': len(chunk_stats),
+                    'total': len(results_array),
+                    'results': translations,
+                    'score': self._format_score(evaluation_type, running_scores),
+                })
+        except tornado.httpclient.HTTPError as exc:
+            logging.info('exception during streaming request: %s %s', exc.message, self.request)
+            await self._write_record({'type': 'error', 'status': 'error', 'detail': exc.message})
+            return
+
+        stats = merge_statistics([chunk_stats[idx] for idx in range(len(results_array))])
+        response_data = results_array[0]
+        response_data['results'] = [
+            translation for chunk_response in results_array
+            for translation in chunk_response['results']
+        ]
+        response_data['score'] = self._format_score(evaluation_type, corpus_scores(stats))
+        report = self._segment_report(data_set, response_data['results'], stats, segment_options)
+        if report is not None:
+            response_data['segments'] = report
+        response_data = await self.store_result(data_set_id, response_data, data_set)
+        final_record = {key: value for key, value in response_data.items() if key != 'results'}
+        final_record['type'] = 'result'
+        await self._write_record(final_record)
+
+    def _prepare(self, request_payload, data_set):
+        return self.create_payload(data_set, request_payload)
+
+    @staticmethod
+    def _count_lines(data_set, proxy_request_payload):
+        providers = proxy_request_payload['service'].get('provider')
+        if isinstance(data_set, DataSetStream):
+            lines = data_set.estimated_lines
+        else:
+            lines = len(data_set.original)
+        return lines * (len(providers) if isinstance(providers, list) else 1)
+
+    @staticmethod
+    def _overloaded(exc):
+        logging.info('request rejected, %s', exc.reason)
+        return (503, {'Retry-After': str(exc.retry_after)},
+                {'status': 'error', 'detail': 'Overloaded, {}'.format(exc.reason)})
+
+    def _coalescing_key(self, request_payload):
+        """
+        Requests with the same key share one evaluation; None for requests which
+        must run on their own.
+        """
+        if self._get_cache_mode(request_payload) != CACHE_USE:
+            return
+        return self.coalescer.make_key(request_payload, self.request.headers.get('apikey'))
+
+    async def run_evaluation(self, request_payload):
+        """
+        :return: (status code, response headers, response data)
+        """
         # get main arguments:
         data_set_id = self._get_data_set_id(request_payload)
         evaluation_type = self._get_evaluation_type(request_payload)
-        data_set = await self.get_data_set(data_set_id)
+        cache_mode = self._get_cache_mode(request_payload)
+        segment_options = self._get_segment_options(request_payload)
+        sequential_options = self._get_sequential_options(request_payload)
+        incremental = self._is_incremental(request_payload)
+        with STAGE_SECONDS.time('data_set'):
+            if incremental:
+                data_set, version = await self.manager.get_versioned_data_set(data_set_id)
+            elif (isinstance(request_payload['service']['provider'], list)
+                    or sequential_options is not None):
+                data_set = await self.get_data_set(data_set_id)
+            else:
+                # upstream requests start while the data set is read
+                data_set = await self.manager.open_data_set(data_set_id, self.CHUNK_SIZE)
 
         # create proxy request
-        proxy_request_payload = self.create_payload(data_set, request_payload)
+        proxy_request_payload = self._prepare(request_payload, data_set)
+        multi = isinstance(proxy_request_payload['service'].get('provider'), list)
+        queued = time.monotonic()
+        try:
+            async with self.admission_controller.admit(
+                    self._count_lines(data_set, proxy_request_payload)):
+                STAGE_SECONDS.observe(time.monotonic() - queued, 'admission')
+                if sequential_options is not None:
+                    return await self.handle_sequential_evaluation(
+                        data_set_id, data_set, evaluation_type, proxy_request_payload, cache_mode,
+                        sequential_options
+                    )
+                if incremental:
+                    return await self.handle_incremental_evaluation(
+                        data_set_id, data_set, version, evaluation_type, proxy_request_payload,
+                        cache_mode, segment_options
+                    )
+                return await self.handle_evaluation(data_set_id, data_set, evaluation_type,
+                                                    proxy_request_payload, cache_mode, multi,
+                                                    segment_options)
+        except Overloaded as exc:
+            return self._overloaded(exc)
+
+    async def handle_evaluation(self, data_set_id, data_set, evaluation_type,
+                                proxy_request_payload, cache_mode, multi,
+                                segment_options=(False, 0)):
         try:
             # client = AsyncHTTPClient()
             # response = await client.fetch(self.create_proxy_request(proxy_request_payload))
             # # get proxy response
             # response_data = tornado.escape.json_decode(response.body)
             logging.info('start fetch_and_handle %s', self.request)
-            response_data = await self.fetch_and_handle(proxy_request_payload, data_set)
+            with STAGE_SECONDS.time('upstream'):
+                if multi:
+                    response_data = await self.fetch_and_handle_multi(proxy_request_payload,
+                                                                      data_set, cache_mode)
+                else:
+                    response_data = await self.fetch_and_handle(proxy_request_payload, data_set,
+                                                                cache_mode)
             logging.info('finish fetch_and_handle %s', self.request)
+            if isinstance(data_set, DataSetStream):
+                data_set = await data_set.data_set()
             # evaluate
-            proxy_response_data = self.evaluate(response_data, data_set, evaluation_type)
+            with STAGE_SECONDS.time('scoring'):
+                proxy_response_data = await self.evaluate(response_data, data_set,
+                                                          evaluation_type, segment_options)
             # save data_set_id
-            self.save_result(data_set_id, proxy_response_data)
-            # write response
-            self.write(proxy_response_data)
-            logging.info('finish handling request %s', self.request)
+            proxy_response_data = await self.store_result(data_set_id, proxy_response_data,
+                                                          data_set)
+            return 200, {}, proxy_response_data
         except tornado.httpclient.HTTPError as exc:
-            self.set_status(500)
             logging.info('exception during request: %s %s', exc.message, self.request)
-            self.write(tornado.escape.json_encode({"status": "error", "detail": exc.message}))
+            return 500, {}, {"status": "error", "detail": exc.message}
+
+    async def handle_sequential_evaluation(self, data_set_id, data_set, evaluation_type,
+                                           proxy_request_payload, cache_mode, options):
+        try:
+            response_data = await self.fetch_and_handle_sequential(
+                proxy_request_payload, data_set, evaluation_type, options, cache_mode
+            )
+            response_data = await self.store_result(data_set_id, response_data, data_set)
+            return 200, {}, response_data
+        except tornado.httpclient.HTTPError as exc:
+            logging.info('exception during sequential request: %s %s', exc.message, self.request)
+            return 500, {}, {"status": "error", "detail": exc.message}
+
+    async def handle_incremental_evaluation(self, data_set_id, data_set, version, evaluation_type,
+                                            proxy_request_payload, cache_mode,
+                                            segment_options=(False, 0)):
+        try:
+            response_data = await self.fetch_and_handle_incremental(
+                data_set_id, proxy_request_payload, data_set, version, evaluation_type,
+                cache_mode, segment_options
+            )
+            response_data = await self.store_result(data_set_id, response_data, version=version)
+            return 200, {}, response_data
+        except tornado.httpclient.HTTPError as exc:
+            logging.info('exception during incremental request: %s %s', exc.message, self.request)
+            return 500, {}, {"status": "error", "detail": exc.message}
+
+    async def run_job(self, request_payload, job):
+        """
+        The evaluation of a job, which runs after its request was answered.
+        """
+        self.job = job
+        while True:
+            outcome = await self.run_evaluation(request_payload)
+            status, headers, _ = outcome
+            if status != 503 or 'Retry-After' not in headers:
+                return outcome
+            # a job waits for capacity instead of failing
+            await gen.sleep(int(headers['Retry-After']))
+
+    async def submit_job(self, request_payload):
+        priority = int(request_payload['context'].get('priority', 0))
+        try:
+            job = await self.job_scheduler.submit(
+                functools.partial(self.run_job, request_payload), priority
+            )
+        except QueueFull as exc:
+            self.write_outcome((503, {'Retry-After': str(app_settings['admission_retry_after'])},
+                                {'status': 'error', 'detail': 'Overloaded, {}'.format(exc)}))
+            return
+        self.set_header('Location', '/jobs/{}'.format(job.id))
+        self.write_outcome((202, {}, job.to_dict()))
+
+    async def stream_request(self, request_payload):
+        data_set_id = self._get_data_set_id(request_payload)
+        evaluation_type = self._get_evaluation_type(request_payload)
+        cache_mode = self._get_cache_mode(request_payload)
+        segment_options = self._get_segment_options(request_payload)
+        with STAGE_SECONDS.time('data_set'):
+            data_set = await self.get_data_set(data_set_id)
+
+        proxy_request_payload = self._prepare(request_payload, data_set)
+        if isinstance(proxy_request_payload['service'].get('provider'), list):
+            raise tornado.web.HTTPError(400, 'Streaming supports a single provider')
+        queued = time.monotonic()
+        try:
+            async with self.admission_controller.admit(
+                    self._count_lines(data_set, proxy_request_payload)):
+                STAGE_SECONDS.observe(time.monotonic() - queued, 'admission')
+                await self.stream_and_handle(data_set_id, data_set, evaluation_type,
+                                             proxy_request_payload, cache_mode, segment_options)
+        except Overloaded as exc:
+            self.write_outcome(self._overloaded(exc))
+
+    def write_outcome(self, outcome):
+        status, headers, response_data = outcome
+        self.set_status(status)
+        for name, value in headers.items():
+            self.set_header(name, value)
+        self.set_header('Content-Type', 'application/json; charset=UTF-8')
+        self.write(json_encode(response_data))
+
+    async def post(self, *args, **kwargs):
+        logging.info('handle request %s', self.request)
+        # validate request:
+        request_payload = self.validate_request_payload(self.request.body)
+        self._get_sequential_options(request_payload)
+        self._is_incremental(request_payload)
+        if request_payload['context'].get('job'):
+            await self.submit_job(request_payload)
+            return
+        if self._is_streaming(request_payload):
+            with STAGE_SECONDS.time('total'):
+                await self.stream_request(request_payload)
+            return
+
+        key = self._coalescing_key(request_payload)
+        with STAGE_SECONDS.time('total'):
+            if key is None:
+                outcome = await self.run_evaluation(request_payload)
+            else:
+                # failed outcomes, e.g. an upstream error, are not replayed from the memo
+                outcome = await self.coalescer.run(key,
+                                                   lambda: self.run_evaluation(request_payload),
+                                                   lambda outcome: outcome[0] == 200)
+        self.write_outcome(outcome)
+        logging.info('finish handling request %s', self.request)
+
+
+class StatsHandler(RequestHandler):
+
+    def initialize(self, *args, **kwargs):
+        self.manager = kwargs.pop('data_store_manager')
+        self.scoring_engine = kwargs.pop('scoring_engine')
+        self.translation_cache = kwargs.pop('translation_cache')
+        self.upstream_client = kwargs.pop('upstream_client')
+        self.admission_controller = kwargs.pop('admission_controller')
+        self.coalescer = kwargs.pop('coalescer')
+        self.job_scheduler = kwargs.pop('job_scheduler')
+
+    def get(self, *args, **kwargs):
+        self.write({
+            'scoring': self.scoring_engine.stats(),
+            'data_set_cache': self.manager.data_set_cache.stats(),
+            'results': self.manager.results_store.stats(),
+            'translation_cache': self.translation_cache.stats(),
+            'upstream': self.upstream_client.stats(),
+            'admission': self.admission_controller.stats(),
+            'coalescing': self.coalescer.stats(),
+            'jobs': self.job_scheduler.stats(),
+        })
+
+
+class MetricsHandler(RequestHandler):
+
+    def get(self, *args, **kwargs):
+        self.set_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.write(metrics.REGISTRY.exposition())
+
+
+class ReadyHandler(RequestHandler):
+    """
+    Readiness for load balancers: 503 until the warm-up of the process is done and
+    again once it drains.
+    """
+
+    def get(self, *args, **kwargs):
+        if not self.application.ready:
+            self.set_status(503)
+        self.write({'ready': self.application.ready, 'warm_up': self.application.warm_up_report})
+
+
+class ResultsHandler(RequestHandler):
+    """
+    Read-only views of the results index, paginated with ``limit`` and ``offset``.
+    """
+
+    def initialize(self, *args, **kwargs):
+        self.manager = kwargs.pop('data_store_manager')
+
+    def _get_number(self, name, default, type_=int):
+        value = self.get_argument(name, None)
+        if value is None:
+            return default
+        try:
+            return type_(value)
+        except ValueError:
+            raise tornado.web.HTTPError(400, 'Not valid argument: {}'.format(name))
+
+    def _get_page(self):
+        limit = self._get_number('limit', app_settings['results_page_size'])
+        offset = self._get_number('offset', 0)
+        if limit < 1 or offset < 0:
+            raise tornado.web.HTTPError(400, 'Not valid page')
+        return min(limit, app_settings['results_max_page_size']), offset
+
+    def write_page(self, items, limit, offset):
+        self.write({
+            'items': items,
+            'limit': limit,
+            'offset': offset,
+            'next_offset': offset + limit if len(items) == limit else None,
+        })
+
+
+class ResultsHistoryHandler(ResultsHandler):
+
+    async def get(self, *args, **kwargs):
+        limit, offset = self._get_page()
+        items = await self.manager.results_history(
+            self.get_argument('provider'), self.get_argument('data_set_id'),
+            since=self._get_number('since', None, float),
+            until=self._get_number('until', None, float),
+            limit=limit, offset=offset,
+            data_set_version=self.get_argument('data_set_version', None),
+        )
+        self.write_page(items, limit, offset)
+
+
+class ResultsLatestHandler(ResultsHandler):
+
+    async def get(self, *args, **kwargs):
+        limit, offset = self._get_page()
+        items = await self.manager.latest_results(self.get_argument('data_set_id', None),
+                                                  limit=limit, offset=offset)
+        self.write_page(items, limit, offset)
+
+
+class LeaderboardHandler(ResultsHandler):
+
+    async def get(self, *args, **kwargs):
+        limit, offset = self._get_page()
+        try:
+            items = await self.manager.leaderboard(
+                self.get_argument('lang_from'), self.get_argument('lang_to'),
+                score_type=self.get_argument('score_type', 'bleu'), limit=limit, offset=offset,
+            )
+        except ValueError as exc:
+            raise tornado.web.HTTPError(400, str(exc))
+        self.write_page(items, limit, offset)
+
+
+class ResultHandler(ResultsHandler):
+    """
+    A stored result, with the per-segment scores left out of its response.
+    """
+
+    async def get(self, record_id, *args, **kwargs):
+        record = await self.manager.read_result(int(record_id))
+        if record is None:
+            raise tornado.web.HTTPError(404)
+        self.set_header('Content-Type', 'application/json; charset=UTF-8')
+        self.write(json_encode(record['result']))
+
+
+class JobHandler(RequestHandler):
+    """
+    State, progress and result of a job; DELETE cancels it.
+    """
+
+    def initialize(self, *args, **kwargs):
+        self.manager = kwargs.pop('data_store_manager')
+        self.job_scheduler = kwargs.pop('job_scheduler')
+
+    def write_job(self, state):
+        if state is None:
+            raise tornado.web.HTTPError(404)
+        self.set_header('Content-Type', 'application/json; charset=UTF-8')
+        self.write(json_encode(state))
+
+    async def get(self, job_id, *args, **kwargs):
+        self.write_job(await self.job_scheduler.get(job_id))
+
+    async def delete(self, job_id, *args, **kwargs):
+        if not await self.job_scheduler.cancel(job_id):
+            state = await self.manager.get_job(job_id)
+            if state is not None and state['state'] not in FINISHED:
+                # run by another process, which cancels it on its next sync
+                await self.manager.request_job_cancel(job_id)
+                self.set_status(202)
+            self.write_job(state)
+            return
+        self.write_job(await self.job_scheduler.get(job_id))
+
+
+@tornado.web.stream_request_body
+class DataSetUploadHandler(JsonErrorMixin, RequestHandler):
+    """
+    PUT a data set, ``source<TAB>reference`` lines, as the body; gzip and zstd
+    bodies are sent with their Content-Encoding. Lines are validated as the
+    body arrives, the complete data set is compiled and replaces the current one.
+    """
+    LANGUAGE_RE = re.compile(r'[A-Za-z_]+')
+
+    def initialize(self, *args, **kwargs):
+        self.manager = kwargs.pop('data_store_manager')
+        self.upload = None
+        self.error = None
+
+    def _get_language(self, name):
+        value = self.get_argument(name)
+        if not self.LANGUAGE_RE.fullmatch(value):
+            raise tornado.web.HTTPError(400, 'Not valid argument: {}'.format(name))
+        return value
+
+    async def prepare(self):
+        if self.request.method != 'PUT':
+            raise tornado.web.HTTPError(405)
+        self.request.connection.set_max_body_size(app_settings['data_set_upload_max_bytes'])
+        encoding = self.request.headers.get('Content-Encoding', 'identity')
+        try:
+            self.upload = await self.manager.start_upload(
+                self.path_args[0], self._get_language('lang_from'),
+                self._get_language('lang_to'), encoding
+            )
+        except ValueError as exc:
+            raise tornado.web.HTTPError(400, str(exc))
+
+    async def data_received(self, chunk):
+        if self.error is not None:
+            # the rest of the body is ignored
+            return
+        try:
+            await self.manager.write_upload(self.upload, chunk)
+        except ValueError as exc:
+            self.error = str(exc)
+            await self.manager.abort_upload(self.upload)
+
+    def on_connection_close(self):
+        if self.upload is not None and self.error is None:
+            self.error = 'connection closed'
+            IOLoop.current().spawn_callback(self.manager.abort_upload, self.upload)
+
+    async def put(self, data_set_id, *args, **kwargs):
+        if self.error is None:
+            try:
+                lines = await self.manager.commit_upload(self.upload)
+            except ValueError as exc:
+                self.error = str(exc)
+                await self.manager.abort_upload(self.upload)
+            self.upload = None
+        if self.error is not None:
+            raise tornado.web.HTTPError(400, 'Not valid data set, {}'.format(self.error))
+        self.set_status(201)
+        self.write({'data_set_id': int(data_set_id), 'lang_from': self.get_argument('lang_from'),
+                    'lang_to': self.get_argument('lang_to'), 'lines': lines})
 
 
 class App(Application):
-    def __init__(self):
+    def __init__(self, *args, **kwargs):
+        self.manager = kwargs.get('manager') or Manager()
+        self.scoring_engine = kwargs.get('scoring_engine') or ScoringEngine()
+        self.translation_cache = kwargs.get('translation_cache') or TranslationCache()
+        self.upstream_client = kwargs.get('upstream_client') or UpstreamClient()
+        self.admission_controller = kwargs.get('admission_controller') or AdmissionController()
+        self.coalescer = kwargs.get('coalescer') or RequestCoalescer()
+        self.job_scheduler = kwargs.get('job_scheduler') or JobScheduler(manager=self.manager)
+        metrics.REGISTRY.set_collector('app', self.collect_metrics)
+        handler_kwargs = dict(data_store_manager=self.manager, scoring_engine=self.scoring_engine,
+                              translation_cache=self.translation_cache,
+                              upstream_client=self.upstream_client,
+                              admission_controller=self.admission_controller,
+                              coalescer=self.coalescer, job_scheduler=self.job_scheduler)
         app_handlers = [
-            (EVALUATE_URL, EvaluateProviderHandler, dict(data_store_manager=Manager()))
+            (EVALUATE_URL, EvaluateProviderHandler, handler_kwargs),
+            (STATS_URL, StatsHandler, handler_kwargs),
+            (METRICS_URL, MetricsHandler),
+            (READY_URL, ReadyHandler),
+            (RESULTS_HISTORY_URL, ResultsHistoryHandler, handler_kwargs),
+            (RESULTS_LATEST_URL, ResultsLatestHandler, handler_kwargs),
+            (LEADERBOARD_URL, LeaderboardHandler, handler_kwargs),
+            (RESULT_URL, ResultHandler, handler_kwargs),
+            (JOB_URL, JobHandler, handler_kwargs),
+            (DATA_SET_URL, DataSetUploadHandler, handler_kwargs),
         ]
         super().__init__(handlers=app_handlers)
+        # set by ``warm_up``
+        self.ready = False
+        self.warm_up_report = None
+
+    def busy(self):
+        """
+        Whether evaluations or jobs are in flight.
+        """
+        jobs = self.job_scheduler.stats()
+        return bool(self.admission_controller.stats()['in_flight'] or jobs['running']
+                    or jobs['queued'] or self.scoring_engine.in_flight)
+
+    def close(self):
+        # the results queued for the writer are flushed
+        self.manager.results_store.close()
+        self.scoring_engine.shutdown()
+        self.upstream_client.close()
+
+    def collect_metrics(self):
+        """
+        Copy the counters kept by the components into the metrics registry.
+        """
+        lookups = metrics.CACHE_LOOKUPS
+        translation_cache = self.translation_cache.stats()
+        lookups.set(translation_cache['memory_hits'], 'translation', 'memory_hit')
+        lookups.set(translation_cache['disk_hits'], 'translation', 'disk_hit')
+        lookups.set(translation_cache['misses'], 'translation', 'miss')
+        data_set_cache = self.manager.data_set_cache.stats()
+        lookups.set(data_set_cache['hits'], 'data_set', 'hit')
+        lookups.set(data_set_cache['misses'], 'data_set', 'miss')
+        results = self.manager.results_store.stats()
+        lookups.set(results['aggregate_hits'], 'results', 'hit')
+        lookups.set(results['aggregate_misses'], 'results', 'miss')
+        coalescing = self.coalescer.stats()
+        lookups.set(coalescing['coalesced'] + coalescing['memo_hits'], 'coalescing', 'hit')
+        lookups.set(coalescing['executed'], 'coalescing', 'miss')
+
+        in_flight = metrics.IN_FLIGHT
+        in_flight.set(self.scoring_engine.in_flight, 'scoring')
+        in_flight.set(self.upstream_client.stats()['in_flight'], 'upstream')
+        admission = self.admission_controller.stats()
+        in_flight.set(admission['in_flight'], 'evaluations')
+        in_flight.set(admission['queued'], 'admission_queue')
+        in_flight.set(results['queued'], 'results_writer')
+        jobs = self.job_scheduler.stats()
+        in_flight.set(jobs['running'], 'jobs')
+        in_flight.set(jobs['queued'], 'jobs_queue')
+
+
+async def warm_up(app):
+    """
+    Prepare a new server process for its first requests, then report it ready: the
+    data sets of ``preload_data_sets`` are read and, with ``warm_up``, the request
+    validator is compiled, the scoring workers started and connections to the
+    providers of ``warm_up_providers`` opened. A step which fails is logged, the
+    process is ready anyway.
+    """
+    started = time.monotonic()
+    steps = {'data_sets': app.manager.preload()}
+    if app_settings['warm_up']:
+        EvaluateProviderHandler._get_validator()
+        steps['scoring_workers'] = app.scoring_engine.warm_up()
+        steps['upstream_connections'] = app.upstream_client.warm_up(
+            app_settings['warm_up_providers'], proxy_path[EVALUATE_URL]
+        )
+    names = list(steps)
+    results = await asyncio.gather(*steps.values(), return_exceptions=True)
+    report = {}
+    for name, result in zip(names, results):
+        if isinstance(result, Exception):
+            logging.error('warm-up of %s failed: %s', name, result)
+            result = None
+        report[name] = result
+    report['seconds'] = time.monotonic() - started
+    app.warm_up_report = report
+    app.ready = True
+    notify_ready()
+    logging.info('ready after %.3fs: %s', report['seconds'], report)
+
+
+def start_background_tasks(app):
+    # one scoring pool per server process, started after the fork
+    app.scoring_engine.start()
+    IOLoop.current().spawn_callback(warm_up, app)
+    metrics.REGISTRY.start()
+    # only one process compacts at a time, the others skip their turn
+    PeriodicCallback(app.manager.compact_results,
+                     app_settings['results_compaction_interval'] * 1000).start()
+    # jobs of processes which are gone are failed, old jobs deleted
+    IOLoop.current().spawn_callback(app.job_scheduler.recover)
+    PeriodicCallback(lambda: IOLoop.current().spawn_callback(app.job_scheduler.recover),
+                     app_settings['results_compaction_interval'] * 1000).start()
+    PeriodicCallback(lambda: IOLoop.current().spawn_callback(app.job_scheduler.sync),
+                     app_settings['jobs_sync_interval'] * 1000).start()
+
+
+async def drain(server, app, timeout):
+    """
+    Stop accepting connections, wait up to ``timeout`` seconds for the evaluations
+    and jobs in flight, then stop the IOLoop.
+    """
+    app.ready = False
+    server.stop()
+    deadline = time.monotonic() + timeout
+    while app.busy() and time.monotonic() < deadline:
+        await gen.sleep(0.1)
+    if app.busy():
+        logging.warning('stopping with work in flight after %ss', timeout)
+    app.close()
+    IOLoop.current().stop()
+
+
+def serve(sockets, scoring_address=None, authkey=None, manager=None):
+    """
+    HTTP server process of the production process model, see ``supervisor``.
+
+    :param manager: Manager created before the fork, with the preloaded data sets
+    """
+    io_loop = IOLoop.current()
+    app = App(manager=manager,
+              scoring_engine=ScoringEngine(address=scoring_address, authkey=authkey))
+    server = HTTPServer(app)
+    server.add_sockets(sockets)
+
+    def on_term(signum, frame):
+        io_loop.add_callback_from_signal(drain, server, app, app_settings['drain_timeout'])
+    signal.signal(signal.SIGTERM, on_term)
+    start_background_tasks(app)
+    io_loop.start()
 
 
 if __name__ == '__main__':
     port = app_settings['port']
 
     if app_settings['env'] == 'dev':
-        App().listen(port)
+        app = App()
+        app.listen(port)
+        start_background_tasks(app)
+        IOLoop.current().start()
 
     else:
-        server = HTTPServer(App())
-        server.bind(port)
-        server.start(0)
-
-    IOLoop.current().start()
\ No newline at end of file
+        sockets = bind_sockets(port)
+        scoring_address = authkey = scoring_target = None
+        if app_settings['scoring_shared']:
+            # every server process sends its scoring to one pool sized to the machine
+            scoring_address = app_settings['scoring_socket'] or os.path.join(
+                tempfile.gettempdir(), 'evaluate-scoring-{}.sock'.format(os.getpid())
+            )
+            authkey = os.urandom(32)
+            scoring_target = ScoringServer(scoring_address, authkey).serve
+        # read once, the server processes share the pages of compiled data sets
+        manager = Manager()
+        manager.load_data_sets()
+        Supervisor(functools.partial(serve, sockets, scoring_address, authkey, manager),
+                   app_settings['io_workers'], scoring_target,
+                   app_settings['drain_timeout'], app_settings['ready_timeout']).run()
@@ -0,0 +1,140 @@
+"""
+Batches of texts sent to the providers: their size, and when a failed one is retried.
+"""
+import random
+import time
+
+from settings import app_settings
+
+# the provider rejected a batch as too large, or throttled it
+TOO_LARGE = 413
+TOO_MANY_REQUESTS = 429
+# statuses after which a batch is sent again; 599 are timeouts and closed connections
+RETRY_STATUSES = (TOO_MANY_REQUESTS, 502, 503, 504, 599)
+# request bytes of a text besides its own: quotes and separator
+TEXT_OVERHEAD_BYTES = 3
+
+
+class BatchPlanner:
+    """
+    Splits the texts sent to a provider in batches under its limits on items,
+    characters and request bytes.
+
+    The number of items of a batch is adjusted online (AIMD): it grows by
+    ``increase`` items for every batch of the current size answered within
+    ``latency_target`` seconds and is multiplied by ``decrease`` after a slower
+    batch or a throttled one, at most once per ``latency_target`` seconds. A batch
+    the provider rejects as too large halves ``max_items`` for good.
+    """
+
+    def __init__(self, provider_id=None, **kwargs):
+        self.provider_id = provider_id
+        self.max_items = kwargs.get('max_items', app_settings['upstream_batch_max_items'])
+        self.max_chars = kwargs.get('max_chars', app_settings['upstream_batch_max_chars'])
+        self.max_bytes = kwargs.get('max_bytes', app_settings['upstream_batch_max_bytes'])
+        self.min_items = kwargs.get('min_items', 1)
+        self.increase = kwargs.get('increase', app_settings['upstream_batch_increase'])
+        self.decrease = kwargs.get('decrease', app_settings['upstream_batch_decrease'])
+        self.latency_target = kwargs.get('latency_target',
+                                         app_settings['upstream_batch_latency_target'])
+        self.size = float(min(kwargs.get('items') or self.max_items, self.max_items))
+        self.batches = 0
+        self.decreases = 0
+        self.throttled_batches = 0
+        self.too_large_batches = 0
+        self._decreased_at = None
+
+    @property
+    def items(self):
+        return max(self.min_items, min(int(self.size), self.max_items))
+
+    def plan(self, texts):
+        """
+        >>> BatchPlanner(items=2, max_chars=5, max_bytes=100).plan(['abc', 'de', 'fghij', 'k'])
+        [(0, 2), (2, 3), (3, 4)]
+
+        :type texts: list
+        :return: (start, stop) of consecutive batches of ``texts``; a text beyond
+            the limits on its own is a batch of its own
+        """
+        items = self.items
+        batches = []
+        start = chars = size = 0
+        for idx, text in enumerate(texts):
+            text_chars = len(text)
+            # isascii is a flag of the string, nothing is encoded for ascii texts
+            text_bytes = (text_chars if text.isascii() else len(text.encode())) + \
+                TEXT_OVERHEAD_BYTES
+            if idx > start and (idx - start >= items or chars + text_chars > self.max_chars
+                                or size + text_bytes > self.max_bytes):
+                batches.append((start, idx))
+                start, chars, size = idx, 0, 0
+            chars += text_chars
+            size += text_bytes
+        if start < len(texts):
+            batches.append((start, len(texts)))
+        return batches
+
+    def _decrease(self):
+        now = time.monotonic()
+        if self._decreased_at is not None and now - self._decreased_at < self.latency_target:
+            # the batches in flight saw the same congestion
+            return
+        self._decreased_at = now
+        self.decreases += 1
+        self.size = max(float(self.min_items), self.size * self.decrease)
+
+    def completed(self, items, latency):
+        """
+        :param items: number of texts of the batch
+        :param latency: seconds the provider took to answer it
+        """
+        self.batches += 1
+        if latency > self.latency_target:
+            self._decrease()
+        else:
+            self.size = min(float(self.max_items), self.size + self.increase * items / self.size)
+
+    def throttled(self):
+        self.throttled_batches += 1
+        self._decrease()
+
+    def too_large(self, items):
+        self.too_large_batches += 1
+        self.max_items = max(self.min_items, min(self.max_items, items // 2))
+        self.size = min(self.size, float(self.max_items))
+
+    def stats(self):
+        return {
+            'items': self.items,
+            'max_items': self.max_items,
+            'batches': self.batches,
+            'decreases': self.decreases,
+            'throttled': self.throttled_batches,
+            'too_large': self.too_large_batches,
+        }
+
+
+def retry_delay(attempt, retry_after=None):
+    """
+    Seconds before the retry ``attempt`` (0 for the first one): the Retry-After of
+    the provider, otherwise an exponential backoff with full jitter.
+    """
+    cap = app_settings['upstream_retry_backoff_max']
+    if retry_after is not None:
+        return min(retry_after, cap)
+    return random.uniform(0, min(cap, app_settings['upstream_retry_backoff'] * 2 ** attempt))
+
+
+def parse_retry_after(response):
+    """
+    :type response: tornado.httpclient.HTTPResponse or None
+    :return: seconds of the Retry-After header, None without one
+    """
+    if response is None:
+        return
+    try:
+        return max(0.0, float(response.headers.get('Retry-After', '')))
+    except ValueError:
+        # HTTP dates are not used by the providers
+        return
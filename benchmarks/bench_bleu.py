@@ -0,0 +1,78 @@
+"""
+Corpus BLEU: vectorized sufficient statistics against nltk ``corpus_bleu``.
+
+    python benchmarks/bench_bleu.py --segments 100000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from nltk.translate.bleu_score import SmoothingFunction, corpus_bleu  # noqa: E402
+
+from utils import (ReferenceNgrams, bleu_statistics, corpus_bleu_from_stats,  # noqa: E402
+                   merge_bleu_stats, sentence_bleu_from_stats, tokenize)
+
+
+def generate_corpus(segments, vocabulary=20000, seed=0):
+    rnd = random.Random(seed)
+    words = ['w{}'.format(i) for i in range(vocabulary)]
+    references, hypothesis = [], []
+    for _ in range(segments):
+        reference = rnd.choices(words, k=rnd.randint(5, 40))
+        hyp = [word if rnd.random() < 0.7 else rnd.choice(words) for word in reference]
+        references.append(' '.join(reference))
+        hypothesis.append(' '.join(hyp))
+    return references, hypothesis
+
+
+def timed(fn, *args):
+    started = time.perf_counter()
+    result = fn(*args)
+    return time.perf_counter() - started, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--segments', type=int, default=100000)
+    parser.add_argument('--shard-size', type=int, default=10000)
+    parser.add_argument('--skip-nltk', action='store_true')
+    args = parser.parse_args()
+
+    references, hypothesis = generate_corpus(args.segments)
+    ref_tokens, hyp_tokens = tokenize(references), tokenize(hypothesis)
+
+    elapsed_refs, reference_ngrams = timed(ReferenceNgrams, ref_tokens)
+    elapsed_stats, stats = timed(bleu_statistics, hyp_tokens, reference_ngrams)
+    elapsed_corpus, score = timed(corpus_bleu_from_stats, stats)
+    elapsed_sentences, _ = timed(sentence_bleu_from_stats, stats)
+    print('segments:             {}'.format(args.segments))
+    print('reference n-grams:    {:.3f}s'.format(elapsed_refs))
+    print('hypothesis stats:     {:.3f}s'.format(elapsed_stats))
+    print('corpus bleu:          {:.6f}s  {:.6f}'.format(elapsed_corpus, score))
+    print('sentence bleu (all):  {:.3f}s'.format(elapsed_sentences))
+
+    def sharded():
+        return merge_bleu_stats([
+            bleu_statistics(hyp_tokens[start:start + args.shard_size],
+                            reference_ngrams.slice(start, start + args.shard_size))
+            for start in range(0, args.segments, args.shard_size)
+        ])
+    elapsed_sharded, sharded_stats = timed(sharded)
+    print('sharded stats:        {:.3f}s  {:.6f}'.format(
+        elapsed_sharded, corpus_bleu_from_stats(sharded_stats)))
+
+    if not args.skip_nltk:
+        elapsed_nltk, expected = timed(
+            corpus_bleu, [[ref] for ref in ref_tokens], hyp_tokens, (0.25, 0.25, 0.25, 0.25),
+            SmoothingFunction().method4
+        )
+        print('nltk corpus_bleu:     {:.3f}s  {:.6f}'.format(elapsed_nltk, expected))
+        print('difference:           {:.3e}'.format(abs(expected - score)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+"""
+Helpers shared by the benchmarks: percentiles, memory of a process tree and
+stored runs which later runs are compared against.
+"""
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCHMARKS_DIR)
+RESULTS_DIR = os.path.join(BENCHMARKS_DIR, 'results')
+
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+# metrics where a larger value is an improvement, all others should shrink
+HIGHER_IS_BETTER = ('requests_per_second', 'lines_per_second')
+
+
+def percentile(values, q):
+    """
+    Nearest-rank percentile, ``q`` in [0, 100].
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * q // 100))
+    return ordered[min(int(rank), len(ordered)) - 1]
+
+
+def _children():
+    children = {}
+    for name in os.listdir('/proc'):
+        if not name.isdigit():
+            continue
+        try:
+            with open('/proc/{}/stat'.format(name)) as fd:
+                stat = fd.read()
+        except OSError:
+            continue
+        # the command name is in parentheses and may contain spaces
+        ppid = int(stat[stat.rindex(')') + 2:].split()[1])
+        children.setdefault(ppid, []).append(int(name))
+    return children
+
+
+def tree_rss(pid):
+    """
+    Resident memory of a process and all its descendants, in bytes (Linux only).
+    """
+    children = _children()
+    total, pending = 0, [pid]
+    while pending:
+        current = pending.pop()
+        pending.extend(children.get(current, []))
+        try:
+            with open('/proc/{}/status'.format(current)) as fd:
+                for line in fd:
+                    if line.startswith('VmRSS:'):
+                        total += int(line.split()[1]) * 1024
+        except OSError:
+            continue
+    return total
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def save_run(kind, name, params, metrics, results_dir=RESULTS_DIR):
+    """
+    Store a run as ``<results_dir>/<kind>-<name>-<time>.json``.
+
+    :return: path of the stored run
+    """
+    now = datetime.datetime.now(datetime.timezone.utc)
+    run = {
+        'kind': kind,
+        'name': name,
+        'time': now.isoformat(),
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'params': params,
+        'metrics': metrics,
+    }
+    os.makedirs(results_dir, exist_ok=True)
+    path = os.path.join(results_dir, '{}-{}-{}.json'.format(kind, name,
+                                                            now.strftime('%Y%m%dT%H%M%S')))
+    with open(path, 'w') as fd:
+        json.dump(run, fd, indent=1, sort_keys=True)
+    return path
+
+
+def latest_run(kind, name, exclude=None, results_dir=RESULTS_DIR):
+    """
+    Path of the most recent stored run of a benchmark, if any.
+    """
+    if not os.path.isdir(results_dir):
+        return
+    prefix = '{}-{}-'.format(kind, name)
+    paths = sorted(
+        os.path.join(results_dir, file_name) for file_name in os.listdir(results_dir)
+        if file_name.startswith(prefix) and file_name.endswith('.json')
+    )
+    paths = [path for path in paths if path != exclude]
+    return paths[-1] if paths else None
+
+
+def compare(metrics, baseline_path, threshold=0.1):
+    """
+    Print the change of every metric against a stored run.
+
+    :return: names of the metrics which got worse by more than ``threshold``
+    """
+    with open(baseline_path) as fd:
+        baseline = json.load(fd)
+    print('compared to {} ({})'.format(os.path.basename(baseline_path), baseline['revision']))
+    regressions = []
+    for name, value in sorted(metrics.items()):
+        previous = baseline['metrics'].get(name)
+        if not isinstance(value, (int, float)) or not isinstance(previous, (int, float)) \
+                or not previous:
+            continue
+        change = (value - previous) / previous
+        worse = -change if name in HIGHER_IS_BETTER else change
+        flag = ''
+        if worse > threshold:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        print('  {:<28} {:>14.6g} -> {:<14.6g} {:+.1%}{}'.format(name, previous, value, change,
+                                                                 flag))
+    return regressions
+
+
+def report(metrics):
+    for name, value in sorted(metrics.items()):
+        if isinstance(value, float):
+            print('{:<30} {:.6g}'.format(name, value))
+        else:
+            print('{:<30} {}'.format(name, value))
@@ -0,0 +1,78 @@
+"""
+Local stand-in for a translation provider, for load tests.
+
+It answers the requests the service sends to ``PROXY_URL`` after a configurable
+latency, fails a share of them and returns translations of a configurable size:
+
+    python benchmarks/fake_provider.py --port 9100 --latency 0.05 --jitter 0.01
+    PROXY_URL=http://127.0.0.1:9100/translate python app.py
+"""
+import argparse
+import logging
+import random
+
+import tornado.escape
+import tornado.web
+from tornado import gen
+from tornado.ioloop import IOLoop
+
+
+class FakeProviderHandler(tornado.web.RequestHandler):
+
+    def initialize(self, latency=0.0, jitter=0.0, error_rate=0.0, response_size=0, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.response_size = response_size
+        self.random = self.application.settings.setdefault('random', random.Random(seed))
+
+    def _translate(self, text):
+        if not self.response_size:
+            # echoing the source keeps the score meaningful
+            return text
+        text = (text or 'x') + ' '
+        return (text * (self.response_size // len(text) + 1))[:self.response_size]
+
+    async def post(self):
+        payload = tornado.escape.json_decode(self.request.body)
+        delay = self.latency + self.random.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            await gen.sleep(delay)
+        if self.random.random() < self.error_rate:
+            raise tornado.web.HTTPError(500)
+        self.write({
+            'results': [self._translate(text) for text in payload['context']['text']],
+            'meta': {},
+            'service': {'provider': {'id': payload['service']['provider'], 'name': 'Fake'}},
+        })
+
+
+def make_app(**kwargs):
+    """
+    :param kwargs: latency, jitter (seconds), error_rate, response_size (characters
+        per segment, 0 echoes the text) and seed
+    """
+    return tornado.web.Application([('/translate', FakeProviderHandler, kwargs)])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fake translation provider.')
+    parser.add_argument('--port', type=int, default=9100)
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds per request')
+    parser.add_argument('--jitter', type=float, default=0.0,
+                        help='seconds, the latency varies uniformly by up to this much')
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--response-size', type=int, default=0,
+                        help='characters per translated segment, 0 echoes the source')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    make_app(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+             response_size=args.response_size, seed=args.seed).listen(args.port)
+    logging.info('fake provider listening on %s', args.port)
+    IOLoop.current().start()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    main()
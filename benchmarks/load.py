@@ -0,0 +1,202 @@
+"""
+Load test of the evaluation endpoint against the fake provider.
+
+Starts the fake provider and the service in a scratch directory with a generated
+data set, sends evaluation requests from ``--concurrency`` clients and reports
+requests per second, latency percentiles and the peak memory of the service
+and its child processes. The run is stored in ``benchmarks/results`` and
+compared with the previous run of the same name:
+
+    python benchmarks/load.py --mode dev --size 1k --requests 200
+    python benchmarks/load.py --mode multi --size 100k --concurrency 16
+"""
+import argparse
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from common import (BENCHMARKS_DIR, REPO_ROOT, compare, latest_run, percentile, report,
+                    save_run, tree_rss)
+from generate_data_sets import SIZES, write_data_set
+
+import tornado.escape
+from tornado import gen
+from tornado.httpclient import AsyncHTTPClient, HTTPClientError
+from tornado.ioloop import IOLoop
+
+DATA_SET_ID = 1
+EVALUATE_PATH = '/ai/text/evaluate_provider'
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, process, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError('process exited with {}'.format(process.returncode))
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError('port {} did not open in {}s'.format(port, timeout))
+
+
+def stop(process):
+    # the service runs in its own session, forked servers and scoring workers included
+    if process.poll() is None:
+        os.killpg(process.pid, signal.SIGTERM)
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            os.killpg(process.pid, signal.SIGKILL)
+            process.wait()
+
+
+class RssSampler(threading.Thread):
+    """
+    Samples the memory of a process tree until stopped, keeping the peak.
+    """
+
+    def __init__(self, pid, interval=0.2):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.peak = 0
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.is_set():
+            self.peak = max(self.peak, tree_rss(self.pid))
+            self._stopped.wait(self.interval)
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+
+async def drive(url, body, requests, concurrency, timeout):
+    client = AsyncHTTPClient(force_instance=True, max_clients=concurrency)
+    latencies, errors = [], 0
+    remaining = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for _ in remaining:
+            started = time.monotonic()
+            try:
+                await client.fetch(url, method='POST', body=body, request_timeout=timeout)
+            except (HTTPClientError, OSError):
+                errors += 1
+                continue
+            latencies.append(time.monotonic() - started)
+
+    started = time.monotonic()
+    await gen.multi([worker() for _ in range(concurrency)])
+    elapsed = time.monotonic() - started
+    client.close()
+    return latencies, errors, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test of the evaluation endpoint.')
+    parser.add_argument('--mode', choices=('dev', 'multi'), default='dev',
+                        help='one process, or one process per CPU (server.start(0))')
+    parser.add_argument('--size', choices=sorted(SIZES), default='1k')
+    parser.add_argument('--requests', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--warmup', type=int, default=2, help='requests before measuring')
+    parser.add_argument('--timeout', type=float, default=300)
+    parser.add_argument('--cache', choices=('use', 'bypass', 'refresh'), default='bypass',
+                        help='translation cache mode of the requests')
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--jitter', type=float, default=0.01)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--response-size', type=int, default=0)
+    parser.add_argument('--name', help='name of the stored run, derived from the options')
+    parser.add_argument('--baseline', help='stored run to compare with, the previous one if unset')
+    parser.add_argument('--threshold', type=float, default=0.1)
+    parser.add_argument('--keep', action='store_true', help='keep the scratch directory')
+    args = parser.parse_args()
+    name = args.name or '{}-{}-c{}'.format(args.mode, args.size, args.concurrency)
+
+    workdir = tempfile.mkdtemp(prefix='evaluate-load-')
+    write_data_set(os.path.join(workdir, 'data_set'), DATA_SET_ID, SIZES[args.size])
+    provider_port, app_port = free_port(), free_port()
+    env = dict(os.environ, APP_PORT=str(app_port),
+               ENV='dev' if args.mode == 'dev' else 'production',
+               PROXY_URL='http://127.0.0.1:{}/translate'.format(provider_port),
+               METRICS_DIR=os.path.join(workdir, 'metrics'))
+
+    processes = []
+    try:
+        provider = subprocess.Popen([
+            sys.executable, os.path.join(BENCHMARKS_DIR, 'fake_provider.py'),
+            '--port', str(provider_port), '--latency', str(args.latency),
+            '--jitter', str(args.jitter), '--error-rate', str(args.error_rate),
+            '--response-size', str(args.response_size),
+        ], cwd=workdir, env=env, stderr=subprocess.DEVNULL, start_new_session=True)
+        processes.append(provider)
+        app = subprocess.Popen([sys.executable, os.path.join(REPO_ROOT, 'app.py')],
+                               cwd=workdir, env=env, stderr=subprocess.DEVNULL,
+                               start_new_session=True)
+        processes.append(app)
+        wait_for_port(provider_port, provider)
+        wait_for_port(app_port, app)
+
+        url = 'http://127.0.0.1:{}{}'.format(app_port, EVALUATE_PATH)
+        body = tornado.escape.json_encode({
+            'context': {'data_set_id': str(DATA_SET_ID), 'score_type': 'bleu',
+                        'cache': args.cache},
+            'service': {'provider': 'fake.provider'},
+        })
+        loop = IOLoop.current()
+        if args.warmup:
+            loop.run_sync(lambda: drive(url, body, args.warmup, 1, args.timeout))
+
+        sampler = RssSampler(app.pid)
+        sampler.start()
+        latencies, errors, elapsed = loop.run_sync(
+            lambda: drive(url, body, args.requests, args.concurrency, args.timeout)
+        )
+        sampler.stop()
+    finally:
+        for process in reversed(processes):
+            stop(process)
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    metrics = {
+        'requests': args.requests,
+        'errors': errors,
+        'requests_per_second': len(latencies) / elapsed if elapsed else 0.0,
+        'lines_per_second': len(latencies) * SIZES[args.size] / elapsed if elapsed else 0.0,
+        'latency_p50': percentile(latencies, 50),
+        'latency_p95': percentile(latencies, 95),
+        'latency_p99': percentile(latencies, 99),
+        'latency_max': max(latencies) if latencies else None,
+        'peak_rss_mb': sampler.peak / 1024 ** 2,
+    }
+    report(metrics)
+    params = {key: value for key, value in vars(args).items()
+              if key not in ('name', 'baseline', 'threshold', 'keep')}
+    path = save_run('load', name, params, metrics)
+    print('stored in {}'.format(path))
+    baseline = args.baseline or latest_run('load', name, exclude=path)
+    if baseline and compare(metrics, baseline, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""
+Micro-benchmarks of the hot functions: ``utils.score_translation``,
+``Manager.get_data_set`` (from disk and from its cache) and ``utils.split``.
+
+The best time of ``--repeat`` runs is reported and stored in
+``benchmarks/results``, then compared with the previous run of the same name:
+
+    python benchmarks/micro.py --lines 100000
+"""
+import argparse
+import shutil
+import sys
+import tempfile
+import time
+
+from common import compare, latest_run, report, save_run
+from generate_data_sets import generate_pairs, write_data_set
+
+from tornado.ioloop import IOLoop
+
+from storage import DefaultStorage, Manager
+from utils import score_translation, split
+
+
+def best_of(repeat, fn, *args):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn(*args)
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Micro-benchmarks.')
+    parser.add_argument('--lines', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--chunk-size', type=int, default=100)
+    parser.add_argument('--name', default='default')
+    parser.add_argument('--baseline', help='stored run to compare with, the previous one if unset')
+    parser.add_argument('--threshold', type=float, default=0.1)
+    args = parser.parse_args()
+
+    sources, references = zip(*generate_pairs(args.lines))
+    sources, references = list(sources), list(references)
+    workdir = tempfile.mkdtemp(prefix='evaluate-micro-')
+    try:
+        write_data_set(workdir, 1, args.lines)
+        storage = DefaultStorage(data_set_base_path=workdir, results_base_path=workdir)
+        loop = IOLoop.current()
+
+        def load_cold():
+            manager = Manager(storage=storage, cache_max_lines=0)
+            loop.run_sync(lambda: manager.get_data_set(1))
+
+        cached = Manager(storage=storage)
+        loop.run_sync(lambda: cached.get_data_set(1))
+
+        def load_cached():
+            loop.run_sync(lambda: cached.get_data_set(1))
+
+        metrics = {
+            'score_translation_seconds': best_of(args.repeat, score_translation, references,
+                                                 sources),
+            'get_data_set_cold_seconds': best_of(args.repeat, load_cold),
+            'get_data_set_cached_seconds': best_of(args.repeat, load_cached),
+            'split_seconds': best_of(args.repeat, split, sources, args.chunk_size),
+        }
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report(metrics)
+    path = save_run('micro', args.name, vars(args), metrics)
+    print('stored in {}'.format(path))
+    baseline = args.baseline or latest_run('micro', args.name, exclude=path)
+    if baseline and compare(metrics, baseline, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+"""
+Cold start of the service: import time of ``app`` and the time from starting the
+process to its first evaluation.
+
+The import is timed in ``--repeat`` fresh interpreters, the best time is reported
+with the modules which take longest (``python -X importtime``). Then the service
+is started against the fake provider with a preloaded data set, and the time until
+the port opens, until ``GET /ready`` answers 200 and until the first evaluation
+returns is measured, with the latency of the first and the second evaluation. The
+run is stored in ``benchmarks/results`` and compared with the previous run of the
+same name:
+
+    python benchmarks/startup.py --mode dev --size 100k
+    WARM_UP=0 python benchmarks/startup.py --name no-warm-up
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from common import BENCHMARKS_DIR, REPO_ROOT, compare, latest_run, report, save_run
+from generate_data_sets import SIZES, write_data_set
+from load import DATA_SET_ID, EVALUATE_PATH, free_port, stop, wait_for_port
+
+import tornado.escape
+from tornado.httpclient import HTTPClient, HTTPClientError
+
+READY_PATH = '/ready'
+IMPORT_SCRIPT = 'import time; started = time.perf_counter(); import app; ' \
+                'print(time.perf_counter() - started)'
+
+
+def import_seconds(repeat):
+    timings = []
+    for _ in range(repeat):
+        output = subprocess.check_output([sys.executable, '-c', IMPORT_SCRIPT], cwd=REPO_ROOT)
+        timings.append(float(output.decode().split()[-1]))
+    return min(timings)
+
+
+def slowest_imports(count):
+    """
+    :return: (cumulative seconds, module) of the ``count`` slowest imports of ``app``
+    """
+    output = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app'],
+                            cwd=REPO_ROOT, stdout=subprocess.DEVNULL,
+                            stderr=subprocess.PIPE, check=True).stderr.decode()
+    imports = []
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # nested imports are indented by two spaces per level under the one which
+        # triggered them, the imports of app are one level deep
+        if len(name) - len(name.lstrip()) == 3:
+            imports.append((int(cumulative) / 1e6, name.strip()))
+    return sorted(imports, reverse=True)[:count]
+
+
+def wait_until_ready(url, process, timeout):
+    client = HTTPClient()
+    deadline = time.monotonic() + timeout
+    try:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError('process exited with {}'.format(process.returncode))
+            try:
+                client.fetch(url, request_timeout=1)
+                return
+            except HTTPClientError as exc:
+                if exc.code != 503:
+                    raise
+            except OSError:
+                pass
+            time.sleep(0.01)
+    finally:
+        client.close()
+    raise RuntimeError('not ready in {}s'.format(timeout))
+
+
+def evaluate(url, body, timeout):
+    client = HTTPClient()
+    started = time.monotonic()
+    try:
+        client.fetch(url, method='POST', body=body, request_timeout=timeout)
+    finally:
+        client.close()
+    return time.monotonic() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Import time and time to first request.')
+    parser.add_argument('--mode', choices=('dev', 'multi'), default='dev',
+                        help='one process, or the supervisor with its processes')
+    parser.add_argument('--size', choices=sorted(SIZES), default='1k')
+    parser.add_argument('--repeat', type=int, default=5, help='interpreters the import is timed in')
+    parser.add_argument('--slowest', type=int, default=5, help='slowest imports to show')
+    parser.add_argument('--timeout', type=float, default=300)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--name', help='name of the stored run, derived from the options')
+    parser.add_argument('--baseline', help='stored run to compare with, the previous one if unset')
+    parser.add_argument('--threshold', type=float, default=0.1)
+    parser.add_argument('--keep', action='store_true', help='keep the scratch directory')
+    args = parser.parse_args()
+    name = args.name or '{}-{}'.format(args.mode, args.size)
+
+    metrics = {'import_app_seconds': import_seconds(args.repeat)}
+    for seconds, module in slowest_imports(args.slowest):
+        print('import {:<24} {:.6f}s'.format(module, seconds))
+
+    workdir = tempfile.mkdtemp(prefix='evaluate-startup-')
+    write_data_set(os.path.join(workdir, 'data_set'), DATA_SET_ID, SIZES[args.size])
+    provider_port, app_port = free_port(), free_port()
+    env = dict(os.environ, APP_PORT=str(app_port),
+               ENV='dev' if args.mode == 'dev' else 'production',
+               PROXY_URL='http://127.0.0.1:{}/translate'.format(provider_port),
+               METRICS_DIR=os.path.join(workdir, 'metrics'),
+               PRELOAD_DATA_SETS=str(DATA_SET_ID), WARM_UP_PROVIDERS='fake.provider')
+
+    processes = []
+    try:
+        provider = subprocess.Popen([
+            sys.executable, os.path.join(BENCHMARKS_DIR, 'fake_provider.py'),
+            '--port', str(provider_port), '--latency', str(args.latency), '--jitter', '0',
+        ], cwd=workdir, env=env, stderr=subprocess.DEVNULL, start_new_session=True)
+        processes.append(provider)
+        wait_for_port(provider_port, provider)
+
+        started = time.monotonic()
+        app = subprocess.Popen([sys.executable, os.path.join(REPO_ROOT, 'app.py')],
+                               cwd=workdir, env=env, stderr=subprocess.DEVNULL,
+                               start_new_session=True)
+        processes.append(app)
+        wait_for_port(app_port, app, args.timeout)
+        metrics['listen_seconds'] = time.monotonic() - started
+        base_url = 'http://127.0.0.1:{}'.format(app_port)
+        wait_until_ready(base_url + READY_PATH, app, args.timeout)
+        metrics['ready_seconds'] = time.monotonic() - started
+
+        body = tornado.escape.json_encode({
+            'context': {'data_set_id': str(DATA_SET_ID), 'score_type': 'bleu',
+                        'cache': 'bypass'},
+            'service': {'provider': 'fake.provider'},
+        })
+        metrics['first_request_seconds'] = evaluate(base_url + EVALUATE_PATH, body, args.timeout)
+        metrics['time_to_first_request_seconds'] = time.monotonic() - started
+        metrics['second_request_seconds'] = evaluate(base_url + EVALUATE_PATH, body,
+                                                     args.timeout)
+    finally:
+        for process in reversed(processes):
+            stop(process)
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report(metrics)
+    params = {key: value for key, value in vars(args).items()
+              if key not in ('name', 'baseline', 'threshold', 'keep', 'slowest')}
+    params['warm_up'] = os.environ.get('WARM_UP', '1') == '1'
+    path = save_run('startup', name, params, metrics)
+    print('stored in {}'.format(path))
+    baseline = args.baseline or latest_run('startup', name, exclude=path)
+    if baseline and compare(metrics, baseline, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+import hashlib
+import json
+import time
+
+from tornado.concurrent import Future
+
+from settings import app_settings
+
+
+class RequestCoalescer:
+    """
+    Single-flight execution of identical requests.
+
+    Requests with the same key which arrive while one of them is running wait for
+    its result instead of running again. With ``memo_ttl`` a successful result is
+    also reused for that many seconds after it completed; a failure is only shared
+    with the requests which waited for it.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.memo_ttl = kwargs.get('memo_ttl', app_settings['coalescing_memo_ttl'])
+        self.executed = 0
+        self.coalesced = 0
+        self.memo_hits = 0
+        self._in_flight = {}
+        self._memo = {}
+
+    @staticmethod
+    def make_key(payload, *extra):
+        """
+        :param payload: decoded request payload, key order does not matter
+        :param extra: other values the result depends on, e.g. the api key
+        """
+        canonical = json.dumps([payload, extra], sort_keys=True, separators=(',', ':'))
+        return hashlib.sha256(canonical.encode()).hexdigest()
+
+    def _purge(self, now):
+        expired = [key for key, (expires, _) in self._memo.items() if expires <= now]
+        for key in expired:
+            del self._memo[key]
+
+    async def run(self, key, factory, succeeded=None):
+        """
+        :param factory: callable returning the awaitable which computes the result
+        :param succeeded: callable telling whether a result may be memoised, all
+            results are by default
+        """
+        now = time.monotonic()
+        memo = self._memo.get(key)
+        if memo is not None and memo[0] > now:
+            self.memo_hits += 1
+            return memo[1]
+
+        future = self._in_flight.get(key)
+        if future is not None:
+            self.coalesced += 1
+            return await future
+
+        future = self._in_flight[key] = Future()
+        self.executed += 1
+        try:
+            result = await factory()
+        except Exception as exc:
+            future.set_exception(exc)
+            # nobody else may be waiting for it
+            future.exception()
+            raise
+        except BaseException:
+            future.cancel()
+            raise
+        finally:
+            del self._in_flight[key]
+
+        future.set_result(result)
+        if self.memo_ttl and (succeeded is None or succeeded(result)):
+            now = time.monotonic()
+            self._purge(now)
+            self._memo[key] = (now + self.memo_ttl, result)
+        return result
+
+    def stats(self):
+        return {
+            'in_flight': len(self._in_flight),
+            'memo_entries': len(self._memo),
+            'executed': self.executed,
+            'coalesced': self.coalesced,
+            'memo_hits': self.memo_hits,
+        }
@@ -0,0 +1,240 @@
+"""
+Binary data set format which is memory-mapped instead of parsed.
+
+A compiled file sits next to the ``<from>-<to>.txt`` it was built from, as
+``<from>-<to>.bin``. It holds a header followed by 8-byte aligned sections:
+line offsets and UTF-8 blobs for the source and reference columns and,
+optionally, the reference token ids with their vocabulary. Forked server
+processes mapping the same file share its pages.
+
+    python compiled_data_set.py 1 2 3
+"""
+import argparse
+import array
+import logging
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+
+import numpy as np
+
+from utils import ReferenceNgrams, tokenize
+
+COMPILED_EXT = '.bin'
+MAGIC = b'DSET'
+VERSION = 1
+SECTIONS = ('source_offsets', 'source', 'reference_offsets', 'reference',
+            'token_offsets', 'token_ids', 'vocab_offsets', 'vocab')
+HEADER = struct.Struct('<4sIQ' + 'QQ' * len(SECTIONS))
+# line offsets, in the byte order numpy reads them in
+OFFSET = struct.Struct('=Q')
+# array type of the uint32 token ids
+TOKEN_ID_TYPE = 'I'
+ALIGNMENT = 8
+
+
+class MappedColumn:
+    """
+    Read-only sequence of strings stored as offsets into a UTF-8 blob.
+
+    Slicing returns another column over the same buffers, in O(1).
+    """
+
+    def __init__(self, offsets, blob):
+        self._offsets = offsets
+        self._blob = blob
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            start, stop, step = idx.indices(len(self))
+            if step != 1:
+                return [self[i] for i in range(start, stop, step)]
+            return MappedColumn(self._offsets[start:max(start, stop) + 1], self._blob)
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError('column index out of range')
+        return str(self._blob[self._offsets[idx]:self._offsets[idx + 1]], 'utf-8')
+
+    def __iter__(self):
+        offsets = self._offsets.tolist()
+        blob = self._blob
+        for start, stop in zip(offsets, offsets[1:]):
+            yield str(blob[start:stop], 'utf-8')
+
+
+def _encode_column(values):
+    encoded = [value.encode() for value in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.uint64)
+    np.cumsum([len(value) for value in encoded], out=offsets[1:])
+    return offsets, b''.join(encoded)
+
+
+class CompiledWriter:
+    """
+    Writes a compiled data set line by line: every section is appended to a file
+    of ``staging_dir`` as the lines arrive and ``finish`` joins them, so only the
+    vocabulary of the references is held in memory.
+    """
+    STREAMED = SECTIONS[:6]
+
+    def __init__(self, staging_dir, with_tokens=True):
+        self.staging_dir = staging_dir
+        self.with_tokens = with_tokens
+        self.lines = 0
+        self._vocab = {}
+        self._ends = {'source': 0, 'reference': 0, 'token_ids': 0}
+        self._files = {name: open(os.path.join(staging_dir, name), 'w+b')
+                       for name in self.STREAMED}
+        for name in ('source_offsets', 'reference_offsets', 'token_offsets'):
+            self._files[name].write(OFFSET.pack(0))
+
+    def _append(self, column, data, size=None):
+        self._files[column].write(data)
+        self._ends[column] += len(data) if size is None else size
+        self._files[column + '_offsets'].write(OFFSET.pack(self._ends[column]))
+
+    def add(self, source, reference):
+        """
+        :type source: str
+        :type reference: str
+        """
+        self._append('source', source.encode())
+        self._append('reference', reference.encode())
+        if self.with_tokens:
+            tokens = tokenize((reference,))[0]
+            vocab = self._vocab
+            ids = array.array(TOKEN_ID_TYPE, [vocab.setdefault(token, len(vocab))
+                                              for token in tokens])
+            self._files['token_ids'].write(ids.tobytes())
+            self._ends['token_ids'] += len(tokens)
+            self._files['token_offsets'].write(OFFSET.pack(self._ends['token_ids']))
+        self.lines += 1
+
+    def finish(self, path):
+        """
+        Write the compiled file to ``path``, replacing it at once.
+
+        :return: path
+        """
+        sections = [self._files[name] for name in self.STREAMED]
+        if self.with_tokens:
+            vocab_offsets, vocab = _encode_column(self._vocab)
+            sections += [vocab_offsets.tobytes(), vocab]
+        else:
+            sections = sections[:4] + [b''] * 4
+        sizes = [len(section) if isinstance(section, bytes) else section.tell()
+                 for section in sections]
+
+        layout = []
+        position = HEADER.size
+        for size in sizes:
+            position += -position % ALIGNMENT
+            layout += [position, size]
+            position += size
+
+        # hidden until it is complete, the data set directory is listed by the readers
+        temporary_path = os.path.join(os.path.dirname(path),
+                                      '.{}.tmp'.format(os.path.basename(path)))
+        with open(temporary_path, 'wb') as fd:
+            fd.write(HEADER.pack(MAGIC, VERSION, self.lines, *layout))
+            for section, offset in zip(sections, layout[::2]):
+                fd.write(b'\0' * (offset - fd.tell()))
+                if isinstance(section, bytes):
+                    fd.write(section)
+                else:
+                    section.seek(0)
+                    shutil.copyfileobj(section, fd)
+        os.replace(temporary_path, path)
+        self.close()
+        return path
+
+    def close(self):
+        for fd in self._files.values():
+            fd.close()
+
+
+def write_compiled(path, pairs, with_tokens=True):
+    """
+    Write (source, reference) pairs to ``path`` in the compiled format.
+
+    :type path: str
+    :type pairs: iterable
+    :type with_tokens: bool
+    :param with_tokens: also store token ids of the references
+    """
+    # next to the compiled file, hidden from the readers of its directory
+    with tempfile.TemporaryDirectory(prefix='.compile-', dir=os.path.dirname(path)) as staging:
+        writer = CompiledWriter(staging, with_tokens)
+        try:
+            for source, reference in pairs:
+                writer.add(source, reference)
+            return writer.finish(path)
+        finally:
+            writer.close()
+
+
+class CompiledDataSet:
+    """
+    Memory-mapped compiled data set.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as fd:
+            self._mmap = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+        buffer = memoryview(self._mmap)
+        magic, version, self.lines, *layout = HEADER.unpack_from(buffer)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('not a compiled data set: {}'.format(path))
+        self._sections = {
+            name: buffer[offset:offset + size]
+            for name, offset, size in zip(SECTIONS, layout[::2], layout[1::2])
+        }
+        self.original = MappedColumn(self._array('source_offsets', np.uint64),
+                                     self._sections['source'])
+        self.translation = MappedColumn(self._array('reference_offsets', np.uint64),
+                                        self._sections['reference'])
+
+    def _array(self, name, dtype):
+        return np.frombuffer(self._sections[name], dtype=dtype)
+
+    def __len__(self):
+        return self.lines
+
+    @property
+    def has_tokens(self):
+        return len(self._sections['token_offsets']) > 0
+
+    def reference_ngrams(self):
+        """
+        :rtype: utils.ReferenceNgrams
+        """
+        if not self.has_tokens:
+            return ReferenceNgrams(tokenize(self.translation))
+        vocab = MappedColumn(self._array('vocab_offsets', np.uint64), self._sections['vocab'])
+        lengths = np.diff(self._array('token_offsets', np.uint64)).astype(np.int64)
+        return ReferenceNgrams.from_ids(self._array('token_ids', np.uint32), lengths, list(vocab))
+
+
+def main():
+    from storage import DefaultStorage
+
+    parser = argparse.ArgumentParser(description='Compile data sets to the memory-mapped format.')
+    parser.add_argument('data_set_ids', nargs='+')
+    parser.add_argument('--no-tokens', action='store_true',
+                        help='do not store reference token ids')
+    args = parser.parse_args()
+
+    storage = DefaultStorage()
+    for data_set_id in args.data_set_ids:
+        path = storage.compile(data_set_id, with_tokens=not args.no_tokens)
+        logging.info('compiled data set %s: %s', data_set_id, path)
+
+
+if __name__ == '__main__':
+    main()
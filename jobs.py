@@ -0,0 +1,243 @@
+"""
+Evaluation jobs: the client gets a job id at once and polls for the result,
+instead of holding the connection open while a large data set is evaluated.
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import time
+import uuid
+
+from settings import app_settings
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+FINISHED = (DONE, FAILED, CANCELLED)
+
+
+class QueueFull(Exception):
+    pass
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class Job:
+    """
+    State of a job, as it is persisted and returned to the client.
+    """
+
+    def __init__(self, priority=0, **state):
+        self.id = state.get('id') or uuid.uuid4().hex
+        self.priority = priority
+        self.state = state.get('state', QUEUED)
+        # the process which runs the job
+        self.pid = state.get('pid', os.getpid())
+        self.created = state.get('created', time.time())
+        self.started = state.get('started')
+        self.finished = state.get('finished')
+        self.completed_chunks = state.get('completed_chunks', 0)
+        self.total_chunks = state.get('total_chunks', 0)
+        self.status_code = state.get('status_code')
+        self.result = state.get('result')
+        self.detail = state.get('detail')
+
+    def add_progress(self, completed=0, total=0):
+        self.completed_chunks += completed
+        self.total_chunks += total
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'priority': self.priority,
+            'state': self.state,
+            'pid': self.pid,
+            'created': self.created,
+            'started': self.started,
+            'finished': self.finished,
+            'completed_chunks': self.completed_chunks,
+            'total_chunks': self.total_chunks,
+            'progress': self.completed_chunks / self.total_chunks if self.total_chunks else 0.0,
+            'status_code': self.status_code,
+            'result': self.result,
+            'detail': self.detail,
+        }
+
+
+class JobScheduler:
+    """
+    Runs the jobs of a server process in the background, highest priority first
+    and at most ``max_concurrent`` at a time.
+
+    Every change of state is persisted through the manager, so any server process
+    can report a job, and finished jobs outlive a restart. A job is cancelled by
+    the process which runs it; the others leave a cancellation request which is
+    picked up by ``sync``.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.manager = kwargs.get('manager')
+        self.max_concurrent = kwargs.get('max_concurrent', app_settings['jobs_max_concurrent'])
+        self.max_queue = kwargs.get('max_queue', app_settings['jobs_max_queue'])
+        self.retention = kwargs.get('retention', app_settings['jobs_retention'])
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.jobs = {}
+        self._queue = []
+        self._sequence = itertools.count()
+        self._tasks = {}
+
+    async def _persist(self, job):
+        if self.manager is not None:
+            await self.manager.save_job(job.to_dict())
+
+    def _queued(self):
+        return sum(1 for job in self.jobs.values() if job.state == QUEUED)
+
+    async def submit(self, runner, priority=0):
+        """
+        :param runner: coroutine function called with the job, returns
+            (status code, headers, response data) like an evaluation
+        :rtype: Job
+        :raises QueueFull: when ``max_queue`` jobs are waiting already
+        """
+        if self._queued() >= self.max_queue:
+            raise QueueFull('{} jobs queued'.format(self.max_queue))
+        job = Job(priority=priority)
+        self.jobs[job.id] = job
+        self.submitted += 1
+        await self._persist(job)
+        heapq.heappush(self._queue, (-priority, next(self._sequence), job.id, runner))
+        self._dispatch()
+        return job
+
+    def _dispatch(self):
+        while self._queue and len(self._tasks) < self.max_concurrent:
+            _, _, job_id, runner = heapq.heappop(self._queue)
+            job = self.jobs.get(job_id)
+            if job is None or job.state != QUEUED:
+                # cancelled while it was waiting
+                continue
+            self._tasks[job_id] = asyncio.ensure_future(self._run(job, runner))
+
+    async def _run(self, job, runner):
+        job.state = RUNNING
+        job.started = time.time()
+        try:
+            await self._persist(job)
+            job.status_code, _, job.result = await runner(job)
+            if job.status_code < 400:
+                job.state = DONE
+            else:
+                job.state = FAILED
+                job.detail = (job.result or {}).get('detail')
+        except asyncio.CancelledError:
+            job.state = CANCELLED
+        except Exception as exc:
+            logging.exception('job failed: %s', job.id)
+            job.state = FAILED
+            job.detail = str(exc)
+        finally:
+            del self._tasks[job.id]
+            await self._finish(job)
+            self._dispatch()
+
+    async def _finish(self, job):
+        job.finished = time.time()
+        if job.state == DONE:
+            self.completed += 1
+        elif job.state == FAILED:
+            self.failed += 1
+        else:
+            self.cancelled += 1
+        await self._persist(job)
+        # the persisted state is reported from now on
+        self.jobs.pop(job.id, None)
+
+    async def get(self, job_id):
+        """
+        :rtype: dict or None
+        """
+        job = self.jobs.get(job_id)
+        if job is not None:
+            return job.to_dict()
+        if self.manager is not None:
+            return await self.manager.get_job(job_id)
+
+    async def cancel(self, job_id):
+        """
+        Cancel a job of this process, with its upstream requests in flight; a job
+        which already finished is left as it is.
+
+        :return: False if the job does not run in this process
+        """
+        job = self.jobs.get(job_id)
+        if job is None:
+            return False
+        if job.state == QUEUED:
+            job.state = CANCELLED
+            await self._finish(job)
+        elif job.state not in FINISHED:
+            # the task is gone once the job finished, before its state is persisted
+            task = self._tasks.get(job_id)
+            if task is not None:
+                task.cancel()
+        return True
+
+    async def sync(self):
+        """
+        Persist the progress of the running jobs and act on cancellation requests
+        left by other processes.
+        """
+        if self.manager is None:
+            return
+        for job in list(self.jobs.values()):
+            if self.manager.job_cancel_requested(job.id):
+                await self.cancel(job.id)
+            elif job.state == RUNNING:
+                await self._persist(job)
+
+    async def recover(self):
+        """
+        Fail the jobs whose process is gone, and delete finished jobs older than
+        ``retention`` seconds. A job does not survive its process: its client
+        submits it again.
+        """
+        now = time.time()
+        for state in await self.manager.list_jobs():
+            if state['state'] in FINISHED:
+                if self.retention and state['finished'] < now - self.retention:
+                    await self.manager.delete_job(state['id'])
+            elif state['id'] not in self.jobs and (state['pid'] == os.getpid()
+                                                   or not _process_alive(state['pid'])):
+                # the pid of this process may have been the pid of the one before
+                job = Job(**state)
+                job.state = FAILED
+                job.finished = now
+                job.detail = 'Interrupted by a restart'
+                await self._persist(job)
+
+    def stats(self):
+        return {
+            'max_concurrent': self.max_concurrent,
+            'running': len(self._tasks),
+            'queued': self._queued(),
+            'submitted': self.submitted,
+            'completed': self.completed,
+            'failed': self.failed,
+            'cancelled': self.cancelled,
+        }
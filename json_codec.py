@@ -0,0 +1,79 @@
+"""
+JSON encoding and decoding with orjson when it is installed, the standard
+library otherwise. Both return and accept UTF-8 bytes.
+"""
+import json
+import logging
+import uuid
+
+from settings import app_settings
+
+
+def _default(value):
+    # numpy scalars and arrays from the scoring code
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    raise TypeError('Object of type {} is not JSON serializable'.format(type(value).__name__))
+
+
+class JsonCodec:
+
+    def __init__(self, backend='auto'):
+        self._orjson = None
+        if backend in ('auto', 'orjson'):
+            try:
+                import orjson
+                self._orjson = orjson
+            except ImportError:
+                if backend == 'orjson':
+                    logging.warning('orjson is not installed, using json')
+        self.backend = 'orjson' if self._orjson is not None else 'json'
+
+    def decode(self, data):
+        """
+        :type data: bytes or str
+        :raises json.JSONDecodeError: also for orjson, whose error subclasses it
+        """
+        if self._orjson is not None:
+            return self._orjson.loads(data)
+        return json.loads(data)
+
+    def encode(self, value):
+        """
+        :rtype: bytes
+        """
+        if self._orjson is not None:
+            return self._orjson.dumps(value, default=_default,
+                                      option=self._orjson.OPT_NON_STR_KEYS)
+        return json.dumps(value, default=_default, ensure_ascii=False,
+                          separators=(',', ':')).encode()
+
+
+codec = JsonCodec(app_settings['json_backend'])
+json_decode = codec.decode
+json_encode = codec.encode
+
+
+def _with_value(document, path, value):
+    # copies the containers along the path, the document is not changed
+    if not path:
+        return value
+    return dict(document, **{path[0]: _with_value(document[path[0]], path[1:], value)})
+
+
+class JsonTemplate:
+    """
+    JSON document which is encoded once; the value at ``path`` is encoded and
+    spliced in by every ``render``.
+    """
+
+    def __init__(self, document, path):
+        marker = uuid.uuid4().hex
+        encoded = json_encode(_with_value(document, path, marker))
+        self.prefix, self.suffix = encoded.split(json_encode(marker), 1)
+
+    def render(self, value):
+        """
+        :rtype: bytes
+        """
+        return b''.join((self.prefix, json_encode(value), self.suffix))
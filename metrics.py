@@ -0,0 +1,336 @@
+"""
+Counters, gauges and histograms exposed in the Prometheus text format.
+
+Values are plain numbers updated in place on the IOLoop thread, so recording
+costs a dict lookup and a bisect. Every forked server process periodically
+writes a snapshot of its registry to ``metrics_dir``; ``/metrics`` served by any
+of them merges its own values with the snapshots of the other live processes.
+"""
+import bisect
+import json
+import logging
+import math
+import os
+import time
+
+from tornado.ioloop import IOLoop, PeriodicCallback
+
+from settings import app_settings
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+                   math.inf)
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (
+        '{}="{}"'.format(name, str(value).replace('\\', r'\\').replace('"', r'\"')
+                         .replace('\n', r'\n'))
+        for name, value in pairs
+    )
+    return '{' + ','.join(escaped) + '}'
+
+
+class Metric:
+    type_ = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+
+    def snapshot(self):
+        return {
+            'type': self.type_,
+            'help': self.documentation,
+            'labelnames': self.labelnames,
+            'values': [[list(labels), value] for labels, value in self.values.items()],
+        }
+
+    @staticmethod
+    def merge(values, value):
+        return values + value
+
+
+class Counter(Metric):
+    type_ = 'counter'
+
+    def inc(self, *labels, amount=1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def set(self, value, *labels):
+        # for totals which are counted elsewhere and collected at scrape time
+        self.values[labels] = value
+
+    def lines(self, values):
+        for labels, value in values.items():
+            yield '{}{} {}'.format(self.name, _format_labels(self.labelnames, labels),
+                                   _format_value(value))
+
+
+class Gauge(Metric):
+    """
+    Summed over the processes, or the largest value of them with ``aggregate='max'``.
+    """
+    type_ = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), aggregate='sum'):
+        super().__init__(name, documentation, labelnames)
+        self.aggregate = aggregate
+
+    def set(self, value, *labels):
+        self.values[labels] = value
+
+    def merge(self, values, value):
+        return max(values, value) if self.aggregate == 'max' else values + value
+
+    def lines(self, values):
+        for labels, value in values.items():
+            yield '{}{} {}'.format(self.name, _format_labels(self.labelnames, labels),
+                                   _format_value(value))
+
+
+class Timer:
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.histogram.observe(time.monotonic() - self.started, *self.labels)
+
+
+class Histogram(Metric):
+    type_ = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        if self.buckets[-1] != math.inf:
+            self.buckets += (math.inf,)
+
+    def observe(self, value, *labels):
+        entry = self.values.get(labels)
+        if entry is None:
+            entry = self.values[labels] = [[0] * len(self.buckets), 0.0]
+        entry[0][bisect.bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+
+    def time(self, *labels):
+        """
+        :return: context manager observing the time spent in its block
+        """
+        return Timer(self, labels)
+
+    def snapshot(self):
+        result = super().snapshot()
+        result['buckets'] = [_format_value(bound) for bound in self.buckets]
+        return result
+
+    @staticmethod
+    def merge(values, value):
+        return [[a + b for a, b in zip(values[0], value[0])], values[1] + value[1]]
+
+    def lines(self, values):
+        for labels, (counts, total) in values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                yield '{}_bucket{} {}'.format(
+                    self.name,
+                    _format_labels(self.labelnames, labels, [('le', _format_value(bound))]),
+                    cumulative
+                )
+            yield '{}_sum{} {}'.format(self.name, _format_labels(self.labelnames, labels),
+                                       _format_value(total))
+            yield '{}_count{} {}'.format(self.name, _format_labels(self.labelnames, labels),
+                                         cumulative)
+
+
+class Registry:
+
+    def __init__(self, *args, **kwargs):
+        self.directory = kwargs.get('directory', app_settings['metrics_dir'])
+        self.metrics = {}
+        self.collectors = {}
+        self._flush = None
+
+    def _register(self, metric):
+        registered = self.metrics.setdefault(metric.name, metric)
+        if type(registered) is not type(metric):
+            raise ValueError('metric {} is already registered as a {}'.format(
+                metric.name, registered.type_
+            ))
+        return registered
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=(), aggregate='sum'):
+        return self._register(Gauge(name, documentation, labelnames, aggregate))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def set_collector(self, name, collector):
+        """
+        :param collector: called before every snapshot, to copy values which are
+            kept elsewhere, e.g. the stats of the caches
+        """
+        self.collectors[name] = collector
+
+    def snapshot(self):
+        for name, collector in list(self.collectors.items()):
+            try:
+                collector()
+            except Exception:
+                logging.exception('metrics collector %s failed', name)
+        return {name: metric.snapshot() for name, metric in self.metrics.items()}
+
+    def _snapshot_path(self, pid):
+        return os.path.join(self.directory, '{}.json'.format(pid))
+
+    def write_snapshot(self):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._snapshot_path(os.getpid())
+        with open(path + '.tmp', 'w') as fd:
+            json.dump(self.snapshot(), fd)
+        os.replace(path + '.tmp', path)
+
+    def _other_snapshots(self):
+        if not self.directory or not os.path.isdir(self.directory):
+            return
+        for file_name in os.listdir(self.directory):
+            pid, ext = os.path.splitext(file_name)
+            if ext != '.json' or not pid.isdigit() or int(pid) == os.getpid():
+                continue
+            try:
+                os.kill(int(pid), 0)
+            except ProcessLookupError:
+                # the process is gone, so are its values
+                os.remove(os.path.join(self.directory, file_name))
+                continue
+            except PermissionError:
+                pass
+            try:
+                with open(os.path.join(self.directory, file_name)) as fd:
+                    yield json.load(fd)
+            except (OSError, ValueError):
+                continue
+
+    def collect(self):
+        """
+        :return: values of every metric by labels, merged over the processes
+        """
+        merged = {}
+        for snapshot in [self.snapshot(), *self._other_snapshots()]:
+            for name, data in snapshot.items():
+                metric = self.metrics.get(name)
+                if metric is None:
+                    continue
+                values = merged.setdefault(name, {})
+                for labels, value in data['values']:
+                    labels = tuple(labels)
+                    if labels in values:
+                        values[labels] = metric.merge(values[labels], value)
+                    else:
+                        values[labels] = value
+        return merged
+
+    def exposition(self):
+        """
+        :rtype: str
+        :return: all metrics in the Prometheus text format
+        """
+        lines = []
+        for name, values in sorted(self.collect().items()):
+            metric = self.metrics[name]
+            lines.append('# HELP {} {}'.format(name, metric.documentation))
+            lines.append('# TYPE {} {}'.format(name, metric.type_))
+            lines.extend(metric.lines(values))
+        return '\n'.join(lines) + '\n'
+
+    def start(self):
+        """
+        Write snapshots periodically and measure the IOLoop lag; called in every
+        process after the fork.
+        """
+        if self._flush is None:
+            self._flush = PeriodicCallback(self.write_snapshot,
+                                           app_settings['metrics_flush_interval'] * 1000)
+            self._flush.start()
+            LoopLagMonitor(app_settings['ioloop_lag_interval']).start()
+
+
+class LoopLagMonitor:
+    """
+    Schedules a callback every ``interval`` seconds and records how late it runs.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._expected = None
+
+    def start(self):
+        loop = IOLoop.current()
+        self._expected = loop.time() + self.interval
+        loop.call_at(self._expected, self._tick)
+
+    def _tick(self):
+        loop = IOLoop.current()
+        lag = max(0.0, loop.time() - self._expected)
+        IOLOOP_LAG_SECONDS.observe(lag)
+        IOLOOP_LAG_LAST.set(lag)
+        self._expected = loop.time() + self.interval
+        loop.call_at(self._expected, self._tick)
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    'evaluation_stage_seconds', 'Time spent in each stage of an evaluation.', ['stage']
+)
+UPSTREAM_SECONDS = REGISTRY.histogram(
+    'upstream_request_seconds', 'Latency of chunk requests to the providers.',
+    ['provider', 'status']
+)
+UPSTREAM_WAIT_SECONDS = REGISTRY.histogram(
+    'upstream_wait_seconds', 'Time chunk requests wait for a free slot of their provider.',
+    ['provider']
+)
+UPSTREAM_CHUNK_BYTES = REGISTRY.histogram(
+    'upstream_chunk_bytes', 'Size of the chunk requests sent to the providers.', ['provider'],
+    buckets=(1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+)
+SCORING_QUEUE_SECONDS = REGISTRY.histogram(
+    'scoring_queue_seconds', 'Time scoring tasks wait for a worker of the pool.'
+)
+SCORING_TASK_SECONDS = REGISTRY.histogram(
+    'scoring_task_seconds', 'Time scoring tasks run in a worker of the pool.'
+)
+IOLOOP_LAG_SECONDS = REGISTRY.histogram(
+    'ioloop_lag_seconds', 'Delay of callbacks scheduled on the IOLoop.',
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+)
+IOLOOP_LAG_LAST = REGISTRY.gauge(
+    'ioloop_lag_last_seconds', 'Latest IOLoop delay, of the slowest process.', aggregate='max'
+)
+CACHE_LOOKUPS = REGISTRY.counter(
+    'cache_lookups_total', 'Lookups of the caches by result.', ['cache', 'result']
+)
+IN_FLIGHT = REGISTRY.gauge(
+    'in_flight', 'Work in progress by component.', ['component']
+)
@@ -0,0 +1,443 @@
+import collections
+import concurrent.futures
+import fcntl
+import itertools
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+from settings import app_settings
+from utils import get_scorer
+
+SEGMENTS_DIR = 'segments'
+INDEX_NAME = 'index.sqlite'
+COMPACTION_LOCK_NAME = 'compaction.lock'
+
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS results ('
+    'id INTEGER PRIMARY KEY AUTOINCREMENT, provider TEXT, data_set_id TEXT, timestamp REAL, '
+    'score_type TEXT, score REAL, lang_from TEXT, lang_to TEXT, '
+    'segment TEXT, offset INTEGER, length INTEGER, data_set_version TEXT)',
+    'CREATE INDEX IF NOT EXISTS results_key ON results (provider, data_set_id, timestamp)',
+    'CREATE INDEX IF NOT EXISTS results_language ON results (lang_from, lang_to, score_type)',
+    'CREATE TABLE IF NOT EXISTS segments (name TEXT PRIMARY KEY, sealed INTEGER, size INTEGER)',
+    # bumped by every change of the results, cached aggregates are checked against it
+    'CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER)',
+    "INSERT OR IGNORE INTO meta VALUES ('version', 0)",
+)
+BUMP_VERSION = "UPDATE meta SET value = value + 1 WHERE key = 'version'"
+# added to indexes created before data set versions were recorded
+MIGRATIONS = (
+    ('data_set_version', 'ALTER TABLE results ADD COLUMN data_set_version TEXT'),
+)
+SUMMARY_COLUMNS = ('id', 'provider', 'data_set_id', 'timestamp', 'score_type', 'score',
+                   'data_set_version')
+# the most recent result of every provider, data set and score type
+LATEST_RESULTS = (
+    'SELECT id, provider, data_set_id, timestamp, score_type, score, data_set_version FROM ('
+    'SELECT *, ROW_NUMBER() OVER (PARTITION BY provider, data_set_id, score_type '
+    'ORDER BY timestamp DESC, id DESC) AS position FROM results WHERE {}'
+    ') WHERE position = 1'
+)
+
+
+def connect_index(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    connection = sqlite3.connect(path, timeout=30)
+    connection.execute('PRAGMA journal_mode=WAL')
+    for statement in SCHEMA:
+        connection.execute(statement)
+    columns = {row[1] for row in connection.execute('PRAGMA table_info(results)')}
+    for column, statement in MIGRATIONS:
+        if column not in columns:
+            try:
+                connection.execute(statement)
+            except sqlite3.OperationalError:
+                # added by another process in the meantime
+                pass
+    connection.commit()
+    return connection
+
+
+class ResultsStore:
+    """
+    Evaluation results as JSON lines appended to segment files, with a SQLite
+    index keyed by (provider, data set id, timestamp).
+
+    Appends are written by a background thread which batches them, so one fsync
+    and one index transaction cover many results. Every process writes its own
+    segments, they are sealed when they reach ``segment_max_bytes`` and
+    ``compact`` rewrites sealed segments which are mostly dead.
+
+    History, latest and leaderboard queries are answered from the index alone and
+    cached until the results change.
+    """
+    AGGREGATE_CACHE_ENTRIES = 1024
+
+    def __init__(self, *args, **kwargs):
+        self.path = kwargs.get('path', app_settings['results_path'])
+        self.segment_max_bytes = kwargs.get('segment_max_bytes',
+                                            app_settings['results_segment_max_bytes'])
+        self.flush_interval = kwargs.get('flush_interval', app_settings['results_flush_interval'])
+        self.batch_size = kwargs.get('batch_size', app_settings['results_batch_size'])
+        self.segments_path = os.path.join(self.path, SEGMENTS_DIR)
+        self.index_path = os.path.join(self.path, INDEX_NAME)
+        self._queue = queue.Queue()
+        self._writer = None
+        self._writer_pid = None
+        self._segment = None
+        self._segment_name = None
+        self._lock = threading.Lock()
+        self._sequence = itertools.count()
+        self._local = threading.local()
+        self._aggregates = collections.OrderedDict()
+        self.aggregate_hits = 0
+        self.aggregate_misses = 0
+        self.written = 0
+        self.batches = 0
+        self.errors = 0
+
+    def _start(self):
+        # the thread does not survive a fork, every process starts its own
+        with self._lock:
+            if self._writer is None or self._writer_pid != os.getpid():
+                os.makedirs(self.segments_path, exist_ok=True)
+                self._queue = queue.Queue()
+                self._segment = None
+                self._writer_pid = os.getpid()
+                self._writer = threading.Thread(target=self._run, name='results-writer',
+                                                daemon=True)
+                self._writer.start()
+
+    def append_many(self, records):
+        """
+        :type records: list
+        :param records: dicts with ``provider``, ``data_set_id`` and ``timestamp``, optionally
+            ``score_type``, ``score``, ``lang_from`` and ``lang_to``, or ``scores`` by score
+            type instead of ``score_type`` and ``score``; written as they are
+        :rtype: concurrent.futures.Future
+        :return: resolves to the ids of the records once they are durable, the id of the
+            first score of records with several
+        """
+        self._start()
+        future = concurrent.futures.Future()
+        self._queue.put((records, future))
+        return future
+
+    def close(self):
+        if self._writer is not None and self._writer_pid == os.getpid():
+            self._queue.put(None)
+            self._writer.join()
+            self._writer = None
+
+    def _run(self):
+        connection = connect_index(self.index_path)
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get(timeout=max(0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            try:
+                ids = self._write_batch(connection, [records for records, _ in batch])
+            except Exception as exc:
+                logging.exception('cannot write results')
+                self.errors += len(batch)
+                for _, future in batch:
+                    future.set_exception(exc)
+                continue
+            self.written += sum(map(len, ids))
+            self.batches += 1
+            for (_, future), batch_ids in zip(batch, ids):
+                future.set_result(batch_ids)
+        self._seal(connection)
+        connection.close()
+
+    def _segment_file_name(self, suffix=''):
+        # unique among processes, and sorted by creation time
+        return '{:013d}-{}-{}{}.log'.format(int(time.time() * 1000), os.getpid(),
+                                            next(self._sequence), suffix)
+
+    def _open_segment(self, connection):
+        self._segment_name = self._segment_file_name()
+        self._segment = open(os.path.join(self.segments_path, self._segment_name), 'ab')
+        with connection:
+            connection.execute('INSERT INTO segments VALUES (?, 0, 0)', (self._segment_name,))
+
+    def _seal(self, connection):
+        if self._segment is None:
+            return
+        size = self._segment.tell()
+        self._segment.close()
+        self._segment = None
+        with connection:
+            connection.execute('UPDATE segments SET sealed = 1, size = ? WHERE name = ?',
+                               (size, self._segment_name))
+
+    def _write_batch(self, connection, batch):
+        if self._segment is not None and self._segment.tell() >= self.segment_max_bytes:
+            self._seal(connection)
+        if self._segment is None:
+            self._open_segment(connection)
+
+        rows = []
+        for records in batch:
+            for record in records:
+                line = json.dumps(record, ensure_ascii=False).encode() + b'\n'
+                rows.append((record, self._segment.tell(), len(line)))
+                self._segment.write(line)
+        self._segment.flush()
+        os.fsync(self._segment.fileno())
+
+        ids = []
+        with connection:
+            for record, offset, length in rows:
+                # one index row per score, all of them pointing to the same line
+                scores = record.get('scores') or {record.get('score_type'): record.get('score')}
+                row_ids = [
+                    connection.execute(
+                        'INSERT INTO results (provider, data_set_id, timestamp, score_type, '
+                        'score, lang_from, lang_to, segment, offset, length, data_set_version) '
+                        'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                        (record['provider'], str(record['data_set_id']), record['timestamp'],
+                         score_type, score, record.get('lang_from'), record.get('lang_to'),
+                         self._segment_name, offset, length, record.get('data_set_version'))
+                    ).lastrowid
+                    for score_type, score in scores.items()
+                ]
+                ids.append(row_ids[0])
+            connection.execute('UPDATE segments SET size = ? WHERE name = ?',
+                               (self._segment.tell(), self._segment_name))
+            connection.execute(BUMP_VERSION)
+
+        result, position = [], 0
+        for records in batch:
+            result.append(ids[position:position + len(records)])
+            position += len(records)
+        return result
+
+    def _read(self, segment, offset, length):
+        with open(os.path.join(self.segments_path, segment), 'rb') as fd:
+            fd.seek(offset)
+            return json.loads(fd.read(length).decode())
+
+    def _reader(self):
+        # one connection per thread and process
+        if getattr(self._local, 'pid', None) != os.getpid():
+            self._local.connection = connect_index(self.index_path)
+            self._local.pid = os.getpid()
+        return self._local.connection
+
+    def get(self, record_id):
+        """
+        :rtype: dict or None
+        """
+        row = self._reader().execute('SELECT segment, offset, length FROM results WHERE id = ?',
+                                     (record_id,)).fetchone()
+        if row is None:
+            return
+        return self._read(*row)
+
+    def query(self, provider, data_set_id, since=None, until=None, limit=None):
+        """
+        Records of a provider and data set, oldest first.
+
+        :rtype: list
+        """
+        rows = self._reader().execute(
+            'SELECT segment, offset, length FROM results '
+            'WHERE provider = ? AND data_set_id = ? AND timestamp >= ? AND timestamp <= ? '
+            'GROUP BY segment, offset ORDER BY timestamp, MIN(id) LIMIT ?',
+            (provider, str(data_set_id), since or 0, until or float('inf'), limit or -1)
+        ).fetchall()
+        return [self._read(*row) for row in rows]
+
+    def delete(self, record_ids):
+        connection = self._reader()
+        with connection:
+            # with the other scores of the same record
+            connection.executemany('DELETE FROM results WHERE (segment, offset) IN '
+                                   '(SELECT segment, offset FROM results WHERE id = ?)',
+                                   [(record_id,) for record_id in record_ids])
+            connection.execute(BUMP_VERSION)
+
+    def _aggregate(self, key, compute):
+        connection = self._reader()
+        version = connection.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()[0]
+        with self._lock:
+            entry = self._aggregates.get(key)
+            if entry is not None and entry[0] == version:
+                self._aggregates.move_to_end(key)
+                self.aggregate_hits += 1
+                return entry[1]
+            self.aggregate_misses += 1
+        result = compute(connection)
+        with self._lock:
+            self._aggregates[key] = (version, result)
+            self._aggregates.move_to_end(key)
+            while len(self._aggregates) > self.AGGREGATE_CACHE_ENTRIES:
+                self._aggregates.popitem(last=False)
+        return result
+
+    def history(self, provider, data_set_id, since=None, until=None, limit=100, offset=0,
+                data_set_version=None):
+        """
+        Scores of a provider on a data set, oldest first.
+
+        :param data_set_version: only the scores of this version of the data set
+        :rtype: list
+        :return: dicts with id, provider, data_set_id, timestamp, score_type, score and
+            data_set_version
+        """
+        def compute(connection):
+            condition, parameters = '', ()
+            if data_set_version is not None:
+                condition, parameters = ' AND data_set_version = ?', (data_set_version,)
+            rows = connection.execute(
+                'SELECT {} FROM results '
+                'WHERE provider = ? AND data_set_id = ? AND timestamp >= ? AND timestamp <= ?{} '
+                'ORDER BY timestamp, id LIMIT ? OFFSET ?'.format(', '.join(SUMMARY_COLUMNS),
+                                                                 condition),
+                (provider, str(data_set_id), since or 0, until or float('inf')) + parameters +
+                (limit, offset)
+            )
+            return [dict(zip(SUMMARY_COLUMNS, row)) for row in rows]
+
+        return self._aggregate(
+            ('history', provider, str(data_set_id), since, until, limit, offset, data_set_version),
+            compute
+        )
+
+    def latest(self, data_set_id=None, limit=100, offset=0):
+        """
+        The most recent score of every provider, per data set and score type.
+
+        :rtype: list
+        """
+        def compute(connection):
+            if data_set_id is None:
+                condition, parameters = '1', ()
+            else:
+                condition, parameters = 'data_set_id = ?', (str(data_set_id),)
+            rows = connection.execute(
+                LATEST_RESULTS.format(condition) +
+                ' ORDER BY data_set_id, provider, score_type LIMIT ? OFFSET ?',
+                parameters + (limit, offset)
+            )
+            return [dict(zip(SUMMARY_COLUMNS, row)) for row in rows]
+
+        return self._aggregate(('latest', data_set_id and str(data_set_id), limit, offset),
+                               compute)
+
+    def leaderboard(self, lang_from, lang_to, score_type='bleu', limit=10, offset=0):
+        """
+        Providers of a language pair ranked by the mean of their latest scores on
+        its data sets, best first.
+
+        :rtype: list
+        :return: dicts with provider, score, data_sets and timestamp of the latest result
+        :raises ValueError: for an unknown score type
+        """
+        order = 'ASC' if get_scorer(score_type).lower_is_better else 'DESC'
+
+        def compute(connection):
+            rows = connection.execute(
+                'SELECT provider, AVG(score) AS mean, COUNT(*), MAX(timestamp) FROM ({}) '
+                'GROUP BY provider ORDER BY mean {}, provider LIMIT ? OFFSET ?'.format(
+                    LATEST_RESULTS.format('lang_from = ? AND lang_to = ? AND score_type = ? '
+                                          'AND score IS NOT NULL'),
+                    order
+                ),
+                (lang_from, lang_to, score_type, limit, offset)
+            )
+            return [dict(zip(('provider', 'score', 'data_sets', 'timestamp'), row))
+                    for row in rows]
+
+        return self._aggregate(('leaderboard', lang_from, lang_to, score_type, limit, offset),
+                               compute)
+
+    def compact(self, min_live_ratio=0.5, max_age=None):
+        """
+        Drop records older than ``max_age`` seconds and rewrite the sealed segments
+        whose live records take less than ``min_live_ratio`` of their size.
+
+        Only one process compacts at a time, the others return None.
+
+        :return: names of the rewritten segments
+        """
+        os.makedirs(self.segments_path, exist_ok=True)
+        with open(os.path.join(self.path, COMPACTION_LOCK_NAME), 'w') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return
+            return self._compact(self._reader(), min_live_ratio, max_age)
+
+    def _compact(self, connection, min_live_ratio, max_age):
+        if max_age:
+            with connection:
+                connection.execute('DELETE FROM results WHERE timestamp < ?',
+                                   (time.time() - max_age,))
+                connection.execute(BUMP_VERSION)
+        segments = connection.execute(
+            'SELECT s.name, s.size, COALESCE(SUM(r.length), 0) FROM segments s '
+            'LEFT JOIN (SELECT DISTINCT segment, offset, length FROM results) r '
+            'ON r.segment = s.name WHERE s.sealed = 1 GROUP BY s.name'
+        ).fetchall()
+        compacted = []
+        for name, size, live in segments:
+            if size and live / size >= min_live_ratio:
+                continue
+            self._rewrite(connection, name, live)
+            compacted.append(name)
+        return compacted
+
+    def _rewrite(self, connection, name, live):
+        rows = connection.execute(
+            'SELECT DISTINCT offset, length FROM results WHERE segment = ? ORDER BY offset',
+            (name,)
+        ).fetchall()
+        new_name = None
+        if rows:
+            new_name = self._segment_file_name('-compacted')
+            updates = []
+            with open(os.path.join(self.segments_path, name), 'rb') as source, \
+                    open(os.path.join(self.segments_path, new_name), 'wb') as target:
+                for offset, length in rows:
+                    source.seek(offset)
+                    updates.append((new_name, target.tell(), name, offset))
+                    target.write(source.read(length))
+                target.flush()
+                os.fsync(target.fileno())
+        with connection:
+            if new_name is not None:
+                connection.execute('INSERT INTO segments VALUES (?, 1, ?)', (new_name, live))
+                connection.executemany('UPDATE results SET segment = ?, offset = ? '
+                                       'WHERE segment = ? AND offset = ?', updates)
+            connection.execute('DELETE FROM segments WHERE name = ?', (name,))
+        os.remove(os.path.join(self.segments_path, name))
+
+    def stats(self):
+        return {
+            'written': self.written,
+            'batches': self.batches,
+            'errors': self.errors,
+            'queued': self._queue.qsize(),
+            'records_per_batch': self.written / self.batches if self.batches else 0.0,
+            'aggregate_hits': self.aggregate_hits,
+            'aggregate_misses': self.aggregate_misses,
+        }
@@ -0,0 +1,173 @@
+"""
+Declarative request schemas, compiled once into nested validator functions.
+
+A schema is a dict of keys to sub-schemas or fields; a field is a ``Field`` or
+just the name of its type:
+
+    validate = compile_schema({'context': {'data_set_id': Field('integer', minimum=0),
+                                           'score_type': 'text'}})
+    validate(payload)  # raises SchemaError('context.data_set_id', 'key not found')
+"""
+import math
+
+
+class SchemaError(ValueError):
+
+    def __init__(self, path, message):
+        super().__init__('{}: {}'.format(path, message))
+        self.path = path
+        self.message = message
+
+
+def _is_number(value):
+    if isinstance(value, bool):
+        return False
+    if isinstance(value, (int, float)):
+        return math.isfinite(value)
+    if isinstance(value, str):
+        # ids are sent as strings as well
+        try:
+            return math.isfinite(float(value))
+        except ValueError:
+            return False
+    return False
+
+
+def _is_integer(value):
+    if isinstance(value, bool):
+        return False
+    if isinstance(value, int):
+        return True
+    return isinstance(value, str) and value.isdigit()
+
+
+TYPES = {
+    'number': _is_number,
+    'integer': _is_integer,
+    'text': lambda value: isinstance(value, str),
+    'boolean': lambda value: isinstance(value, bool),
+    'list': lambda value: isinstance(value, list),
+    'object': lambda value: isinstance(value, dict),
+}
+
+
+def _join(path, key):
+    return '{}.{}'.format(path, key) if path else str(key)
+
+
+class Field:
+    """
+    :param type_: name of a type in ``TYPES``, or a tuple of names
+    :param minimum: inclusive bounds of numbers
+    :param choices: allowed values
+    :param items: field of the elements of lists
+    :param min_items: bounds of the length of lists
+    """
+
+    def __init__(self, type_, required=True, minimum=None, maximum=None, choices=None,
+                 items=None, min_items=None, max_items=None):
+        self.types = (type_,) if isinstance(type_, str) else tuple(type_)
+        unknown = [name for name in self.types if name not in TYPES]
+        if unknown:
+            raise ValueError('unknown types: {}'.format(', '.join(unknown)))
+        self.required = required
+        self.minimum = minimum
+        self.maximum = maximum
+        self.choices = choices
+        self.items = items
+        self.min_items = min_items
+        self.max_items = max_items
+
+    def compile(self, path):
+        checks = [self._type_check()]
+        if self.choices is not None:
+            choices = frozenset(self.choices)
+            expected = ', '.join(sorted(map(str, choices)))
+
+            def check_choice(value):
+                # the elements of lists are checked by ``items``
+                if not isinstance(value, list) and value not in choices:
+                    return 'expected one of {}'.format(expected)
+            checks.append(check_choice)
+        if self.minimum is not None or self.maximum is not None:
+            checks.append(self._range_check())
+        if self.min_items is not None or self.max_items is not None:
+            checks.append(self._length_check())
+        items = compile_schema(self.items, path + '[]') if self.items is not None else None
+
+        def validate(value):
+            for check in checks:
+                message = check(value)
+                if message is not None:
+                    raise SchemaError(path, message)
+            if items is not None and isinstance(value, list):
+                for idx, item in enumerate(value):
+                    try:
+                        items(item)
+                    except SchemaError as exc:
+                        # the error path gets the index of the element
+                        raise SchemaError('{}[{}]{}'.format(path, idx, exc.path[len(path) + 2:]),
+                                          exc.message)
+        return validate
+
+    def _type_check(self):
+        predicates = [TYPES[name] for name in self.types]
+        expected = 'expected {}'.format(' or '.join(self.types))
+
+        def check_type(value):
+            if not any(predicate(value) for predicate in predicates):
+                return expected
+        return check_type
+
+    def _range_check(self):
+        minimum, maximum = self.minimum, self.maximum
+
+        def check_range(value):
+            if not _is_number(value):
+                return
+            number = float(value)
+            if minimum is not None and number < minimum:
+                return 'must be at least {}'.format(minimum)
+            if maximum is not None and number > maximum:
+                return 'must be at most {}'.format(maximum)
+        return check_range
+
+    def _length_check(self):
+        min_items, max_items = self.min_items, self.max_items
+
+        def check_length(value):
+            if not isinstance(value, list):
+                return
+            if min_items is not None and len(value) < min_items:
+                return 'must have at least {} items'.format(min_items)
+            if max_items is not None and len(value) > max_items:
+                return 'must have at most {} items'.format(max_items)
+        return check_length
+
+
+def _is_required(schema):
+    return not isinstance(schema, Field) or schema.required
+
+
+def compile_schema(schema, path=''):
+    """
+    :type schema: dict, Field or str
+    :return: function which raises ``SchemaError`` for data not matching the schema
+    """
+    if isinstance(schema, str):
+        schema = Field(schema)
+    if isinstance(schema, Field):
+        return schema.compile(path)
+
+    keys = [(key, compile_schema(sub_schema, _join(path, key)), _is_required(sub_schema))
+            for key, sub_schema in schema.items()]
+
+    def validate_object(value):
+        if not isinstance(value, dict):
+            raise SchemaError(path or '$', 'expected object')
+        for key, validate, required in keys:
+            if key in value:
+                validate(value[key])
+            elif required:
+                raise SchemaError(_join(path, key), 'key not found')
+    return validate_object
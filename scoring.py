@@ -0,0 +1,403 @@
+import itertools
+import logging
+import multiprocessing
+import os
+import pickle
+import queue
+import signal
+import struct
+import threading
+import time
+
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing.connection import Client, Listener
+from tornado import gen
+from tornado.ioloop import IOLoop
+
+from metrics import SCORING_QUEUE_SECONDS, SCORING_TASK_SECONDS
+from settings import app_settings
+from utils import (SCORERS, ReferenceNgrams, compute_statistics, corpus_scores,
+                   merge_statistics)
+
+
+# seconds a warm-up task waits for the other workers of its pool
+WARM_UP_TIMEOUT = 10
+
+_warm_up_barrier = None
+
+
+def _init_worker(warm_up_barrier=None):
+    global _warm_up_barrier
+    _warm_up_barrier = warm_up_barrier
+    # import the scoring code once per worker process, not once per task
+    import utils  # noqa: F401
+    logging.info('scoring worker started: %s', os.getpid())
+
+
+def _worker_pool(max_workers):
+    return ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker,
+                               initargs=(multiprocessing.Barrier(max_workers),))
+
+
+def warm_up_worker(every_worker=False):
+    """
+    Score a tiny sample once, the first task of a worker pays for the imports and
+    caches. With ``every_worker`` the task waits for one such task in each of the
+    other workers, so a fast worker does not take the tasks of a slow one.
+    """
+    compute_statistics(['warm up'], ['warm up'], list(SCORERS))
+    if every_worker and _warm_up_barrier is not None:
+        try:
+            _warm_up_barrier.wait(WARM_UP_TIMEOUT)
+        except threading.BrokenBarrierError:
+            logging.warning('scoring worker %s warmed up without the others', os.getpid())
+    return os.getpid()
+
+
+def _timed_call(fn, *args):
+    started = time.monotonic()
+    result = fn(*args)
+    return time.monotonic() - started, result
+
+
+# request id, and for replies whether the payload is an exception
+HEADER = struct.Struct('!Q?')
+
+
+def _call_pickled(data):
+    # the scoring server passes the payloads through without unpickling them
+    fn, args = pickle.loads(data)
+    return pickle.dumps(fn(*args), protocol=pickle.HIGHEST_PROTOCOL)
+
+
+class ScoringServer:
+    """
+    One process pool for the scoring of all server processes of a machine, which
+    submit their tasks over a unix socket with ``RemoteExecutor``.
+
+    ``serve`` runs in a process of its own. On SIGTERM it stops accepting
+    connections, finishes the tasks it was given and exits.
+    """
+
+    def __init__(self, address, authkey, max_workers=None):
+        self.address = address
+        self.authkey = authkey
+        self.max_workers = max_workers or app_settings['scoring_workers']
+        self._listener = None
+
+    def serve(self):
+        executor = _worker_pool(self.max_workers)
+        if os.path.exists(self.address):
+            os.remove(self.address)
+        self._listener = Listener(self.address, family='AF_UNIX', authkey=self.authkey)
+        signal.signal(signal.SIGTERM, self._stop)
+        if app_settings['warm_up']:
+            self.warm_up(executor)
+        logging.info('scoring server with %s workers on %s', self.max_workers, self.address)
+        while True:
+            try:
+                connection = self._listener.accept()
+            except OSError:
+                # closed by ``_stop``
+                break
+            threading.Thread(target=self._handle, args=(connection, executor),
+                             daemon=True).start()
+        executor.shutdown(wait=True)
+        logging.info('scoring server stopped')
+
+    def warm_up(self, executor):
+        """
+        Start every worker of the pool before the first connection; each worker
+        takes one of the tasks, see ``warm_up_worker``.
+        """
+        futures = [executor.submit(warm_up_worker, True) for _ in range(self.max_workers)]
+        try:
+            workers = {future.result() for future in futures}
+        except Exception:
+            logging.exception('cannot warm up the scoring workers')
+            return
+        logging.info('scoring server warmed up %s workers', len(workers))
+
+    def _stop(self, signum, frame):
+        self._listener.close()
+
+    def _handle(self, connection, executor):
+        lock = threading.Lock()
+        while True:
+            try:
+                header = connection.recv_bytes()
+                data = connection.recv_bytes()
+            except (EOFError, OSError):
+                break
+            request_id, _ = HEADER.unpack(header)
+            try:
+                future = executor.submit(_call_pickled, data)
+            except RuntimeError as exc:
+                # shutting down
+                future = Future()
+                future.set_exception(BrokenProcessPool(str(exc)))
+            future.add_done_callback(
+                lambda done, request_id=request_id: self._reply(connection, lock, request_id, done)
+            )
+        connection.close()
+
+    @staticmethod
+    def _reply(connection, lock, request_id, future):
+        try:
+            failed, data = False, future.result()
+        except BaseException as exc:
+            failed, data = True, pickle.dumps(exc, protocol=pickle.HIGHEST_PROTOCOL)
+        with lock:
+            try:
+                connection.send_bytes(HEADER.pack(request_id, failed))
+                connection.send_bytes(data)
+            except OSError:
+                logging.info('scoring client is gone, dropping result %s', request_id)
+
+
+class RemoteExecutor(Executor):
+    """
+    Executor which runs the tasks in a ``ScoringServer``.
+
+    Tasks are pickled and sent by a writer thread, like ``ProcessPoolExecutor``
+    does, so a large task does not block the IOLoop. The writer thread connects
+    first, retrying for ``connect_timeout`` seconds while the server is not
+    listening yet. When the server goes away the pending tasks fail with
+    ``BrokenProcessPool`` and the next task reconnects.
+    """
+
+    CONNECT_INTERVAL = 0.05
+
+    def __init__(self, address, authkey, *args, **kwargs):
+        self.address = address
+        self.authkey = authkey
+        self.connect_timeout = kwargs.get('connect_timeout',
+                                          app_settings['scoring_connect_timeout'])
+        self._ids = itertools.count()
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._outbox = None
+        self._connection = None
+
+    def _open(self):
+        deadline = time.monotonic() + self.connect_timeout
+        while True:
+            try:
+                return Client(self.address, family='AF_UNIX', authkey=self.authkey)
+            except OSError:
+                # the socket file is missing or not listening yet
+                if time.monotonic() >= deadline:
+                    raise
+            time.sleep(self.CONNECT_INTERVAL)
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        with self._lock:
+            if self._outbox is None:
+                self._outbox = queue.Queue()
+                threading.Thread(target=self._write, args=(self._outbox,), daemon=True).start()
+            request_id = next(self._ids)
+            self._pending[request_id] = future
+            self._outbox.put((request_id, fn, args))
+        return future
+
+    def _write(self, outbox):
+        try:
+            connection = self._open()
+        except Exception as exc:
+            self._disconnect(outbox, 'scoring server: {}'.format(exc))
+            return
+        with self._lock:
+            if self._outbox is not outbox:
+                connection.close()
+                return
+            self._connection = connection
+        threading.Thread(target=self._read, args=(connection, outbox), daemon=True).start()
+        while True:
+            item = outbox.get()
+            if item is None:
+                break
+            request_id, fn, args = item
+            try:
+                data = pickle.dumps((fn, args), protocol=pickle.HIGHEST_PROTOCOL)
+            except Exception as exc:
+                self._resolve(request_id, exc)
+                continue
+            try:
+                connection.send_bytes(HEADER.pack(request_id, False))
+                connection.send_bytes(data)
+            except OSError:
+                break
+
+    def _read(self, connection, outbox):
+        while True:
+            try:
+                request_id, failed = HEADER.unpack(connection.recv_bytes())
+                result = pickle.loads(connection.recv_bytes())
+            except (EOFError, OSError):
+                break
+            self._resolve(request_id, result if failed else None, result)
+        self._disconnect(outbox, 'scoring server connection lost')
+
+    def _resolve(self, request_id, exc, result=None):
+        with self._lock:
+            future = self._pending.pop(request_id, None)
+        if future is None:
+            return
+        if exc is not None:
+            future.set_exception(exc)
+        else:
+            future.set_result(result)
+
+    def _disconnect(self, outbox, reason):
+        with self._lock:
+            if self._outbox is not outbox:
+                return
+            outbox.put(None)
+            connection, self._connection, self._outbox = self._connection, None, None
+            pending, self._pending = self._pending, {}
+        if connection is not None:
+            connection.close()
+        for future in pending.values():
+            future.set_exception(BrokenProcessPool(reason))
+
+    def shutdown(self, wait=True, **kwargs):
+        outbox = self._outbox
+        if outbox is not None:
+            self._disconnect(outbox, 'scoring server connection lost')
+
+
+class ScoringEngine:
+    """
+    Process pool for scoring which is created once and shared by all requests.
+
+    The pool has to be started after ``HTTPServer.start`` forks, otherwise the
+    children inherit a pool whose worker processes belong to the parent. With an
+    ``address``, the tasks run in the pool of the ``ScoringServer`` listening there,
+    which all server processes share.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.address = kwargs.get('address')
+        self.authkey = kwargs.get('authkey')
+        self.connect_timeout = kwargs.get('connect_timeout',
+                                          app_settings['scoring_connect_timeout'])
+        self.max_workers = kwargs.get('max_workers') or app_settings['scoring_workers']
+        self.shard_size = kwargs.get('shard_size') or app_settings['scoring_shard_size']
+        self.executor = None
+        self.started_at = None
+        self.in_flight = 0
+        self.submitted = 0
+        self.completed = 0
+        self.busy_time = 0.0
+
+    def start(self):
+        if self.executor is None:
+            if self.address:
+                self.executor = RemoteExecutor(self.address, self.authkey,
+                                               connect_timeout=self.connect_timeout)
+            else:
+                self.executor = _worker_pool(self.max_workers)
+            self.started_at = time.monotonic()
+            logging.info('scoring pool started with %s workers%s', self.max_workers,
+                         ', shared on {}'.format(self.address) if self.address else '')
+        return self.executor
+
+    async def warm_up(self):
+        """
+        Start the pool and run the scoring code once in every worker, or connect to
+        the scoring server, which warms up its own pool.
+
+        :return: number of distinct workers which answered
+        """
+        if self.address:
+            return len({await self.submit(warm_up_worker)})
+        return len(set(await gen.multi([self.submit(warm_up_worker, True)
+                                        for _ in range(self.max_workers)])))
+
+    def shutdown(self, wait=True):
+        if self.executor is not None:
+            self.executor.shutdown(wait=wait)
+            self.executor = None
+
+    async def submit(self, fn, *args):
+        executor = self.start()
+        self.in_flight += 1
+        self.submitted += 1
+        submitted = time.monotonic()
+        try:
+            elapsed, result = await IOLoop.current().run_in_executor(
+                executor, _timed_call, fn, *args
+            )
+        finally:
+            self.in_flight -= 1
+            self.completed += 1
+        self.busy_time += elapsed
+        # the rest of the round trip is spent queued and in transfer
+        SCORING_QUEUE_SECONDS.observe(max(0.0, time.monotonic() - submitted - elapsed))
+        SCORING_TASK_SECONDS.observe(elapsed)
+        return result
+
+    async def statistics(self, references, hypothesis, score_types=('bleu',)):
+        """
+        Statistics of every segment, computed shard by shard in the pool; each
+        shard is tokenized once for all the score types.
+
+        :type references: list or utils.ReferenceNgrams
+        :type hypothesis: list
+        :type score_types: list
+        :rtype: dict
+        :return: statistics by score type, see ``utils.compute_statistics``
+        """
+        unknown = [name for name in score_types if name not in SCORERS]
+        if unknown:
+            raise ValueError('Not acceptable type: {}'.format(', '.join(unknown)))
+
+        if isinstance(references, ReferenceNgrams):
+            cut = references.slice
+        else:
+            def cut(start, stop):
+                return references[start:stop]
+
+        shards = range(0, max(len(hypothesis), 1), self.shard_size)
+        result = await gen.multi([
+            self.submit(compute_statistics,
+                        cut(start, start + self.shard_size),
+                        hypothesis[start:start + self.shard_size],
+                        list(score_types))
+            for start in shards
+        ])
+        return merge_statistics(result)
+
+    async def score(self, references, hypothesis, type_='bleu'):
+        """
+        :type references: list or utils.ReferenceNgrams
+        :type hypothesis: list
+        :type type_: str or list
+        :rtype: float or dict
+        :return: the score, or the scores by type for a list of types
+        """
+        score_types = [type_] if isinstance(type_, str) else list(type_)
+
+        logging.info('starting score calculation: %s', type_)
+        scores = corpus_scores(await self.statistics(references, hypothesis, score_types))
+        logging.info('finishing score calculation: %s', type_)
+        return scores[type_] if isinstance(type_, str) else scores
+
+    def stats(self):
+        busy_workers = min(self.in_flight, self.max_workers)
+        uptime = time.monotonic() - self.started_at if self.started_at else 0.0
+        return {
+            'shared': bool(self.address),
+            'workers': self.max_workers,
+            'in_flight': self.in_flight,
+            'queue_depth': max(0, self.in_flight - self.max_workers),
+            'busy_workers': busy_workers,
+            'utilisation': busy_workers / self.max_workers,
+            'average_utilisation': (
+                self.busy_time / (uptime * self.max_workers) if uptime else 0.0
+            ),
+            'submitted': self.submitted,
+            'completed': self.completed,
+        }
@@ -0,0 +1,150 @@
+"""
+Sequential evaluation: the chunks of a data set are translated in a stratified
+random order, and no more are requested once a bootstrap confidence interval of
+the score is narrow enough or the line or character budget is spent.
+
+Chunks are resampled as a whole, the lines of a chunk being consecutive. Two
+providers translate the same chunks and are compared by a paired bootstrap of
+the difference of their scores.
+"""
+import numpy as np
+
+from settings import app_settings
+from utils import (bootstrap_weights, concatenate_rows, corpus_scores, get_scorer,
+                   merge_statistics, percentile_interval)
+
+# why an evaluation stopped
+COMPLETE = 'complete'
+INTERVAL = 'interval'
+SIGNIFICANT = 'significant'
+BUDGET = 'budget'
+
+
+class SequentialEstimate:
+    """
+    Statistics of the chunks evaluated so far, for one provider or a pair.
+    """
+
+    def __init__(self, score_type, providers=1, **kwargs):
+        """
+        :param score_type: the score the interval is computed for
+        :param providers: 1, or 2 for a paired comparison
+        """
+        self.score_type = score_type
+        self.providers = providers
+        self.confidence = kwargs.get('confidence') or app_settings['sequential_confidence']
+        self.width = kwargs.get('width')
+        self.max_lines = kwargs.get('max_lines')
+        self.max_chars = kwargs.get('max_chars')
+        self.samples = kwargs.get('samples', app_settings['bootstrap_samples'])
+        self.min_chunks = kwargs.get('min_chunks', app_settings['sequential_min_chunks'])
+        self.rng = np.random.default_rng(kwargs.get('seed'))
+        # sent upstream, by all providers together
+        self.sent_lines = 0
+        self.sent_chars = 0
+        self.lines = 0
+        self.chunks = []
+        self.intervals = None
+        self.difference = None
+        self.stopped = None
+        self.budget_spent = False
+        self._stats = []
+        self._groups = []
+
+    def can_start(self, texts):
+        """
+        Whether the budget allows to send ``texts`` upstream; they are counted
+        when it does.
+        """
+        lines = self.sent_lines + len(texts)
+        chars = self.sent_chars + sum(map(len, texts))
+        if (self.max_lines is not None and lines > self.max_lines
+                or self.max_chars is not None and chars > self.max_chars):
+            self.budget_spent = True
+            return False
+        self.sent_lines, self.sent_chars = lines, chars
+        return True
+
+    def add(self, idx, lines, stats):
+        """
+        :param idx: index of the chunk
+        :param lines: number of lines of the chunk
+        :type stats: list
+        :param stats: statistics of the chunk by score type, for every provider
+        """
+        scorer = get_scorer(self.score_type)
+        self.chunks.append(idx)
+        self.lines += lines
+        self._stats.append(stats)
+        self._groups.append([scorer.group(provider_stats[self.score_type])
+                             for provider_stats in stats])
+        if len(self._groups) < 2:
+            return
+        weights = bootstrap_weights(len(self._groups), self.samples, self.rng)
+        scores = [
+            scorer.resampled_scores(concatenate_rows([groups[provider] for groups in self._groups]),
+                                    weights)
+            for provider in range(self.providers)
+        ]
+        self.intervals = [percentile_interval(values, self.confidence) for values in scores]
+        if self.providers == 2:
+            # the same resamples for both providers
+            self.difference = percentile_interval(scores[0] - scores[1], self.confidence)
+
+    def should_stop(self, remaining):
+        """
+        :param remaining: number of chunks not evaluated yet
+        """
+        if not remaining:
+            self.stopped = COMPLETE
+        elif self.intervals is not None and len(self.chunks) >= self.min_chunks:
+            low, high = self.difference or self.intervals[0]
+            if self.width is not None and high - low <= self.width:
+                self.stopped = INTERVAL
+            elif self.difference is not None and (low > 0 or high < 0):
+                self.stopped = SIGNIFICANT
+        return self.stopped is not None
+
+    def finish(self):
+        """
+        Called when the chunks the budget allowed are evaluated.
+        """
+        if self.stopped is None:
+            self.stopped = BUDGET if self.budget_spent else COMPLETE
+
+    def scores(self, provider=0):
+        """
+        :return: corpus score by score type, of the chunks evaluated so far
+        """
+        return corpus_scores(merge_statistics([stats[provider] for stats in self._stats]))
+
+    def report(self, total_lines, provider=0, other=None):
+        """
+        :param other: id of the other provider of a pair
+        :rtype: dict
+        """
+        interval = list(self.intervals[provider]) if self.intervals else None
+        difference = None
+        if self.difference is not None:
+            low, high = self.difference
+            # of this provider minus the other one
+            difference = [low, high] if provider == 0 else [-high, -low]
+        if self.stopped == COMPLETE:
+            # the scores of the whole data set are known
+            score = self.scores(provider)[self.score_type]
+            interval = [score, score]
+            if other is not None:
+                score -= self.scores(1 - provider)[self.score_type]
+                difference = [score, score]
+        report = {
+            'score_type': self.score_type,
+            'confidence': self.confidence,
+            'interval': interval,
+            'lines': self.lines,
+            'fraction': self.lines / total_lines if total_lines else 1.0,
+            'chunks': len(self.chunks),
+            'stopped': self.stopped,
+        }
+        if other is not None:
+            report['difference'] = {'provider': other, 'interval': difference}
+        return report
@@ -1,11 +1,124 @@
+import json
 import os
 
 app_settings = {
     "default_handler_args": dict(status_code=404),
     "env": os.environ.get("ENV", "dev"),
     "port": os.environ.get("APP_PORT", "9000"),
+    # HTTP server processes in production, and threads of each for file access
+    "io_workers": int(os.environ.get("IO_WORKERS", os.cpu_count() or 1)),
+    "manager_threads": int(os.environ.get("MANAGER_THREADS", "4")),
+    # scoring worker pool; in production one pool shared by the HTTP server processes,
+    # which submit to it over a unix socket (a temporary path if unset)
+    "scoring_workers": int(os.environ.get("SCORING_WORKERS", os.cpu_count() or 1)),
+    "scoring_shared": os.environ.get("SCORING_SHARED", "1") == "1",
+    "scoring_socket": os.environ.get("SCORING_SOCKET", ""),
+    # seconds a server process keeps trying to connect to a scoring server which is
+    # not listening yet, e.g. started at the same time
+    "scoring_connect_timeout": float(os.environ.get("SCORING_CONNECT_TIMEOUT", "5")),
+    # seconds a stopping server process waits for the evaluations in flight
+    "drain_timeout": float(os.environ.get("DRAIN_TIMEOUT", "30")),
+    "scoring_shard_size": int(os.environ.get("SCORING_SHARD_SIZE", "10000")),
+    # parsed data sets kept in memory, bounded by their total number of lines
+    "data_set_cache_lines": int(os.environ.get("DATA_SET_CACHE_LINES", "2000000")),
+    # largest uploaded data set, before and after decompression
+    "data_set_upload_max_bytes": int(os.environ.get("DATA_SET_UPLOAD_MAX_BYTES",
+                                                    str(1024 ** 3))),
+    # segment translations, in memory and in a SQLite file shared by the processes
+    "translation_cache_path": os.environ.get(
+        "TRANSLATION_CACHE_PATH", os.path.join(os.getcwd(), "cache", "translations.sqlite")
+    ),
+    "translation_cache_memory_entries": int(os.environ.get("TRANSLATION_CACHE_MEMORY_ENTRIES",
+                                                           "100000")),
+    "translation_cache_ttl": int(os.environ.get("TRANSLATION_CACHE_TTL", str(7 * 24 * 3600))),
+    "translation_cache_max_bytes": int(os.environ.get("TRANSLATION_CACHE_MAX_BYTES",
+                                                      str(1024 ** 3))),
+    # upstream providers: "simple" or "curl" (needs pycurl, keeps connections alive)
+    "upstream_backend": os.environ.get("UPSTREAM_BACKEND", "simple"),
+    "upstream_max_clients": int(os.environ.get("UPSTREAM_MAX_CLIENTS", "10")),
+    "upstream_max_in_flight": int(os.environ.get("UPSTREAM_MAX_IN_FLIGHT", "10")),
+    # requests in flight to all providers together
+    "upstream_max_in_flight_total": int(os.environ.get("UPSTREAM_MAX_IN_FLIGHT_TOTAL", "32")),
+    "upstream_connect_timeout": float(os.environ.get("UPSTREAM_CONNECT_TIMEOUT", "5")),
+    "upstream_request_timeout": float(os.environ.get("UPSTREAM_REQUEST_TIMEOUT", "60")),
+    "upstream_gzip": os.environ.get("UPSTREAM_GZIP", "1") == "1",
+    # batches of texts per upstream request: limits, with per provider ones as JSON
+    # ({"<provider id>": {"max_items": 100, "max_chars": 5000, "max_bytes": 65536}}), and
+    # the adjustment of their size: items added per batch answered within the latency
+    # target (seconds), factor applied after a slower or throttled one
+    "upstream_batch_max_items": int(os.environ.get("UPSTREAM_BATCH_MAX_ITEMS", "1000")),
+    "upstream_batch_max_chars": int(os.environ.get("UPSTREAM_BATCH_MAX_CHARS", "100000")),
+    "upstream_batch_max_bytes": int(os.environ.get("UPSTREAM_BATCH_MAX_BYTES", str(1024 ** 2))),
+    "upstream_batch_limits": json.loads(os.environ.get("UPSTREAM_BATCH_LIMITS", "{}")),
+    "upstream_batch_increase": float(os.environ.get("UPSTREAM_BATCH_INCREASE", "10")),
+    "upstream_batch_decrease": float(os.environ.get("UPSTREAM_BATCH_DECREASE", "0.5")),
+    "upstream_batch_latency_target": float(os.environ.get("UPSTREAM_BATCH_LATENCY_TARGET", "5")),
+    # retries of a failed batch, with exponential backoff in seconds up to a maximum
+    "upstream_retries": int(os.environ.get("UPSTREAM_RETRIES", "3")),
+    "upstream_retry_backoff": float(os.environ.get("UPSTREAM_RETRY_BACKOFF", "0.5")),
+    "upstream_retry_backoff_max": float(os.environ.get("UPSTREAM_RETRY_BACKOFF_MAX", "30")),
+    # evaluations running at once, weighted by data set lines, and their wait queue
+    "admission_capacity": int(os.environ.get("ADMISSION_CAPACITY", "100")),
+    "admission_lines_per_unit": int(os.environ.get("ADMISSION_LINES_PER_UNIT", "1000")),
+    "admission_max_queue": int(os.environ.get("ADMISSION_MAX_QUEUE", "50")),
+    "admission_queue_timeout": float(os.environ.get("ADMISSION_QUEUE_TIMEOUT", "10")),
+    "admission_retry_after": int(os.environ.get("ADMISSION_RETRY_AFTER", "5")),
+    # seconds an evaluation result is reused by identical requests, 0 disables it
+    "coalescing_memo_ttl": float(os.environ.get("COALESCING_MEMO_TTL", "0")),
+    # evaluation results: segment logs with a SQLite index, written in batches
+    "results_path": os.environ.get("RESULTS_PATH", os.path.join(os.getcwd(), "results")),
+    "results_segment_max_bytes": int(os.environ.get("RESULTS_SEGMENT_MAX_BYTES",
+                                                    str(64 * 1024 ** 2))),
+    "results_flush_interval": float(os.environ.get("RESULTS_FLUSH_INTERVAL", "0.01")),
+    "results_batch_size": int(os.environ.get("RESULTS_BATCH_SIZE", "256")),
+    "results_compaction_interval": float(os.environ.get("RESULTS_COMPACTION_INTERVAL", "3600")),
+    "results_min_live_ratio": float(os.environ.get("RESULTS_MIN_LIVE_RATIO", "0.5")),
+    # seconds results are kept for, 0 keeps them forever
+    "results_retention": float(os.environ.get("RESULTS_RETENTION", "0")),
+    # items per page of the results endpoints, by default and at most
+    "results_page_size": int(os.environ.get("RESULTS_PAGE_SIZE", "100")),
+    "results_max_page_size": int(os.environ.get("RESULTS_MAX_PAGE_SIZE", "1000")),
+    # per-segment scores of larger responses are stored with the result, not returned
+    "segment_scores_inline_max": int(os.environ.get("SEGMENT_SCORES_INLINE_MAX", "1000")),
+    # most worst segments a request may ask for
+    "worst_segments_max": int(os.environ.get("WORST_SEGMENTS_MAX", "100")),
+    # sequential evaluations: chunks in flight, parts of the data set the chunks are drawn
+    # from in turn, chunks before they may stop, default confidence, bootstrap resamples
+    "sequential_window": int(os.environ.get("SEQUENTIAL_WINDOW", "4")),
+    "sequential_strata": int(os.environ.get("SEQUENTIAL_STRATA", "10")),
+    "sequential_min_chunks": int(os.environ.get("SEQUENTIAL_MIN_CHUNKS", "5")),
+    "sequential_confidence": float(os.environ.get("SEQUENTIAL_CONFIDENCE", "0.95")),
+    "bootstrap_samples": int(os.environ.get("BOOTSTRAP_SAMPLES", "1000")),
+    # background evaluation jobs: state files, jobs running at once per process, waiting jobs
+    "jobs_path": os.environ.get("JOBS_PATH", os.path.join(os.getcwd(), "jobs")),
+    "jobs_max_concurrent": int(os.environ.get("JOBS_MAX_CONCURRENT", "2")),
+    "jobs_max_queue": int(os.environ.get("JOBS_MAX_QUEUE", "100")),
+    "jobs_max_priority": int(os.environ.get("JOBS_MAX_PRIORITY", "9")),
+    # seconds between progress updates of running jobs, and finished jobs are kept for
+    "jobs_sync_interval": float(os.environ.get("JOBS_SYNC_INTERVAL", "1")),
+    "jobs_retention": float(os.environ.get("JOBS_RETENTION", str(7 * 24 * 3600))),
+    # snapshots of the metrics of every server process, merged by /metrics
+    "metrics_dir": os.environ.get("METRICS_DIR", os.path.join(os.getcwd(), "cache", "metrics")),
+    "metrics_flush_interval": float(os.environ.get("METRICS_FLUSH_INTERVAL", "5")),
+    "ioloop_lag_interval": float(os.environ.get("IOLOOP_LAG_INTERVAL", "0.5")),
+    # "auto" uses orjson when it is installed, "json" the standard library
+    "json_backend": os.environ.get("JSON_BACKEND", "auto"),
+    # data sets read before the first request, by the supervisor before it forks
+    "preload_data_sets": [
+        data_set_id for data_set_id in os.environ.get("PRELOAD_DATA_SETS", "").split(",")
+        if data_set_id
+    ],
+    # a new server process starts its scoring workers and connects to these providers
+    # before GET /ready answers 200; a rolling restart waits up to READY_TIMEOUT seconds
+    # for it before the old process drains (0 does not wait)
+    "warm_up": os.environ.get("WARM_UP", "1") == "1",
+    "warm_up_providers": [
+        provider_id for provider_id in os.environ.get("WARM_UP_PROVIDERS", "").split(",")
+        if provider_id
+    ],
+    "ready_timeout": float(os.environ.get("READY_TIMEOUT", "60")),
 }
 
 proxy_path = {
     '/ai/text/evaluate_provider': os.environ.get("PROXY_URL", "https://www.google.com")
-}
\ No newline at end of file
+}
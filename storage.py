@@ -1,13 +1,105 @@
 import os
 import collections
+import gzip
+import hashlib
+import io
+import json
+import logging
+import shutil
+import struct
+import threading
 import time
+import uuid
+import zlib
 
+import numpy as np
 from concurrent.futures import ThreadPoolExecutor
 from tornado import concurrent
+from tornado.concurrent import Future, chain_future
+from tornado.ioloop import IOLoop
+from tornado.queues import Queue
 
-from utils import generate_hash
+from compiled_data_set import COMPILED_EXT, CompiledDataSet, CompiledWriter, write_compiled
+from json_codec import json_decode, json_encode
+from metrics import STAGE_SECONDS
+from results_store import ResultsStore
+from settings import app_settings
+from utils import ReferenceNgrams, data_set_version, get_scorer, line_hashes, tokenize
 
-DataSet = collections.namedtuple('DataSet', ['original', 'translation', 'lang_from', 'lang_to'])
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+DataSet = collections.namedtuple('DataSet', ['original', 'translation', 'lang_from', 'lang_to',
+                                             'reference_ngrams'],
+                                 defaults=(None,))
+# hashes of the lines of a data set and the version they identify
+DataSetVersion = collections.namedtuple('DataSetVersion', ['version', 'hashes'])
+# what a provider was last evaluated with on a data set: the version, the hashes of
+# its lines, their translations, the provider response envelope and the statistics
+# of every line by score type
+Snapshot = collections.namedtuple('Snapshot', ['version', 'hashes', 'translations', 'envelope',
+                                               'stats'])
+
+TEXT_EXT = '.txt'
+SNAPSHOTS_DIR = 'snapshots'
+# data set files read through a decompressor, and the matching upload encodings
+COMPRESSED_EXTS = {'.gz': 'gzip', '.zst': 'zstd'}
+# decompressed bytes a line count is extrapolated from
+SAMPLE_SIZE = 1024 ** 2
+
+
+def split_file_name(file_name):
+    """
+    >>> split_file_name('en-ru.txt.gz')
+    ('en-ru', '.txt.gz')
+    """
+    name, ext = os.path.splitext(file_name)
+    if ext in COMPRESSED_EXTS:
+        name, inner_ext = os.path.splitext(name)
+        ext = inner_ext + ext
+    return name, ext
+
+
+def _need_zstandard(what):
+    if zstandard is None:
+        raise ValueError('zstandard is not installed, cannot read {}'.format(what))
+
+
+def _decompressing(fd, file_path):
+    """
+    Binary stream of the content of ``fd``, decompressed as it is read.
+    """
+    ext = os.path.splitext(file_path)[1]
+    if ext == '.gz':
+        return gzip.GzipFile(fileobj=fd)
+    if ext == '.zst':
+        _need_zstandard(file_path)
+        return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(fd))
+    return fd
+
+
+def _content_size(fd, file_path):
+    """
+    Size of the decompressed content, from the gzip trailer or the zstd frame header.
+    """
+    size = os.fstat(fd.fileno()).st_size
+    ext = os.path.splitext(file_path)[1]
+    if ext == '.gz' and size >= 4:
+        fd.seek(-4, os.SEEK_END)
+        # the trailer holds the size modulo 4 GiB, the content is not smaller than the file
+        content_size, = struct.unpack('<I', fd.read(4))
+        while content_size < size:
+            content_size += 2 ** 32
+        size = content_size
+    elif ext == '.zst' and zstandard is not None:
+        # 18 bytes hold the largest frame header
+        content_size = zstandard.frame_content_size(fd.read(18))
+        if content_size >= 0:
+            size = content_size
+    fd.seek(0)
+    return size
 
 
 class BaseStorage:
@@ -15,31 +107,63 @@ class BaseStorage:
     def open(self, *args, **kwargs):
         raise NotImplemented
 
-    def save(self, *args, **kwargs):
-        raise NotImplemented
-
 
 class DefaultStorage(BaseStorage):
     DATA_SET_BASE_PATH = os.path.join(os.getcwd(), 'data_set')
-    RESULTS_BASE_PATH = os.path.join(os.getcwd(), 'results')
+    RESULTS_BASE_PATH = app_settings['results_path']
+    JOBS_BASE_PATH = app_settings['jobs_path']
 
     def __init__(self, *args, **kwargs):
         self.data_set_base_path = kwargs.get('data_set_base_path', self.DATA_SET_BASE_PATH)
         self.results_base_path = kwargs.get('results_base_path', self.RESULTS_BASE_PATH)
-
-    def _generate_name(self, name):
-        return '{}.txt'.format(generate_hash(name))
+        self.jobs_base_path = kwargs.get('jobs_base_path', self.JOBS_BASE_PATH)
+        self._paths = {}
 
     def _get_path(self, data_set_id):
         dat_set_dir = os.path.join(self.data_set_base_path, str(data_set_id))
-        # currently only on file per folder is supported
         try:
-            file_path = os.listdir(dat_set_dir)[0]
-            full_path = os.path.join(dat_set_dir, file_path)
+            dir_mtime = os.stat(dat_set_dir).st_mtime_ns
         except FileNotFoundError:
-            full_path = None
+            return
+        cached = self._paths.get(str(data_set_id))
+        if cached is not None and cached[0] == dir_mtime:
+            return cached[1]
+
+        full_path = self._select_file(dat_set_dir)
+        self._paths[str(data_set_id)] = (dir_mtime, full_path)
         return full_path
 
+    @staticmethod
+    def _select_file(dat_set_dir):
+        # currently only on file per folder is supported, plus its compiled version;
+        # hidden and temporary files are being written
+        file_names = sorted(name for name in os.listdir(dat_set_dir)
+                            if not name.startswith('.') and not name.endswith('.tmp'))
+        if not file_names:
+            return
+        sources = [name for name in file_names if not name.endswith(COMPILED_EXT)]
+        compiled = [name for name in file_names if name.endswith(COMPILED_EXT)]
+        full_path = os.path.join(dat_set_dir, (sources or compiled)[0])
+        if compiled:
+            compiled_path = os.path.join(dat_set_dir, compiled[0])
+            if not sources or os.stat(compiled_path).st_mtime_ns >= os.stat(full_path).st_mtime_ns:
+                return compiled_path
+            logging.warning('compiled data set is older than its source: %s', compiled_path)
+        return full_path
+
+    def get_signature(self, data_set_id):
+        """
+        Identifies the current content of a data set: (path, mtime, size).
+        """
+        file_path = self._get_path(data_set_id)
+        if file_path is None:
+            return
+        try:
+            stat = os.stat(file_path)
+        except FileNotFoundError:
+            return
+        return file_path, stat.st_mtime_ns, stat.st_size
+
     def get_file_name(self, data_set_id):
         file_name = os.path.basename(self._get_path(data_set_id))
         return file_name
@@ -48,49 +172,397 @@ class DefaultStorage(BaseStorage):
         sentences = [sentence.strip() for sentence in line.decode().split('\t')]
         return sentences[0], sentences[1]
 
-    def open(self, data_set_id, mode='rb'):
+    def _iter_file(self, file_path):
+        with open(file_path, 'rb') as fd:
+            for line in _decompressing(fd, file_path):
+                yield self._process_line(line)
+
+    def iter_pairs(self, data_set_id):
+        """
+        Yield the (source, reference) pairs of a data set as its file is read;
+        gzip and zstd files are decompressed on the fly.
+        """
         file_path = self._get_path(data_set_id)
         if file_path is None:
             return
-        #
-        result = []
-        with open(file_path, mode) as fd:
-            for line in fd:
-                result.append(self._process_line(line))
-        return result
+        if file_path.endswith(COMPILED_EXT):
+            compiled = CompiledDataSet(file_path)
+            yield from zip(compiled.original, compiled.translation)
+            return
+        yield from self._iter_file(file_path)
 
-    def save(self, provider_id, data_set_id, data):
+    def iter_chunks(self, data_set_id, chunk_size):
+        """
+        Yield lists of (source, reference) pairs in the sizes of ``utils.split``:
+        full chunks, then the last one, which may be empty.
+        """
+        chunk = []
+        for pair in self.iter_pairs(data_set_id):
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+            chunk.append(pair)
+        yield chunk
 
-        current_time = str(int(time.time()))
-        hashed_time = self._generate_name(current_time)
-        full_path = os.path.join(
-            *[self.results_base_path, provider_id, str(data_set_id), current_time, hashed_time]
+    def estimate_lines(self, data_set_id, sample_size=SAMPLE_SIZE):
+        """
+        Number of lines of a data set, extrapolated from its first ``sample_size``
+        bytes when it is larger.
+        """
+        file_path = self._get_path(data_set_id)
+        if file_path is None:
+            return 0
+        if file_path.endswith(COMPILED_EXT):
+            return len(CompiledDataSet(file_path))
+        lines = read = 0
+        with open(file_path, 'rb') as fd:
+            content_size = _content_size(fd, file_path)
+            for line in _decompressing(fd, file_path):
+                lines += 1
+                read += len(line)
+                if read >= sample_size:
+                    return max(lines, round(lines * content_size / read))
+        return lines
+
+    def open(self, data_set_id):
+        file_path = self._get_path(data_set_id)
+        if file_path is None:
+            return
+        if file_path.endswith(COMPILED_EXT):
+            return CompiledDataSet(file_path)
+        return list(self._iter_file(file_path))
+
+    def compile(self, data_set_id, with_tokens=True):
+        """
+        Write the compiled version of a text data set next to it.
+        """
+        file_path = self._get_path(data_set_id)
+        if file_path is None or file_path.endswith(COMPILED_EXT):
+            return file_path
+        compiled_path = write_compiled(split_file_name(file_path)[0] + COMPILED_EXT,
+                                       self._iter_file(file_path), with_tokens=with_tokens)
+        self._paths.pop(str(data_set_id), None)
+        return compiled_path
+
+    def create_upload(self, data_set_id, lang_from, lang_to, encoding='identity'):
+        """
+        :rtype: DataSetUpload
+        """
+        staging_dir = os.path.join(self.data_set_base_path, '.uploads', uuid.uuid4().hex)
+        return DataSetUpload(
+            staging_dir, os.path.join(self.data_set_base_path, str(data_set_id)),
+            '{}-{}'.format(lang_from, lang_to), encoding,
+            max_bytes=app_settings['data_set_upload_max_bytes'],
         )
-        if not os.path.exists(os.path.dirname(full_path)):
-            os.makedirs(os.path.dirname(full_path))
 
-        return self._save(full_path, data)
+    def _snapshot_path(self, data_set_id, provider_id):
+        name = hashlib.sha1(provider_id.encode()).hexdigest()
+        return os.path.join(self.results_base_path, SNAPSHOTS_DIR, str(data_set_id),
+                            '{}.npz'.format(name))
 
-    def _save(self, full_path, data):
-        with open(full_path, 'wb') as fd:
-            fd.write('\n'.join(data).encode())
-        return full_path
+    def save_snapshot(self, data_set_id, provider_id, snapshot):
+        """
+        :type snapshot: Snapshot
+        """
+        path = self._snapshot_path(data_set_id, provider_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        arrays = {
+            'hashes': snapshot.hashes,
+            'translations': np.frombuffer(json_encode(snapshot.translations), dtype=np.uint8),
+            'envelope': np.frombuffer(json_encode(snapshot.envelope), dtype=np.uint8),
+        }
+        for name, value in snapshot.stats.items():
+            for field, array in zip(value._fields, value):
+                arrays['{}.{}'.format(name, field)] = array
+        # readers in other processes never see a partial file
+        temp_path = '{}.{}.tmp'.format(path, os.getpid())
+        with open(temp_path, 'wb') as fd:
+            np.savez(fd, **arrays)
+        os.replace(temp_path, path)
+
+    def load_snapshot(self, data_set_id, provider_id):
+        """
+        :rtype: Snapshot or None
+        """
+        try:
+            arrays = np.load(self._snapshot_path(data_set_id, provider_id))
+        except FileNotFoundError:
+            return
+        with arrays:
+            stats = {}
+            for name in {key.split('.')[0] for key in arrays.files if '.' in key}:
+                stats_type = get_scorer(name).stats_type
+                stats[name] = stats_type(*[arrays['{}.{}'.format(name, field)]
+                                           for field in stats_type._fields])
+            hashes = arrays['hashes']
+            return Snapshot(version=data_set_version(hashes), hashes=hashes,
+                            translations=json_decode(arrays['translations'].tobytes()),
+                            envelope=json_decode(arrays['envelope'].tobytes()), stats=stats)
+
+
+class DataSetUpload:
+    """
+    A data set received in pieces. Lines are validated and written to staging
+    files as they arrive, ``commit`` compiles the data set from them and moves it
+    in place of the current one.
+    """
+
+    def __init__(self, staging_dir, data_set_dir, name, encoding='identity', max_bytes=None):
+        """
+        :param name: ``<lang_from>-<lang_to>``
+        :param encoding: content encoding of the data, identity, gzip or zstd
+        """
+        if encoding not in ('identity', 'gzip', 'zstd'):
+            raise ValueError('Not supported encoding: {}'.format(encoding))
+        if encoding == 'zstd':
+            _need_zstandard('zstd uploads')
+        self.staging_dir = staging_dir
+        self.data_set_dir = data_set_dir
+        self.name = name
+        self.encoding = encoding
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._decompressor = self._new_decompressor()
+        self._pending = b''
+        os.makedirs(staging_dir)
+        self._fd = open(os.path.join(staging_dir, name + TEXT_EXT), 'wb')
+        # the columns go to staging files as the lines arrive, not to memory
+        self._writer = CompiledWriter(staging_dir)
+
+    @property
+    def lines(self):
+        return self._writer.lines
+
+    def _new_decompressor(self):
+        if self.encoding == 'gzip':
+            # with the gzip header and trailer
+            return zlib.decompressobj(16 + zlib.MAX_WBITS)
+        if self.encoding == 'zstd':
+            return zstandard.ZstdDecompressor().decompressobj()
+
+    def _decompress(self, data):
+        if self._decompressor is None:
+            return data
+        errors = (zlib.error, zstandard.ZstdError) if zstandard is not None else zlib.error
+        try:
+            result = self._decompressor.decompress(data)
+            # concatenated gzip members
+            while (self.encoding == 'gzip' and self._decompressor.eof
+                   and self._decompressor.unused_data):
+                data = self._decompressor.unused_data
+                self._decompressor = self._new_decompressor()
+                result += self._decompressor.decompress(data)
+        except errors as exc:
+            raise ValueError('not valid {} data: {}'.format(self.encoding, exc))
+        return result
+
+    def _add_line(self, line):
+        number = self.lines + 1
+        try:
+            fields = line.decode().split('\t')
+        except UnicodeDecodeError:
+            raise ValueError('line {}: not valid UTF-8'.format(number))
+        fields = [field.strip() for field in fields]
+        if len(fields) != 2 or not all(fields):
+            raise ValueError('line {}: expected a source and a reference separated by a tab'
+                             .format(number))
+        self._writer.add(fields[0], fields[1])
+
+    def write(self, data):
+        """
+        :type data: bytes
+        :raises ValueError: at the first line which is not valid
+        """
+        data = self._decompress(data)
+        self.size += len(data)
+        if self.max_bytes is not None and self.size > self.max_bytes:
+            raise ValueError('data set larger than {} bytes'.format(self.max_bytes))
+        data = self._pending + data
+        end = data.rfind(b'\n') + 1
+        if end:
+            for line in data[:end - 1].split(b'\n'):
+                self._add_line(line)
+            self._fd.write(data[:end])
+        self._pending = data[end:]
+
+    def commit(self):
+        """
+        :return: number of lines of the data set
+        :raises ValueError: when the last line is not valid or there is none
+        """
+        if self._decompressor is not None and not self._decompressor.eof:
+            raise ValueError('truncated {} data'.format(self.encoding))
+        if self._pending.strip():
+            self._add_line(self._pending)
+            self._fd.write(self._pending + b'\n')
+        self._fd.close()
+        if not self.lines:
+            raise ValueError('empty data set')
+        self._writer.finish(os.path.join(self.staging_dir, self.name + COMPILED_EXT))
+
+        os.makedirs(self.data_set_dir, exist_ok=True)
+        previous = set(os.listdir(self.data_set_dir))
+        # the compiled file first, it is newer than the text and served at once
+        for file_name in (self.name + COMPILED_EXT, self.name + TEXT_EXT):
+            os.replace(os.path.join(self.staging_dir, file_name),
+                       os.path.join(self.data_set_dir, file_name))
+            previous.discard(file_name)
+        for file_name in previous:
+            os.remove(os.path.join(self.data_set_dir, file_name))
+        self.abort()
+        return self.lines
+
+    def abort(self):
+        self._fd.close()
+        self._writer.close()
+        shutil.rmtree(self.staging_dir, ignore_errors=True)
+
+
+class DataSetStream:
+    """
+    A text data set read by a thread of the manager.
+
+    ``chunks`` yields every chunk once, as soon as it is read, and ``data_set``
+    resolves to the whole ``DataSet`` when the file is read.
+    """
+
+    def __init__(self, lang_from, lang_to, estimated_lines=0):
+        self.lang_from = lang_from
+        self.lang_to = lang_to
+        self.estimated_lines = estimated_lines
+        self._io_loop = IOLoop.current()
+        self._chunks = Queue()
+        self._data_set = Future()
+
+    # called by the reading thread
+
+    def put(self, chunk):
+        self._io_loop.add_callback(self._chunks.put_nowait, chunk)
+
+    def finish(self, data_set=None, exc=None):
+        self._io_loop.add_callback(self._finish, data_set, exc)
+
+    def _finish(self, data_set, exc):
+        self._chunks.put_nowait(None)
+        if exc is not None:
+            self._data_set.set_exception(exc)
+        else:
+            self._data_set.set_result(data_set)
+
+    async def chunks(self):
+        """
+        :return: async iterator of lists of (source, reference) pairs
+        """
+        while True:
+            chunk = await self._chunks.get()
+            if chunk is None:
+                break
+            yield chunk
+        # a failed read is raised where the chunks are used
+        await self._data_set
+
+    async def data_set(self):
+        """
+        :rtype: DataSet
+        """
+        return await self._data_set
+
+
+class DataSetCache:
+    """
+    LRU cache of parsed data sets, bounded by the total number of lines.
+
+    Entries are stored with the signature of the file they were read from and
+    are dropped as soon as the file changes.
+    """
+
+    def __init__(self, max_lines):
+        self.max_lines = max_lines
+        self.lines = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, data_set_id, signature):
+        with self._lock:
+            entry = self._entries.get(data_set_id)
+            if entry is not None and entry[0] == signature:
+                self._entries.move_to_end(data_set_id)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                self._remove(data_set_id)
+            self.misses += 1
+
+    def put(self, data_set_id, signature, data_set):
+        size = len(data_set.original)
+        with self._lock:
+            if data_set_id in self._entries:
+                self._remove(data_set_id)
+            if size > self.max_lines:
+                return
+            while self._entries and self.lines + size > self.max_lines:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+            self._entries[data_set_id] = (signature, data_set)
+            self.lines += size
+
+    def signature_of(self, data_set_id, data_set):
+        """
+        :return: signature of the entry of ``data_set_id`` when it holds ``data_set``
+        """
+        with self._lock:
+            entry = self._entries.get(data_set_id)
+            if entry is not None and entry[1] is data_set:
+                return entry[0]
+
+    def _remove(self, data_set_id):
+        _, data_set = self._entries.pop(data_set_id)
+        self.lines -= len(data_set.original)
+
+    def stats(self):
+        requests = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'lines': self.lines,
+            'max_lines': self.max_lines,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / requests if requests else 0.0,
+        }
 
 
 class Manager:
     def __init__(self, *args, **kwargs):
         self.storage = kwargs.get('storage', DefaultStorage())
-        self.executor = ThreadPoolExecutor(max_workers=4)
+        self.executor = ThreadPoolExecutor(
+            max_workers=kwargs.get('threads', app_settings['manager_threads'])
+        )
+        self.data_set_cache = DataSetCache(
+            kwargs.get('cache_max_lines', app_settings['data_set_cache_lines'])
+        )
+        self.results_store = kwargs.get('results_store') or ResultsStore(
+            path=self.storage.results_base_path
+        )
+        # DataSetVersion of every data set with the signature it was computed for
+        self._versions = {}
 
     def get_from_to_languages(self, data_set_id):
-        file_name, ext = os.path.splitext(self.storage.get_file_name(data_set_id))
+        file_name, ext = split_file_name(self.storage.get_file_name(data_set_id))
         lang_from, lang_to = file_name.split('-')
         return lang_from, lang_to
 
-    @concurrent.run_on_executor
-    def get_data_set(self, data_set_id):
+    def _load_data_set(self, data_set_id):
         result = self.storage.open(data_set_id)
         lang_from, lang_to = self.get_from_to_languages(data_set_id)
+        if isinstance(result, CompiledDataSet):
+            # columns stay in the shared mapping, nothing is copied
+            return DataSet(original=result.original, translation=result.translation,
+                           lang_from=lang_from, lang_to=lang_to,
+                           reference_ngrams=result.reference_ngrams())
         original = []
         translation = []
 
@@ -100,15 +572,276 @@ class Manager:
             translation.append(transl)
 
         return DataSet(original=original, translation=translation,
-                       lang_from=lang_from, lang_to=lang_to)
-
-    @concurrent.run_on_executor
-    def save(self, data_set_id, response_data):
-        if isinstance(response_data, list):
-            saved_data = []
-            for result in response_data:
-                provider_id = result['service']['provider']
-                saved_data.append(self.storage.save(provider_id, data_set_id, response_data))
-            return saved_data
-        return self.storage.save(response_data['service']['provider']['id'],
-                                 data_set_id, response_data)
\ No newline at end of file
+                       lang_from=lang_from, lang_to=lang_to,
+                       reference_ngrams=ReferenceNgrams(tokenize(translation)))
+
+    def _get_data_set(self, data_set_id, signature):
+        data_set = self.data_set_cache.get(data_set_id, signature)
+        if data_set is None:
+            data_set = self._load_data_set(data_set_id)
+            self.data_set_cache.put(data_set_id, signature, data_set)
+        return data_set
+
+    @concurrent.run_on_executor
+    def get_data_set(self, data_set_id):
+        data_set_id = str(data_set_id)
+        return self._get_data_set(data_set_id, self.storage.get_signature(data_set_id))
+
+    def _get_version(self, data_set_id, signature, data_set=None):
+        entry = self._versions.get(data_set_id)
+        if entry is not None and entry[0] == signature:
+            return entry[1]
+        if data_set is None:
+            data_set = self._get_data_set(data_set_id, signature)
+        version = self._hash_data_set(data_set)
+        self._versions[data_set_id] = (signature, version)
+        return version
+
+    @staticmethod
+    def _hash_data_set(data_set):
+        hashes = line_hashes(data_set.original, data_set.translation)
+        return DataSetVersion(version=data_set_version(hashes), hashes=hashes)
+
+    @concurrent.run_on_executor
+    def get_data_set_version(self, data_set_id):
+        """
+        The hashes of the lines of the current content of a data set, computed
+        once per change of its file.
+
+        :rtype: DataSetVersion or None
+        """
+        data_set_id = str(data_set_id)
+        signature = self.storage.get_signature(data_set_id)
+        if signature is None:
+            return
+        return self._get_version(data_set_id, signature)
+
+    @concurrent.run_on_executor
+    def get_version_of(self, data_set_id, data_set):
+        """
+        The version of the content of ``data_set``, which the file of the data set
+        may no longer have; computed once while the data set is cached.
+
+        :rtype: DataSetVersion
+        """
+        data_set_id = str(data_set_id)
+        signature = self.data_set_cache.signature_of(data_set_id, data_set)
+        if signature is None:
+            return self._hash_data_set(data_set)
+        return self._get_version(data_set_id, signature, data_set)
+
+    @concurrent.run_on_executor
+    def get_versioned_data_set(self, data_set_id):
+        """
+        :rtype: tuple
+        :return: (DataSet, DataSetVersion) of the same content of the data set
+        """
+        data_set_id = str(data_set_id)
+        signature = self.storage.get_signature(data_set_id)
+        data_set = self._get_data_set(data_set_id, signature)
+        return data_set, self._get_version(data_set_id, signature, data_set)
+
+    @concurrent.run_on_executor
+    def load_snapshot(self, data_set_id, provider_id):
+        return self.storage.load_snapshot(data_set_id, provider_id)
+
+    @concurrent.run_on_executor
+    def save_snapshot(self, data_set_id, provider_id, snapshot):
+        self.storage.save_snapshot(data_set_id, provider_id, snapshot)
+
+    def _read_chunks(self, stream, data_set_id, signature, chunk_size):
+        original = []
+        translation = []
+        try:
+            for chunk in self.storage.iter_chunks(data_set_id, chunk_size):
+                stream.put(chunk)
+                for orig, transl in chunk:
+                    original.append(orig)
+                    translation.append(transl)
+            data_set = DataSet(original=original, translation=translation,
+                               lang_from=stream.lang_from, lang_to=stream.lang_to,
+                               reference_ngrams=ReferenceNgrams(tokenize(translation)))
+        except Exception as exc:
+            stream.finish(exc=exc)
+            return
+        self.data_set_cache.put(data_set_id, signature, data_set)
+        stream.finish(data_set)
+
+    @concurrent.run_on_executor
+    def estimate_lines(self, data_set_id):
+        return self.storage.estimate_lines(data_set_id)
+
+    async def open_data_set(self, data_set_id, chunk_size):
+        """
+        The data set when it is cached or compiled, otherwise a ``DataSetStream``
+        whose chunks can be used while the rest of the file is read.
+
+        :rtype: DataSet or DataSetStream
+        """
+        data_set_id = str(data_set_id)
+        signature = self.storage.get_signature(data_set_id)
+        if signature is None or signature[0].endswith(COMPILED_EXT):
+            return await self.get_data_set(data_set_id)
+        data_set = self.data_set_cache.get(data_set_id, signature)
+        if data_set is not None:
+            return data_set
+        lang_from, lang_to = self.get_from_to_languages(data_set_id)
+        stream = DataSetStream(lang_from, lang_to, await self.estimate_lines(data_set_id))
+        self.executor.submit(self._read_chunks, stream, data_set_id, signature, chunk_size)
+        return stream
+
+    def load_data_sets(self, data_set_ids=None):
+        """
+        Read data sets into the cache before the first request needs them. Called
+        before the server processes fork, they share the pages of compiled data sets.
+
+        :return: number of data sets read
+        """
+        if data_set_ids is None:
+            data_set_ids = app_settings['preload_data_sets']
+        loaded = 0
+        for data_set_id in data_set_ids:
+            try:
+                data_set_id = str(data_set_id)
+                self._get_data_set(data_set_id, self.storage.get_signature(data_set_id))
+            except Exception:
+                logging.exception('cannot preload data set %s', data_set_id)
+                continue
+            loaded += 1
+        return loaded
+
+    @concurrent.run_on_executor
+    def preload(self, data_set_ids=None):
+        return self.load_data_sets(data_set_ids)
+
+    def _result_record(self, data_set_id, response_data, timestamp, version=None):
+        score = response_data.get('score') or {}
+        try:
+            lang_from, lang_to = self.get_from_to_languages(data_set_id)
+        except (TypeError, ValueError):
+            lang_from = lang_to = None
+        record = {
+            'provider': response_data['service']['provider']['id'],
+            'data_set_id': str(data_set_id),
+            'timestamp': timestamp,
+            'lang_from': lang_from,
+            'lang_to': lang_to,
+            'data_set_version': version,
+            'result': response_data,
+        }
+        if isinstance(score, list):
+            # several score types requested at once
+            record['scores'] = {item['type']: item['value'] for item in score}
+        else:
+            record['score_type'] = score.get('type')
+            record['score'] = score.get('value')
+        return record
+
+    async def save(self, data_set_id, response_data, version=None):
+        """
+        Append evaluation results to the results store.
+
+        :param version: DataSetVersion of the data set the results were computed on
+        :return: record id, or the record ids of a multi-provider response
+        """
+        multi = isinstance(response_data, list)
+        timestamp = time.time()
+        records = [
+            self._result_record(data_set_id, result, timestamp,
+                                version.version if version is not None else None)
+            for result in (response_data if multi else [response_data])
+            if result.get('status') != 'error'
+        ]
+        future = Future()
+        with STAGE_SECONDS.time('save'):
+            chain_future(self.results_store.append_many(records), future)
+            record_ids = await future
+        return record_ids if multi else record_ids[0]
+
+    @concurrent.run_on_executor
+    def read_result(self, record_id):
+        return self.results_store.get(record_id)
+
+    @concurrent.run_on_executor
+    def results_history(self, provider_id, data_set_id, **kwargs):
+        return self.results_store.history(provider_id, data_set_id, **kwargs)
+
+    @concurrent.run_on_executor
+    def latest_results(self, data_set_id=None, **kwargs):
+        return self.results_store.latest(data_set_id, **kwargs)
+
+    @concurrent.run_on_executor
+    def leaderboard(self, lang_from, lang_to, **kwargs):
+        return self.results_store.leaderboard(lang_from, lang_to, **kwargs)
+
+    @concurrent.run_on_executor
+    def start_upload(self, data_set_id, lang_from, lang_to, encoding='identity'):
+        return self.storage.create_upload(data_set_id, lang_from, lang_to, encoding)
+
+    @concurrent.run_on_executor
+    def write_upload(self, upload, data):
+        upload.write(data)
+
+    @concurrent.run_on_executor
+    def commit_upload(self, upload):
+        return upload.commit()
+
+    @concurrent.run_on_executor
+    def abort_upload(self, upload):
+        upload.abort()
+
+    def _job_path(self, job_id, ext='.json'):
+        return os.path.join(self.storage.jobs_base_path, '{}{}'.format(job_id, ext))
+
+    @concurrent.run_on_executor
+    def save_job(self, state):
+        os.makedirs(self.storage.jobs_base_path, exist_ok=True)
+        path = self._job_path(state['id'])
+        # readers in other processes never see a partial file
+        temp_path = '{}.{}.tmp'.format(path, os.getpid())
+        with open(temp_path, 'wb') as fd:
+            fd.write(json_encode(state))
+        os.replace(temp_path, path)
+
+    def _read_job(self, path):
+        try:
+            with open(path, 'rb') as fd:
+                return json_decode(fd.read())
+        except (FileNotFoundError, json.JSONDecodeError):
+            return
+
+    @concurrent.run_on_executor
+    def get_job(self, job_id):
+        return self._read_job(self._job_path(job_id))
+
+    @concurrent.run_on_executor
+    def list_jobs(self):
+        if not os.path.isdir(self.storage.jobs_base_path):
+            return []
+        states = (self._read_job(os.path.join(self.storage.jobs_base_path, file_name))
+                  for file_name in sorted(os.listdir(self.storage.jobs_base_path))
+                  if file_name.endswith('.json'))
+        return [state for state in states if state is not None]
+
+    @concurrent.run_on_executor
+    def request_job_cancel(self, job_id):
+        # for the process which runs the job, see ``JobScheduler.sync``
+        open(self._job_path(job_id, '.cancel'), 'a').close()
+
+    def job_cancel_requested(self, job_id):
+        return os.path.exists(self._job_path(job_id, '.cancel'))
+
+    @concurrent.run_on_executor
+    def delete_job(self, job_id):
+        for ext in ('.json', '.cancel'):
+            try:
+                os.remove(self._job_path(job_id, ext))
+            except FileNotFoundError:
+                pass
+
+    @concurrent.run_on_executor
+    def compact_results(self):
+        return self.results_store.compact(
+            min_live_ratio=app_settings['results_min_live_ratio'],
+            max_age=app_settings['results_retention'],
+        )
@@ -0,0 +1,205 @@
+"""
+Production process model: a supervisor process which forks the scoring server
+and ``io_workers`` HTTP server processes sharing the listening sockets.
+
+    SIGTERM, SIGINT  drain the HTTP processes, then stop the scoring server
+    SIGHUP           restart the HTTP processes one at a time, a new one is
+                     started and, with a ``ready_timeout``, ready before the
+                     old one drains
+
+An HTTP process reports it is ready with ``notify_ready``.
+"""
+import logging
+import os
+import select
+import signal
+import time
+
+# seconds between two checks of the children
+POLL_INTERVAL = 0.1
+
+# write end of the pipe a forked HTTP process reports its readiness on
+_ready_fd = None
+
+
+def notify_ready():
+    """
+    Tell the supervisor this HTTP process is ready for requests; does nothing in a
+    process the supervisor did not start or which reported before.
+    """
+    global _ready_fd
+    if _ready_fd is None:
+        return
+    try:
+        os.write(_ready_fd, b'1')
+    except OSError:
+        pass
+    os.close(_ready_fd)
+    _ready_fd = None
+
+
+def _fork(target, *args):
+    pid = os.fork()
+    if pid:
+        return pid
+    # the children install their own handlers
+    for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+        signal.signal(signum, signal.SIG_DFL)
+    status = 0
+    try:
+        target(*args)
+    except BaseException:
+        logging.exception('process failed: %s', os.getpid())
+        status = 1
+    finally:
+        os._exit(status)
+
+
+class Supervisor:
+
+    def __init__(self, worker_target, workers, scoring_target=None, drain_timeout=30,
+                 ready_timeout=0):
+        """
+        :param worker_target: function run by every HTTP process, which drains and
+            returns on SIGTERM
+        :param scoring_target: function run by the scoring server process
+        :param ready_timeout: seconds a rolling restart waits for the new process to
+            call ``notify_ready``, 0 does not wait
+        """
+        self.worker_target = worker_target
+        self.workers = workers
+        self.scoring_target = scoring_target
+        self.drain_timeout = drain_timeout
+        self.ready_timeout = ready_timeout
+        self.scoring_pid = None
+        self.worker_pids = set()
+        self.restarts = 0
+        self._stopping = False
+        self._to_restart = []
+        self._draining = {}
+        # read end of the readiness pipe and deadline of the processes starting
+        self._starting = {}
+        self._replacing = False
+
+    def _start_scoring(self):
+        if self.scoring_target is not None:
+            self.scoring_pid = _fork(self.scoring_target)
+
+    def _run_worker(self, read_fd, write_fd):
+        global _ready_fd
+        os.close(read_fd)
+        for fd, _ in self._starting.values():
+            os.close(fd)
+        _ready_fd = write_fd
+        self.worker_target()
+
+    def _start_worker(self):
+        if not self.ready_timeout:
+            self.worker_pids.add(_fork(self.worker_target))
+            return
+        read_fd, write_fd = os.pipe()
+        pid = _fork(self._run_worker, read_fd, write_fd)
+        os.close(write_fd)
+        self.worker_pids.add(pid)
+        self._starting[pid] = (read_fd, time.monotonic() + self.ready_timeout)
+
+    def _started(self, pid):
+        read_fd, _ = self._starting.pop(pid)
+        os.close(read_fd)
+
+    def _check_ready(self):
+        if not self._starting:
+            return
+        pids = {read_fd: pid for pid, (read_fd, _) in self._starting.items()}
+        readable, _, _ = select.select(list(pids), [], [], 0)
+        for read_fd in readable:
+            # nothing to read when the process exited before it was ready
+            if not os.read(read_fd, 1):
+                logging.warning('server process %s exited before it was ready', pids[read_fd])
+            self._started(pids[read_fd])
+        now = time.monotonic()
+        for pid, (_, deadline) in list(self._starting.items()):
+            if now > deadline:
+                logging.warning('server process %s not ready after %ss', pid, self.ready_timeout)
+                self._started(pid)
+
+    def _on_stop(self, signum, frame):
+        self._stopping = True
+
+    def _on_restart(self, signum, frame):
+        self._to_restart = [pid for pid in self.worker_pids if pid not in self._draining]
+
+    def _terminate(self, pid):
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            return
+        self._draining.setdefault(pid, time.monotonic() + self.drain_timeout)
+
+    def _reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if not pid:
+                return
+            self._draining.pop(pid, None)
+            if pid in self._starting:
+                self._started(pid)
+            if pid == self.scoring_pid:
+                self.scoring_pid = None
+                if not self._stopping or self.worker_pids:
+                    logging.warning('scoring server exited with %s, restarting', status)
+                    self.restarts += 1
+                    self._start_scoring()
+            elif pid in self.worker_pids:
+                self.worker_pids.discard(pid)
+                if pid in self._to_restart:
+                    if pid == self._to_restart[0]:
+                        # replaced, by the process started for it if there is one
+                        self._replacing = False
+                    self._to_restart.remove(pid)
+                elif not self._stopping:
+                    logging.warning('server process %s exited with %s, restarting', pid, status)
+                    self.restarts += 1
+                    self._start_worker()
+
+    def _kill_stuck(self):
+        now = time.monotonic()
+        for pid, deadline in list(self._draining.items()):
+            if now > deadline:
+                logging.warning('process %s did not drain in time, killing it', pid)
+                os.kill(pid, signal.SIGKILL)
+                self._draining[pid] = float('inf')
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self._on_stop)
+        signal.signal(signal.SIGINT, self._on_stop)
+        signal.signal(signal.SIGHUP, self._on_restart)
+        self._start_scoring()
+        for _ in range(self.workers):
+            self._start_worker()
+
+        while self.worker_pids or self.scoring_pid:
+            if self._stopping:
+                for pid in self.worker_pids:
+                    if pid not in self._draining:
+                        self._terminate(pid)
+                # the workers need the scoring server until they are drained
+                if not self.worker_pids and self.scoring_pid and \
+                        self.scoring_pid not in self._draining:
+                    self._terminate(self.scoring_pid)
+            elif self._to_restart and not self._draining and not self._starting:
+                if self._replacing:
+                    # the new process is ready, the old one drains
+                    self._terminate(self._to_restart[0])
+                    self._replacing = False
+                else:
+                    self._start_worker()
+                    self._replacing = True
+            self._check_ready()
+            self._kill_stuck()
+            time.sleep(POLL_INTERVAL)
+            self._reap()
+        logging.info('all processes stopped')
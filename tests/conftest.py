@@ -1,12 +1,23 @@
 import pytest
-
+import tornado.escape
+import tornado.httpserver
+import tornado.testing
+import tornado.web
+
+from admission import AdmissionController
+from app import EVALUATE_URL, App
+from scoring import ScoringEngine
+from settings import proxy_path
 from storage import DataSet, DefaultStorage, Manager
+from translation_cache import TranslationCache
+from upstream import UpstreamClient
 
 
 @pytest.fixture
 def create_storage(tmpdir):
     return DefaultStorage(data_set_base_path=str(tmpdir),
-                          results_base_path=str(tmpdir))
+                          results_base_path=str(tmpdir),
+                          jobs_base_path=str(tmpdir.join('jobs')))
 
 
 @pytest.fixture
@@ -14,6 +25,11 @@ def manager(create_storage):
     return Manager(storage=create_storage)
 
 
+@pytest.fixture
+def translation_cache(tmpdir):
+    return TranslationCache(path=str(tmpdir.join('cache', 'translations.sqlite')))
+
+
 @pytest.fixture
 def provider_id():
     return 'some.provider.id'
@@ -57,12 +73,74 @@ def data_set():
     return [text, text]
 
 
+@pytest.fixture
+def create_data_set(data_set, tmpdir, data_set_name, data_set_id):
+    full_path = tmpdir.mkdir(str(data_set_id)).join('{}.txt'.format(data_set_name))
+    full_path.write('\n'.join(data_set).encode())
+    return full_path
+
+
 @pytest.fixture
 def data_set_parsed_from_en_to_ru():
     original = ['The social card of residents of Ivanovo region is to be recognised',
                 'The social card of residents of Ivanovo region is to be recognised']
 
-    translated = ['Социальная карта жителя Ивановской области признается электронным средством платежа',
-                  'Социальная карта жителя Ивановской области признается электронным средством платежа']
+    translated = ['Социальная карта жителя Ивановской области признается '
+                  'электронным средством платежа',
+                  'Социальная карта жителя Ивановской области признается '
+                  'электронным средством платежа']
 
     return DataSet(lang_from='en', lang_to='ru', original=original, translation=translated)
+
+
+class FakeProviderHandler(tornado.web.RequestHandler):
+    """
+    Upstream stand-in which "translates" by echoing the text back.
+    """
+
+    def post(self):
+        payload = tornado.escape.json_decode(self.request.body)
+        self.application.requests.append(payload)
+        if payload['service']['provider'] == 'broken.provider':
+            raise tornado.web.HTTPError(500)
+        if (payload['service']['provider'] == 'flaky.provider'
+                and len(self.application.requests) == 1):
+            raise tornado.web.HTTPError(503)
+        self.write({
+            'results': payload['context']['text'],
+            'meta': {},
+            'service': {'provider': {'id': payload['service']['provider'], 'name': 'Fake'}},
+        })
+
+
+@pytest.fixture
+async def upstream(monkeypatch):
+    application = tornado.web.Application([('/translate', FakeProviderHandler)])
+    application.requests = []
+    sock, port = tornado.testing.bind_unused_port()
+    server = tornado.httpserver.HTTPServer(application)
+    server.add_sockets([sock])
+    monkeypatch.setitem(proxy_path, EVALUATE_URL, 'http://127.0.0.1:{}/translate'.format(port))
+    yield application
+    server.stop()
+
+
+@pytest.fixture
+def admission_controller():
+    return AdmissionController()
+
+
+@pytest.fixture
+async def app_url(manager, translation_cache, admission_controller, upstream):
+    scoring_engine = ScoringEngine(max_workers=1)
+    upstream_client = UpstreamClient()
+    sock, port = tornado.testing.bind_unused_port()
+    server = tornado.httpserver.HTTPServer(App(manager=manager, scoring_engine=scoring_engine,
+                                               translation_cache=translation_cache,
+                                               upstream_client=upstream_client,
+                                               admission_controller=admission_controller))
+    server.add_sockets([sock])
+    yield 'http://127.0.0.1:{}'.format(port)
+    server.stop()
+    scoring_engine.shutdown()
+    upstream_client.close()
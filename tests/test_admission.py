@@ -0,0 +1,97 @@
+import asyncio
+
+import pytest
+import tornado.gen
+
+from admission import AdmissionController, Overloaded
+
+
+@pytest.fixture
+def controller():
+    return AdmissionController(capacity=4, lines_per_unit=100, max_queue=2, queue_timeout=0.05,
+                               retry_after=7)
+
+
+def test_weight_by_lines(controller):
+    assert controller.weight(0) == 1
+    assert controller.weight(100) == 1
+    assert controller.weight(101) == 2
+    assert controller.weight(10 ** 6) == controller.capacity
+
+
+@pytest.mark.asyncio
+async def test_admit_and_release(controller):
+    async with controller.admit(250):
+        assert controller.stats()['in_use'] == 3
+        assert controller.stats()['in_flight'] == 1
+    assert controller.stats()['in_use'] == 0
+    assert controller.stats()['admitted'] == 1
+
+
+@pytest.mark.asyncio
+async def test_waiters_are_admitted_in_order(controller):
+    order = []
+
+    async def evaluation(name, lines, duration):
+        async with controller.admit(lines):
+            order.append(name)
+            await tornado.gen.sleep(duration)
+
+    controller.queue_timeout = 1
+    await tornado.gen.multi([evaluation('large', 400, 0.02),
+                             evaluation('medium', 300, 0.01),
+                             evaluation('small', 100, 0.01)])
+    assert order == ['large', 'medium', 'small']
+
+
+@pytest.mark.asyncio
+async def test_queue_full_is_rejected(controller):
+    await controller.acquire(4)
+    queued = [tornado.gen.convert_yielded(controller.acquire(1)) for _ in range(2)]
+    await tornado.gen.sleep(0)
+    with pytest.raises(Overloaded) as excinfo:
+        await controller.acquire(1)
+    assert excinfo.value.retry_after == 7
+    assert controller.stats()['queued'] == 2
+    assert controller.stats()['rejected'] == 1
+
+    controller.release(4)
+    await tornado.gen.multi(queued)
+    assert controller.stats()['in_use'] == 2
+
+
+@pytest.mark.asyncio
+async def test_queue_deadline(controller):
+    await controller.acquire(4)
+    with pytest.raises(Overloaded):
+        await controller.acquire(1)
+    stats = controller.stats()
+    assert stats['timed_out'] == 1
+    assert stats['queued'] == 0
+
+
+@pytest.mark.asyncio
+async def test_cancelled_waiters_give_their_units_back(controller):
+    controller.queue_timeout = 1
+
+    async def evaluation():
+        async with controller.admit(100):
+            await tornado.gen.sleep(1)
+
+    await controller.acquire(4)
+    queued = asyncio.ensure_future(evaluation())
+    await tornado.gen.sleep(0)
+    queued.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await queued
+    assert controller.stats()['queued'] == 0
+
+    # cancelled after it was admitted, before it resumed
+    granted = asyncio.ensure_future(evaluation())
+    await tornado.gen.sleep(0)
+    controller.release(4)
+    granted.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await granted
+    stats = controller.stats()
+    assert (stats['in_use'], stats['in_flight'], stats['queued']) == (0, 0, 0)
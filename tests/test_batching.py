@@ -0,0 +1,50 @@
+from batching import BatchPlanner, retry_delay
+from settings import app_settings
+
+
+def test_plan_limits():
+    planner = BatchPlanner(items=3, max_items=10, max_chars=100, max_bytes=1000)
+    assert planner.plan(['a'] * 7) == [(0, 3), (3, 6), (6, 7)]
+    assert planner.plan([]) == []
+
+    planner = BatchPlanner(items=10, max_chars=10, max_bytes=1000)
+    # a text beyond the limit is sent on its own
+    assert planner.plan(['abcd', 'efgh', 'ijk', 'a' * 20, 'b']) == [(0, 2), (2, 3), (3, 4), (4, 5)]
+
+    planner = BatchPlanner(items=10, max_chars=100, max_bytes=20)
+    # two bytes a letter, plus the quotes and the separator
+    assert planner.plan(['фыва', 'ячсм', 'a']) == [(0, 1), (1, 3)]
+
+
+def test_additive_increase_multiplicative_decrease():
+    planner = BatchPlanner(items=10, max_items=30, increase=10, decrease=0.5, latency_target=1)
+    planner.completed(10, 0.1)
+    assert planner.items == 20
+    # a batch of half the size adds half as much
+    planner.completed(10, 0.1)
+    assert planner.items == 25
+    planner.completed(25, 0.1)
+    planner.completed(30, 0.1)
+    assert planner.items == 30
+
+    planner.completed(30, 2.0)
+    assert planner.items == 15
+    # the other batches in flight saw the same slow down
+    planner.throttled()
+    assert planner.items == 15
+    assert planner.stats()['decreases'] == 1
+    assert planner.stats()['throttled'] == 1
+
+    planner.too_large(12)
+    assert planner.items == planner.max_items == 6
+    planner.completed(6, 0.1)
+    assert planner.items == 6
+
+
+def test_retry_delay(monkeypatch):
+    monkeypatch.setitem(app_settings, 'upstream_retry_backoff', 1)
+    monkeypatch.setitem(app_settings, 'upstream_retry_backoff_max', 10)
+    assert all(0 <= retry_delay(2) <= 4 for _ in range(100))
+    assert retry_delay(20) <= 10
+    assert retry_delay(0, retry_after=3) == 3
+    assert retry_delay(0, retry_after=60) == 10
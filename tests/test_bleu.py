@@ -0,0 +1,71 @@
+import random
+
+import numpy as np
+import pytest
+from nltk.translate.bleu_score import SmoothingFunction, corpus_bleu, sentence_bleu
+
+from utils import (ReferenceNgrams, bleu_statistics, compute_bleu_statistics,
+                   corpus_bleu_from_stats, merge_bleu_stats, sentence_bleu_from_stats, tokenize)
+
+
+def random_corpus(seed, segments, vocabulary=30, max_length=15):
+    rnd = random.Random(seed)
+    words = [str(i) for i in range(vocabulary)]
+
+    def sentence():
+        return ' '.join(rnd.choices(words[:rnd.randint(2, vocabulary)],
+                                    k=rnd.randint(1, max_length)))
+    return [sentence() for _ in range(segments)], [sentence() for _ in range(segments)]
+
+
+def nltk_corpus_bleu(references, hypothesis):
+    return corpus_bleu([[ref] for ref in tokenize(references)], tokenize(hypothesis),
+                       smoothing_function=SmoothingFunction().method4)
+
+
+@pytest.mark.parametrize('seed', range(50))
+def test_corpus_bleu_parity(seed):
+    references, hypothesis = random_corpus(seed, segments=seed % 25 + 1)
+    stats = compute_bleu_statistics(references, hypothesis)
+    assert corpus_bleu_from_stats(stats) == pytest.approx(
+        nltk_corpus_bleu(references, hypothesis), abs=1e-12
+    )
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_sentence_bleu_parity(seed):
+    references, hypothesis = random_corpus(seed, segments=20)
+    expected = [
+        sentence_bleu([ref], hyp, smoothing_function=SmoothingFunction().method4)
+        for ref, hyp in zip(tokenize(references), tokenize(hypothesis))
+    ]
+    scores = sentence_bleu_from_stats(compute_bleu_statistics(references, hypothesis))
+    assert np.allclose(scores, expected, rtol=0, atol=1e-12)
+
+
+@pytest.mark.parametrize('shard_size', [1, 3, 7, 100])
+def test_sharded_statistics_merge_exactly(shard_size):
+    references, hypothesis = random_corpus(42, segments=50)
+    reference_ngrams = ReferenceNgrams(tokenize(references))
+    shards = [
+        bleu_statistics(tokenize(hypothesis[start:start + shard_size]),
+                        reference_ngrams.slice(start, start + shard_size))
+        for start in range(0, len(hypothesis), shard_size)
+    ]
+    merged = merge_bleu_stats(shards)
+    single = compute_bleu_statistics(references, hypothesis)
+    for merged_field, single_field in zip(merged, single):
+        assert (merged_field == single_field).all()
+    assert corpus_bleu_from_stats(merged) == corpus_bleu_from_stats(single)
+
+
+def test_identical_and_disjoint_corpora():
+    references = ['the cat is on the mat', 'there is a cat on the mat']
+    assert corpus_bleu_from_stats(compute_bleu_statistics(references, references)) == 1.0
+    assert corpus_bleu_from_stats(compute_bleu_statistics(references, ['x y z', 'q'])) == 0
+
+
+def test_clipping():
+    stats = compute_bleu_statistics(['the cat is on the mat'], ['the the the the the the the'])
+    assert stats.matches[0, 0] == 2
+    assert stats.totals[0].tolist() == [7, 6, 5, 4]
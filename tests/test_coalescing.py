@@ -0,0 +1,92 @@
+import pytest
+import tornado.gen
+
+from coalescing import RequestCoalescer
+
+
+def test_key_is_canonical():
+    first = RequestCoalescer.make_key({'context': {'a': 1, 'b': 2}, 'service': 'x'}, 'key')
+    second = RequestCoalescer.make_key({'service': 'x', 'context': {'b': 2, 'a': 1}}, 'key')
+    assert first == second
+    assert first != RequestCoalescer.make_key({'context': {'a': 1, 'b': 2}, 'service': 'x'},
+                                              'other key')
+
+
+@pytest.mark.asyncio
+async def test_concurrent_calls_share_one_execution():
+    coalescer = RequestCoalescer(memo_ttl=0)
+    calls = []
+
+    async def evaluation():
+        calls.append(1)
+        await tornado.gen.sleep(0.01)
+        return {'score': 1}
+
+    results = await tornado.gen.multi([coalescer.run('key', evaluation) for _ in range(3)])
+    assert len(calls) == 1
+    assert results[0] is results[1] is results[2]
+    assert coalescer.stats()['coalesced'] == 2
+
+    await coalescer.run('key', evaluation)
+    assert len(calls) == 2
+
+
+@pytest.mark.asyncio
+async def test_memo():
+    coalescer = RequestCoalescer(memo_ttl=60)
+    calls = []
+
+    async def evaluation():
+        calls.append(1)
+        return len(calls)
+
+    assert await coalescer.run('key', evaluation) == 1
+    assert await coalescer.run('key', evaluation) == 1
+    assert await coalescer.run('other', evaluation) == 2
+    assert coalescer.stats()['memo_hits'] == 1
+
+
+@pytest.mark.asyncio
+async def test_errors_are_shared_and_not_memoized():
+    coalescer = RequestCoalescer(memo_ttl=60)
+
+    async def evaluation():
+        await tornado.gen.sleep(0.01)
+        raise ValueError('upstream failed')
+
+    outcomes = await tornado.gen.multi([_capture(coalescer.run('key', evaluation))
+                                        for _ in range(2)])
+    assert all(isinstance(outcome, ValueError) for outcome in outcomes)
+    assert coalescer.stats()['executed'] == 1
+    assert coalescer.stats()['memo_entries'] == 0
+    assert coalescer.stats()['in_flight'] == 0
+
+
+@pytest.mark.asyncio
+async def test_failed_outcomes_are_shared_and_not_memoized():
+    coalescer = RequestCoalescer(memo_ttl=60)
+    outcomes = [(503, {'Retry-After': '1'}, {'status': 'error'}), (200, {}, {'score': 1})]
+
+    async def evaluation():
+        await tornado.gen.sleep(0.01)
+        return outcomes.pop(0)
+
+    def succeeded(outcome):
+        return outcome[0] == 200
+
+    failed = await tornado.gen.multi([coalescer.run('key', evaluation, succeeded)
+                                      for _ in range(2)])
+    assert [outcome[0] for outcome in failed] == [503, 503]
+    assert coalescer.stats()['memo_entries'] == 0
+    # the next request runs again, its success is reused
+    assert (await coalescer.run('key', evaluation, succeeded))[0] == 200
+    assert (await coalescer.run('key', evaluation, succeeded))[0] == 200
+    assert coalescer.stats()['executed'] == 2
+    assert coalescer.stats()['memo_hits'] == 1
+
+
+async def _capture(awaitable):
+    try:
+        return await awaitable
+    except ValueError as exc:
+        return exc
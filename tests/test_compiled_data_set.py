@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+
+from compiled_data_set import CompiledDataSet, CompiledWriter, MappedColumn, write_compiled
+from utils import ReferenceNgrams, tokenize
+
+
+@pytest.fixture
+def pairs():
+    return [('The social card', 'Социальная карта'),
+            ('is to be recognised', 'признается'),
+            ('', ''),
+            ('as an electronic payment instrument', 'электронным средством платежа')]
+
+
+@pytest.fixture
+def compiled_path(tmpdir, pairs):
+    return write_compiled(str(tmpdir.join('en-ru.bin')), pairs)
+
+
+def test_columns(compiled_path, pairs):
+    compiled = CompiledDataSet(compiled_path)
+    assert len(compiled) == len(pairs)
+    assert list(compiled.original) == [source for source, _ in pairs]
+    assert list(compiled.translation) == [reference for _, reference in pairs]
+    assert compiled.translation[-1] == pairs[-1][1]
+    with pytest.raises(IndexError):
+        compiled.original[len(pairs)]
+
+
+def test_slices_are_views(compiled_path, pairs):
+    column = CompiledDataSet(compiled_path).translation
+    piece = column[1:3]
+    assert isinstance(piece, MappedColumn)
+    assert list(piece) == [pairs[1][1], pairs[2][1]]
+    assert list(column[3:1]) == []
+    assert column[::2] == [pairs[0][1], pairs[2][1]]
+
+
+@pytest.mark.parametrize('with_tokens', [True, False])
+def test_reference_ngrams(tmpdir, pairs, with_tokens):
+    path = write_compiled(str(tmpdir.join('en-ru.bin')), pairs, with_tokens=with_tokens)
+    compiled = CompiledDataSet(path)
+    assert compiled.has_tokens == with_tokens
+    expected = ReferenceNgrams(tokenize([reference for _, reference in pairs]))
+    reference_ngrams = compiled.reference_ngrams()
+    assert reference_ngrams.tokens == expected.tokens
+    for n in range(1, expected.max_order + 1):
+        assert np.array_equal(reference_ngrams.counts[n][0], expected.counts[n][0])
+        assert np.array_equal(reference_ngrams.counts[n][1], expected.counts[n][1])
+
+
+def test_writer_streams_the_columns(tmpdir, pairs, compiled_path):
+    staging = tmpdir.mkdir('staging')
+    writer = CompiledWriter(str(staging))
+    for source, reference in pairs:
+        writer.add(source, reference)
+    writer.close()
+    # the lines are on disk before the file is compiled
+    assert staging.join('reference').read_binary() == \
+        ''.join(reference for _, reference in pairs).encode()
+
+    writer = CompiledWriter(str(staging))
+    for source, reference in pairs:
+        writer.add(source, reference)
+    path = writer.finish(str(tmpdir.join('streamed.bin')))
+    with open(path, 'rb') as streamed, open(compiled_path, 'rb') as compiled:
+        assert streamed.read() == compiled.read()
+    # no temporary file is left next to it
+    assert not tmpdir.listdir(lambda path: path.basename.startswith('.'))
+
+
+def test_not_compiled(tmpdir):
+    path = tmpdir.join('en-ru.bin')
+    path.write(b'\0' * 256)
+    with pytest.raises(ValueError):
+        CompiledDataSet(str(path))
@@ -0,0 +1,150 @@
+import os
+import subprocess
+import sys
+
+import pytest
+import tornado.gen
+from tornado.locks import Event
+
+from jobs import CANCELLED, DONE, FAILED, QUEUED, RUNNING, Job, JobScheduler, QueueFull
+
+
+@pytest.fixture
+def scheduler(manager):
+    return JobScheduler(manager=manager, max_concurrent=1, max_queue=2, retention=60)
+
+
+async def wait_for(scheduler, job_id, states):
+    for _ in range(100):
+        state = await scheduler.get(job_id)
+        if state['state'] in states:
+            return state
+        await tornado.gen.sleep(0.01)
+    raise AssertionError('job {} is {}'.format(job_id, state['state']))
+
+
+@pytest.mark.asyncio
+async def test_jobs_run_by_priority(scheduler):
+    order = []
+    release = Event()
+
+    async def runner(job):
+        order.append(job.priority)
+        await release.wait()
+        return 200, {}, {'priority': job.priority}
+
+    first = await scheduler.submit(runner)
+    low = await scheduler.submit(runner, priority=1)
+    high = await scheduler.submit(runner, priority=5)
+    with pytest.raises(QueueFull):
+        await scheduler.submit(runner)
+    assert scheduler.stats()['running'] == 1
+    assert scheduler.stats()['queued'] == 2
+
+    release.set()
+    state = await wait_for(scheduler, low.id, (DONE,))
+    assert state['result'] == {'priority': 1}
+    assert state['status_code'] == 200
+    assert order == [0, 5, 1]
+    # finished jobs are read back from their persisted state
+    assert first.id not in scheduler.jobs
+    assert (await scheduler.get(high.id))['state'] == DONE
+    assert scheduler.stats()['completed'] == 3
+
+
+@pytest.mark.asyncio
+async def test_cancel_running_and_queued_jobs(scheduler):
+    started = Event()
+    cancelled = []
+
+    async def runner(job):
+        started.set()
+        try:
+            await tornado.gen.sleep(10)
+        except BaseException:
+            cancelled.append(job.id)
+            raise
+
+    running = await scheduler.submit(runner)
+    queued = await scheduler.submit(runner)
+    await started.wait()
+    assert await scheduler.cancel(queued.id)
+    assert await scheduler.cancel(running.id)
+    assert (await wait_for(scheduler, running.id, (CANCELLED,)))['finished'] is not None
+    assert cancelled == [running.id]
+    assert (await scheduler.get(queued.id))['state'] == CANCELLED
+    assert not await scheduler.cancel('unknown')
+
+
+@pytest.mark.asyncio
+async def test_cancel_job_which_just_finished(scheduler, monkeypatch):
+    persisting, release = Event(), Event()
+    persist = scheduler._persist
+
+    async def slow_persist(job):
+        if job.state == DONE:
+            persisting.set()
+            await release.wait()
+        await persist(job)
+
+    async def runner(job):
+        return 200, {}, {}
+
+    monkeypatch.setattr(scheduler, '_persist', slow_persist)
+    job = await scheduler.submit(runner)
+    await persisting.wait()
+    # finished, its state not persisted yet
+    assert job.id in scheduler.jobs
+    assert await scheduler.cancel(job.id)
+    release.set()
+    assert (await wait_for(scheduler, job.id, (DONE, CANCELLED)))['state'] == DONE
+
+
+@pytest.mark.asyncio
+async def test_failures_and_progress(scheduler):
+    async def failing(job):
+        job.add_progress(total=4)
+        job.add_progress(completed=1)
+        await scheduler.sync()
+        raise RuntimeError('broken')
+
+    job = await scheduler.submit(failing)
+    state = await wait_for(scheduler, job.id, (FAILED,))
+    assert state['detail'] == 'broken'
+    assert state['progress'] == 0.25
+
+    async def rejected(job):
+        return 500, {}, {'status': 'error', 'detail': 'upstream failed'}
+
+    job = await scheduler.submit(rejected)
+    assert (await wait_for(scheduler, job.id, (FAILED,)))['detail'] == 'upstream failed'
+
+
+@pytest.mark.asyncio
+async def test_cancellation_requested_by_another_process(scheduler, manager):
+    async def runner(job):
+        await tornado.gen.sleep(10)
+
+    job = await scheduler.submit(runner)
+    await wait_for(scheduler, job.id, (RUNNING,))
+    await manager.request_job_cancel(job.id)
+    await scheduler.sync()
+    assert (await wait_for(scheduler, job.id, (CANCELLED,)))['state'] == CANCELLED
+
+
+@pytest.mark.asyncio
+async def test_recover(scheduler, manager):
+    dead = subprocess.Popen([sys.executable, '-c', 'pass'])
+    dead.wait()
+    orphan = Job(pid=dead.pid, state=RUNNING)
+    alive = Job(pid=os.getppid(), state=QUEUED)
+    expired = Job(state=DONE, finished=1)
+    for job in (orphan, alive, expired):
+        await manager.save_job(job.to_dict())
+
+    await scheduler.recover()
+    recovered = await manager.get_job(orphan.id)
+    assert recovered['state'] == FAILED
+    assert recovered['detail'] == 'Interrupted by a restart'
+    assert (await manager.get_job(alive.id))['state'] == QUEUED
+    assert await manager.get_job(expired.id) is None
@@ -0,0 +1,25 @@
+import numpy as np
+import pytest
+
+import json_codec
+from json_codec import JsonCodec, JsonTemplate
+
+
+@pytest.mark.parametrize('backend', ['json', 'auto'])
+def test_round_trip(backend):
+    codec = JsonCodec(backend)
+    value = {'text': ['Социальная карта', '"quoted"'], 'score': np.float64(0.5),
+             'counts': np.arange(3)}
+    encoded = codec.encode(value)
+    assert isinstance(encoded, bytes)
+    assert codec.decode(encoded) == {'text': ['Социальная карта', '"quoted"'], 'score': 0.5,
+                                     'counts': [0, 1, 2]}
+
+
+def test_template():
+    document = {'context': {'text': None, 'to': 'ru'}, 'service': {'provider': 'p'}}
+    template = JsonTemplate(document, ('context', 'text'))
+    assert document['context']['text'] is None
+    for texts in (['one', 'два'], []):
+        rendered = json_codec.json_decode(template.render(texts))
+        assert rendered == {'context': {'text': texts, 'to': 'ru'}, 'service': {'provider': 'p'}}
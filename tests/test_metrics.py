@@ -0,0 +1,67 @@
+import json
+import math
+import os
+
+import pytest
+from tornado import gen
+
+from metrics import IOLOOP_LAG_SECONDS, LoopLagMonitor, Registry
+
+
+@pytest.fixture
+def registry(tmpdir):
+    return Registry(directory=str(tmpdir))
+
+
+def test_histogram_exposition(registry):
+    histogram = registry.histogram('stage_seconds', 'Stages.', ['stage'], buckets=(0.1, 1))
+    histogram.observe(0.05, 'scoring')
+    histogram.observe(0.5, 'scoring')
+    histogram.observe(5, 'scoring')
+    lines = registry.exposition().splitlines()
+    assert lines[:2] == ['# HELP stage_seconds Stages.', '# TYPE stage_seconds histogram']
+    assert lines[2:] == [
+        'stage_seconds_bucket{stage="scoring",le="0.1"} 1',
+        'stage_seconds_bucket{stage="scoring",le="1"} 2',
+        'stage_seconds_bucket{stage="scoring",le="+Inf"} 3',
+        'stage_seconds_sum{stage="scoring"} 5.55',
+        'stage_seconds_count{stage="scoring"} 3',
+    ]
+    assert histogram.buckets[-1] == math.inf
+
+
+def test_merge_processes(registry, tmpdir):
+    counter = registry.counter('lookups_total', 'Lookups.', ['cache'])
+    lag = registry.gauge('lag_seconds', 'Lag.', aggregate='max')
+    histogram = registry.histogram('request_seconds', 'Requests.', buckets=(1,))
+    counter.inc('data_set', amount=2)
+    lag.set(0.2)
+    histogram.observe(0.5)
+    other_process = registry.snapshot()
+    other_process['lag_seconds']['values'] = [[[], 0.7]]
+    # the parent process stands in for a live worker, the pid of a dead one is dropped
+    tmpdir.join('{}.json'.format(os.getppid())).write(json.dumps(other_process))
+    tmpdir.join('999999999.json').write(json.dumps(other_process))
+
+    collected = registry.collect()
+    assert collected['lookups_total'] == {('data_set',): 4}
+    assert collected['lag_seconds'] == {(): 0.7}
+    assert collected['request_seconds'] == {(): [[2, 0], 1.0]}
+    assert not tmpdir.join('999999999.json').check()
+
+
+def test_collectors_run_before_snapshot(registry):
+    gauge = registry.gauge('in_flight', 'In flight.')
+    registry.set_collector('test', lambda: gauge.set(3))
+    assert 'in_flight 3' in registry.exposition()
+
+
+@pytest.mark.asyncio
+async def test_loop_lag_monitor():
+    def observed():
+        return sum(sum(counts) for counts, _ in IOLOOP_LAG_SECONDS.values.values())
+
+    before = observed()
+    LoopLagMonitor(0.01).start()
+    await gen.sleep(0.05)
+    assert observed() > before
@@ -0,0 +1,145 @@
+import os
+import sqlite3
+
+import pytest
+
+from results_store import INDEX_NAME, ResultsStore
+
+
+def make_records(provider, count, timestamp=100.0):
+    return [
+        {'provider': provider, 'data_set_id': '1', 'timestamp': timestamp + idx,
+         'score_type': 'bleu', 'score': idx / count, 'result': {'results': ['line'] * idx}}
+        for idx in range(count)
+    ]
+
+
+@pytest.fixture
+def results_store(tmpdir):
+    store = ResultsStore(path=str(tmpdir), segment_max_bytes=1024, flush_interval=0.05)
+    yield store
+    store.close()
+
+
+def test_batched_appends(results_store):
+    futures = [results_store.append_many(make_records('provider', 3)) for _ in range(10)]
+    record_ids = [future.result(timeout=5) for future in futures]
+    assert sorted(sum(record_ids, [])) == list(range(1, 31))
+    # appends queued together share one fsync
+    assert results_store.batches < 10
+
+    record = results_store.get(record_ids[0][2])
+    assert record['result'] == {'results': ['line', 'line']}
+    assert len(results_store.query('provider', 1, since=101, until=101)) == 10
+    assert results_store.query('other', 1) == []
+
+
+def test_rotation_and_compaction(results_store):
+    record_ids = []
+    for _ in range(20):
+        record_ids += results_store.append_many(make_records('provider', 5)).result(timeout=5)
+    results_store.close()
+    segments = sorted(os.listdir(results_store.segments_path))
+    assert len(segments) > 1
+
+    assert results_store.compact() == []
+    results_store.delete(record_ids[:-5])
+    compacted = results_store.compact()
+    # only the last segment holds live records, it is kept as it is
+    assert sorted(compacted) == segments[:-1]
+    assert os.listdir(results_store.segments_path) == segments[-1:]
+    assert [record['score'] for record in results_store.query('provider', 1)] == \
+        [0.0, 0.2, 0.4, 0.6, 0.8]
+
+    assert results_store.compact(max_age=1) != []
+    assert results_store.query('provider', 1) == []
+    assert os.listdir(results_store.segments_path) == []
+
+
+def save(results_store, provider, data_set_id, score, timestamp, lang_to='ru', score_type='bleu'):
+    record = {'provider': provider, 'data_set_id': data_set_id, 'timestamp': timestamp,
+              'score_type': score_type, 'score': score, 'lang_from': 'en', 'lang_to': lang_to}
+    return results_store.append_many([record]).result(timeout=5)[0]
+
+
+def test_history_latest_and_leaderboard(results_store):
+    save(results_store, 'first', '1', 0.1, 1)
+    save(results_store, 'first', '1', 0.3, 2)
+    save(results_store, 'first', '2', 0.5, 1)
+    save(results_store, 'second', '1', 0.2, 3)
+    save(results_store, 'second', '3', 0.9, 3, lang_to='de')
+
+    history = results_store.history('first', 1)
+    assert [item['score'] for item in history] == [0.1, 0.3]
+    assert [item['score'] for item in results_store.history('first', 1, limit=1, offset=1)] == \
+        [0.3]
+
+    latest = results_store.latest(1)
+    assert [(item['provider'], item['score']) for item in latest] == [('first', 0.3),
+                                                                      ('second', 0.2)]
+    assert len(results_store.latest()) == 4
+
+    leaderboard = results_store.leaderboard('en', 'ru')
+    assert [(item['provider'], item['data_sets']) for item in leaderboard] == [('first', 2),
+                                                                               ('second', 1)]
+    assert leaderboard[0]['score'] == pytest.approx(0.4)
+    assert results_store.leaderboard('en', 'ru', limit=1, offset=1)[0]['provider'] == 'second'
+
+
+def test_leaderboard_of_lower_is_better_score(results_store):
+    save(results_store, 'first', '1', 0.6, 1, score_type='ter')
+    save(results_store, 'second', '1', 0.2, 1, score_type='ter')
+    save(results_store, 'second', '1', 0.9, 1)
+    # the lowest error rate is the best
+    assert [item['provider'] for item in results_store.leaderboard('en', 'ru', 'ter')] == \
+        ['second', 'first']
+    assert [item['provider'] for item in results_store.leaderboard('en', 'ru')] == ['second']
+    with pytest.raises(ValueError):
+        results_store.leaderboard('en', 'ru', 'unknown')
+
+
+def test_aggregates_are_cached_until_results_change(results_store):
+    save(results_store, 'first', '1', 0.1, 1)
+    assert len(results_store.latest()) == 1
+    assert len(results_store.latest()) == 1
+    assert results_store.aggregate_hits == 1
+
+    save(results_store, 'second', '1', 0.2, 2)
+    assert len(results_store.latest()) == 2
+    assert results_store.aggregate_misses == 2
+
+
+def test_records_with_several_scores(results_store):
+    record = {'provider': 'first', 'data_set_id': '1', 'timestamp': 1,
+              'scores': {'bleu': 0.5, 'ter': 0.4}, 'result': {'results': ['line']}}
+    record_id = results_store.append_many([record]).result(timeout=5)[0]
+    save(results_store, 'first', '1', 0.6, 2)
+    assert results_store.get(record_id)['scores'] == {'bleu': 0.5, 'ter': 0.4}
+    assert [item['score_type'] for item in results_store.history('first', 1)] == \
+        ['bleu', 'ter', 'bleu']
+    # the record is read once, and deleted with all its scores
+    assert len(results_store.query('first', 1)) == 2
+    results_store.delete([record_id])
+    assert [item['score'] for item in results_store.history('first', 1)] == [0.6]
+
+
+def test_data_set_versions(tmpdir):
+    # an index from before data set versions were recorded
+    connection = sqlite3.connect(str(tmpdir.join(INDEX_NAME)))
+    connection.execute('CREATE TABLE results (id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                       'provider TEXT, data_set_id TEXT, timestamp REAL, score_type TEXT, '
+                       'score REAL, lang_from TEXT, lang_to TEXT, segment TEXT, offset INTEGER, '
+                       'length INTEGER)')
+    connection.close()
+    store = ResultsStore(path=str(tmpdir), flush_interval=0.05)
+    try:
+        records = make_records('first', 3)
+        for record, version in zip(records, ('v1', 'v1', 'v2')):
+            record['data_set_version'] = version
+        store.append_many(records).result(timeout=5)
+        assert [item['score'] for item in store.history('first', 1, data_set_version='v1')] == \
+            [0.0, 1 / 3]
+        assert [item['data_set_version'] for item in store.history('first', 1)] == \
+            ['v1', 'v1', 'v2']
+    finally:
+        store.close()
@@ -0,0 +1,64 @@
+import pytest
+
+from schema import Field, SchemaError, compile_schema
+
+
+@pytest.fixture
+def validate():
+    return compile_schema({
+        'context': {
+            'data_set_id': Field('integer', minimum=0),
+            'score_type': Field('text', choices=('bleu',)),
+            'stream': Field('boolean', required=False),
+        },
+        'service': {
+            'provider': Field(('text', 'list'), items={'id': 'text'}, min_items=1),
+        },
+    })
+
+
+@pytest.fixture
+def payload():
+    return {'context': {'data_set_id': '1', 'score_type': 'bleu'},
+            'service': {'provider': 'provider'}}
+
+
+def test_valid(validate, payload):
+    validate(payload)
+    payload['context'].update(data_set_id=2, stream=True)
+    payload['service']['provider'] = [{'id': 'first'}, {'id': 'second'}]
+    validate(payload)
+
+
+@pytest.mark.parametrize('path, value, error', [
+    (('context', 'data_set_id'), '../1', 'context.data_set_id: expected integer'),
+    (('context', 'data_set_id'), True, 'context.data_set_id: expected integer'),
+    (('context', 'data_set_id'), -1, 'context.data_set_id: must be at least 0'),
+    (('context', 'score_type'), 'ter', 'context.score_type: expected one of bleu'),
+    (('context', 'stream'), 'yes', 'context.stream: expected boolean'),
+    (('service', 'provider'), [], 'service.provider: must have at least 1 items'),
+    (('service', 'provider'), [{'id': 'a'}, {'id': 1}], 'service.provider[1].id: expected text'),
+    (('service', 'provider'), [{'id': 'a'}, {}], 'service.provider[1].id: key not found'),
+    (('service',), 'provider', 'service: expected object'),
+])
+def test_errors(validate, payload, path, value, error):
+    target = payload
+    for key in path[:-1]:
+        target = target[key]
+    target[path[-1]] = value
+    with pytest.raises(SchemaError) as excinfo:
+        validate(payload)
+    assert str(excinfo.value) == error
+
+
+def test_missing_key(validate, payload):
+    del payload['context']['score_type']
+    with pytest.raises(SchemaError) as excinfo:
+        validate(payload)
+    assert excinfo.value.path == 'context.score_type'
+    assert excinfo.value.message == 'key not found'
+
+
+def test_unknown_type():
+    with pytest.raises(ValueError):
+        Field('date')
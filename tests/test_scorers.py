@@ -0,0 +1,168 @@
+import collections
+
+import numpy as np
+import pytest
+
+from tests.test_bleu import random_corpus
+from utils import (SCORERS, Scorer, ReferenceNgrams, add_statistics, compute_statistics,
+                   concatenate_rows, corpus_scores, get_scorer, merge_statistics, register_scorer,
+                   stratified_order, summed_scores, tokenize, worst_segments)
+
+
+def levenshtein(hypothesis, reference):
+    row = list(range(len(reference) + 1))
+    for i, hyp_token in enumerate(hypothesis, 1):
+        previous, row[0] = row[:], i
+        for j, ref_token in enumerate(reference, 1):
+            row[j] = min(previous[j - 1] + (hyp_token != ref_token), previous[j] + 1,
+                         row[j - 1] + 1)
+    return row[-1]
+
+
+def chrf(reference, hypothesis, max_order=6, beta=2):
+    reference, hypothesis = reference.replace(' ', ''), hypothesis.replace(' ', '')
+    precisions, recalls = [], []
+    for n in range(1, max_order + 1):
+        ref = collections.Counter(reference[i:i + n] for i in range(len(reference) - n + 1))
+        hyp = collections.Counter(hypothesis[i:i + n] for i in range(len(hypothesis) - n + 1))
+        if ref and hyp:
+            matches = sum((ref & hyp).values())
+            precisions.append(matches / sum(hyp.values()))
+            recalls.append(matches / sum(ref.values()))
+    if not precisions:
+        return 0.0
+    precision, recall = np.mean(precisions), np.mean(recalls)
+    if not precision + recall:
+        return 0.0
+    return (1 + beta ** 2) * precision * recall / (beta ** 2 * precision + recall)
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_ter_edit_distances(seed):
+    references, hypothesis = random_corpus(seed, segments=40)
+    stats = compute_statistics(references, hypothesis, ['ter'])['ter']
+    expected = [levenshtein(hyp, ref)
+                for ref, hyp in zip(tokenize(references), tokenize(hypothesis))]
+    assert stats.edits.tolist() == expected
+    assert corpus_scores({'ter': stats})['ter'] == pytest.approx(
+        sum(expected) / sum(map(len, tokenize(references))), abs=1e-12
+    )
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_chrf_sentence_scores(seed):
+    references, hypothesis = random_corpus(seed, segments=20)
+    scores = get_scorer('chrf').sentence_scores(
+        compute_statistics(references, hypothesis, ['chrf'])['chrf']
+    )
+    expected = [chrf(ref, hyp) for ref, hyp in zip(references, hypothesis)]
+    assert np.allclose(scores, expected, rtol=0, atol=1e-12)
+
+
+def test_identical_corpora():
+    references = ['the cat is on the mat', 'there is a cat on the mat']
+    scores = corpus_scores(compute_statistics(references, references, list(SCORERS)))
+    assert scores == {'bleu': 1.0, 'sentence_bleu': 1.0, 'chrf': 1.0, 'ter': 0.0}
+
+
+def test_sentence_bleu_is_mean_of_sentence_scores():
+    references, hypothesis = random_corpus(3, segments=30)
+    stats = compute_statistics(references, hypothesis, ['sentence_bleu'])['sentence_bleu']
+    assert corpus_scores({'sentence_bleu': stats})['sentence_bleu'] == pytest.approx(
+        get_scorer('bleu').sentence_scores(stats).mean(), abs=1e-12
+    )
+
+
+@pytest.mark.parametrize('shard_size', [1, 7, 100])
+def test_sharded_statistics_merge_exactly(shard_size):
+    references, hypothesis = random_corpus(11, segments=50)
+    reference_ngrams = ReferenceNgrams(tokenize(references))
+    shards = [
+        compute_statistics(reference_ngrams.slice(start, start + shard_size),
+                           hypothesis[start:start + shard_size], list(SCORERS))
+        for start in range(0, len(hypothesis), shard_size)
+    ]
+    single = compute_statistics(references, hypothesis, list(SCORERS))
+    assert corpus_scores(merge_statistics(shards)) == corpus_scores(single)
+
+
+def test_one_tokenization_pass(monkeypatch):
+    calls = []
+
+    def counting_tokenize(sentences):
+        calls.append(len(sentences))
+        return tokenize(sentences)
+    monkeypatch.setattr('utils.tokenize', counting_tokenize)
+    references = ReferenceNgrams(tokenize(['a b c', 'd e']))
+    compute_statistics(references, ['a b d', 'd e'], list(SCORERS))
+    assert calls == [2]
+
+
+def test_registry(monkeypatch):
+    monkeypatch.setattr('utils.SCORERS', dict(SCORERS))
+    LengthStats = collections.namedtuple('LengthStats', ['lengths'])
+
+    @register_scorer
+    class LengthScorer(Scorer):
+        name = 'length'
+        stats_type = LengthStats
+
+        def statistics(self, segments):
+            return LengthStats(segments.word_ids[1])
+
+        def corpus_score(self, stats):
+            return float(stats.lengths.sum())
+
+    stats = [compute_statistics(['a b', 'c'], ['a b c', 'd'], ['length', 'bleu']),
+             compute_statistics(['e'], ['e f'], ['length', 'bleu'])]
+    assert corpus_scores(merge_statistics(stats))['length'] == 6.0
+    with pytest.raises(ValueError):
+        get_scorer('unknown')
+
+
+def test_worst_segments():
+    scores = np.array([0.5, 0.1, 0.9, 0.3, 0.7])
+    assert worst_segments(scores, 2).tolist() == [1, 3]
+    assert worst_segments(scores, 2, lower_is_better=True).tolist() == [2, 4]
+    assert worst_segments(scores, 10).tolist() == [1, 3, 0, 4, 2]
+    assert worst_segments(scores, 0).tolist() == []
+
+
+@pytest.mark.parametrize('name', sorted(SCORERS))
+def test_resampled_scores(name):
+    references, hypothesis = random_corpus(5, segments=40)
+    scorer = get_scorer(name)
+    stats = compute_statistics(references, hypothesis, [name])[name]
+    groups = concatenate_rows([
+        scorer.group(compute_statistics(references[start:start + 7], hypothesis[start:start + 7],
+                                        [name])[name])
+        for start in range(0, 40, 7)
+    ])
+    # drawing every group once is the corpus, drawing one group is that group
+    weights = np.vstack([np.ones(6), np.eye(6)])
+    scores = scorer.resampled_scores(groups, weights)
+    assert scores[0] == pytest.approx(scorer.corpus_score(stats), abs=1e-12)
+    assert scores[1] == pytest.approx(
+        corpus_scores(compute_statistics(references[:7], hypothesis[:7], [name]))[name],
+        abs=1e-12
+    )
+
+
+def test_running_scores_of_added_statistics():
+    references, hypothesis = random_corpus(9, segments=30)
+    totals, shards = None, []
+    for start in range(0, 30, 8):
+        shards.append(compute_statistics(references[start:start + 8],
+                                         hypothesis[start:start + 8], list(SCORERS)))
+        totals = add_statistics(totals, shards[-1])
+        expected = corpus_scores(merge_statistics(shards))
+        assert summed_scores(totals) == pytest.approx(expected, abs=1e-12)
+
+
+def test_stratified_order():
+    order = stratified_order(23, 4, np.random.default_rng(1))
+    assert sorted(order.tolist()) == list(range(23))
+    strata = np.arange(23) * 4 // 23
+    # every round takes one chunk of every stratum
+    for end in range(4, 21, 4):
+        assert np.bincount(strata[order[:end]], minlength=4).tolist() == [end // 4] * 4
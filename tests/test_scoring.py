@@ -0,0 +1,129 @@
+import asyncio
+import multiprocessing
+import os
+import time
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing.connection import Client
+
+import pytest
+
+from scoring import ScoringEngine, ScoringServer
+from utils import score_translation
+
+
+@pytest.fixture
+def scoring_engine():
+    engine = ScoringEngine(max_workers=2, shard_size=1)
+    yield engine
+    engine.shutdown()
+
+
+@pytest.fixture
+def sentences():
+    hyp1 = ("It is a guide to action which ensures that the military always obeys "
+            "the commands of the party")
+    ref1 = "It is a guide to action that ensures that the military will forever heed Party commands"
+    hyp2 = "he read the book because he was interested in world history"
+    ref2 = "he was interested in world history because he read the book"
+    return [ref1, ref2], [hyp1, hyp2]
+
+
+@pytest.mark.asyncio
+async def test_score_matches_in_process_score(scoring_engine, sentences):
+    references, hypothesis = sentences
+    value = await scoring_engine.score(references, hypothesis)
+    assert value == pytest.approx(score_translation(references, hypothesis), abs=1e-12)
+
+    scoring_engine.shard_size = 40
+    assert await scoring_engine.score(references, hypothesis) == pytest.approx(value, abs=1e-12)
+
+
+@pytest.mark.asyncio
+async def test_pool_is_reused_and_reports_stats(scoring_engine, sentences):
+    references, hypothesis = sentences
+    await scoring_engine.score(references, hypothesis)
+    executor = scoring_engine.executor
+    await scoring_engine.score(references, hypothesis)
+    assert scoring_engine.executor is executor
+
+    stats = scoring_engine.stats()
+    assert stats['workers'] == 2
+    assert stats['submitted'] == stats['completed'] == 4
+    assert stats['in_flight'] == stats['queue_depth'] == 0
+    assert stats['utilisation'] == 0
+
+
+@pytest.mark.asyncio
+async def test_warm_up_starts_every_worker(scoring_engine):
+    assert await scoring_engine.warm_up() == 2
+    assert len(scoring_engine.executor._processes) == 2
+
+
+@pytest.mark.asyncio
+async def test_not_acceptable_type(scoring_engine, sentences):
+    with pytest.raises(Exception):
+        await scoring_engine.score(*sentences, type_='unknown')
+
+
+@pytest.fixture
+def scoring_server(tmpdir):
+    server = ScoringServer(str(tmpdir.join('scoring.sock')), os.urandom(16), max_workers=2)
+
+    def start():
+        process = multiprocessing.Process(target=server.serve)
+        process.start()
+        # the socket file exists before the server listens, wait for a connection
+        for _ in range(500):
+            try:
+                Client(server.address, family='AF_UNIX', authkey=server.authkey).close()
+                break
+            except OSError:
+                time.sleep(0.01)
+        return process
+
+    processes = [start()]
+    yield server, start, processes
+    for process in processes:
+        process.terminate()
+        process.join()
+
+
+@pytest.mark.asyncio
+async def test_shared_scoring_server(scoring_server, sentences):
+    server, start, processes = scoring_server
+    engine = ScoringEngine(address=server.address, authkey=server.authkey, shard_size=1,
+                           connect_timeout=0.5)
+    references, hypothesis = sentences
+    try:
+        value = await engine.score(references, hypothesis, ['bleu', 'ter'])
+        assert value == pytest.approx(score_translation(references, hypothesis, ['bleu', 'ter']))
+        with pytest.raises(ValueError):
+            await engine.submit(int, 'not a number')
+
+        # the server drains and exits on SIGTERM, the engine reconnects to the next one
+        processes[0].terminate()
+        processes[0].join(5)
+        assert processes[0].exitcode == 0
+        with pytest.raises(BrokenProcessPool):
+            await engine.score(references, hypothesis)
+        processes.append(start())
+        assert await engine.score(references, hypothesis) == pytest.approx(value['bleu'])
+    finally:
+        engine.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_engine_waits_for_the_scoring_server(scoring_server, sentences):
+    server, start, processes = scoring_server
+    processes[0].terminate()
+    processes[0].join(5)
+    engine = ScoringEngine(address=server.address, authkey=server.authkey, connect_timeout=10)
+    try:
+        # submitted before the server listens
+        score = asyncio.ensure_future(engine.score(*sentences))
+        await asyncio.sleep(0.1)
+        assert not score.done()
+        processes.append(start())
+        assert await score == pytest.approx(score_translation(*sentences))
+    finally:
+        engine.shutdown()
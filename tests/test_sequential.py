@@ -0,0 +1,86 @@
+import random
+
+import pytest
+
+from sequential import BUDGET, COMPLETE, INTERVAL, SIGNIFICANT, SequentialEstimate
+from tests.test_bleu import random_corpus
+from utils import compute_statistics, corpus_scores
+
+
+def chunk_statistics(references, hypotheses, chunk_size=10):
+    return [
+        [compute_statistics(references[start:start + chunk_size],
+                            hypothesis[start:start + chunk_size], ['bleu', 'ter'])
+         for hypothesis in hypotheses]
+        for start in range(0, len(references), chunk_size)
+    ]
+
+
+def test_interval_narrows_until_it_stops():
+    references, hypothesis = random_corpus(1, segments=400)
+    rnd = random.Random(0)
+    # about half of the segments are right
+    hypothesis = [reference if rnd.random() < 0.5 else other
+                  for reference, other in zip(references, hypothesis)]
+    chunks = chunk_statistics(references, [hypothesis])
+    estimate = SequentialEstimate('bleu', width=0.12, min_chunks=5, seed=0)
+    widths = []
+    for idx, stats in enumerate(chunks):
+        estimate.add(idx, 10, stats)
+        if estimate.intervals is not None:
+            low, high = estimate.intervals[0]
+            assert low <= estimate.scores()['bleu'] <= high
+            widths.append(high - low)
+        if estimate.should_stop(len(chunks) - idx - 1):
+            break
+    assert estimate.stopped == INTERVAL
+    assert widths[-1] <= 0.12 < max(widths)
+    assert 5 <= len(estimate.chunks) < len(chunks)
+    report = estimate.report(400)
+    assert report['lines'] == 10 * len(estimate.chunks)
+    assert report['fraction'] == report['lines'] / 400
+    assert set(estimate.scores()) == {'bleu', 'ter'}
+
+
+def test_complete_evaluation_is_exact():
+    references, hypothesis = random_corpus(2, segments=30)
+    chunks = chunk_statistics(references, [hypothesis])
+    estimate = SequentialEstimate('ter', seed=0)
+    for idx, stats in enumerate(chunks):
+        estimate.add(idx, 10, stats)
+        estimate.should_stop(len(chunks) - idx - 1)
+    assert estimate.stopped == COMPLETE
+    score = corpus_scores(compute_statistics(references, hypothesis, ['ter']))['ter']
+    report = estimate.report(30)
+    assert report['interval'] == [pytest.approx(score)] * 2
+    assert report['fraction'] == 1.0
+
+
+def test_budget():
+    estimate = SequentialEstimate('bleu', max_lines=5, max_chars=12)
+    assert estimate.can_start(['abc', 'def'])
+    assert not estimate.can_start(['0123456789'])
+    assert estimate.can_start(['ghi'])
+    assert not estimate.can_start(['j'] * 3)
+    assert (estimate.sent_lines, estimate.sent_chars) == (3, 9)
+    estimate.finish()
+    assert estimate.stopped == BUDGET
+
+
+def test_paired_bootstrap():
+    references, hypothesis = random_corpus(3, segments=300)
+    chunks = chunk_statistics(references, [references, hypothesis])
+    estimate = SequentialEstimate('bleu', providers=2, min_chunks=3, seed=0)
+    for idx, stats in enumerate(chunks):
+        estimate.add(idx, 10, stats)
+        if estimate.should_stop(len(chunks) - idx - 1):
+            break
+    # the references are clearly better than random sentences
+    assert estimate.stopped == SIGNIFICANT
+    assert len(estimate.chunks) == 3
+    first = estimate.report(300, 0, 'second')
+    second = estimate.report(300, 1, 'first')
+    assert first['difference']['provider'] == 'second'
+    assert first['difference']['interval'][0] > 0
+    assert second['difference']['interval'] == [-first['difference']['interval'][1],
+                                                -first['difference']['interval'][0]]
@@ -1,27 +1,46 @@
+import gzip
+
+import numpy as np
 import pytest
 
+from storage import DataSetStream, Manager, Snapshot
+from utils import compute_statistics, data_set_version, line_hashes, split
+
+
+def compress_gzip(data):
+    return gzip.compress(data)
+
+
+def compress_zstd(data):
+    zstandard = pytest.importorskip('zstandard')
+    return zstandard.ZstdCompressor(write_content_size=True).compress(data)
+
 
 @pytest.fixture
-def create_data_set(data_set, tmpdir, data_set_name, data_set_id):
-    full_path = tmpdir.mkdir(str(data_set_id)).join('{}.txt'.format(data_set_name))
-    full_path.write('\n'.join(data_set).encode())
-    return full_path
+def numbered_lines():
+    return ['source {0}\treference {0}'.format(idx) for idx in range(250)]
 
 
 @pytest.mark.asyncio
 async def test_create_result(data_set_id, translation_result, manager):
-    file_path = await manager.save(data_set_id, translation_result)
-    with open(file_path, 'rb') as fd:
-        data = fd.read()
-        assert data.decode() == '\n'.join(translation_result)
+    record_id = await manager.save(data_set_id, translation_result)
+    record = await manager.read_result(record_id)
+    assert record['result'] == translation_result
+    assert record['provider'] == translation_result['service']['provider']['id']
+    assert record['data_set_id'] == str(data_set_id)
+    # no data set to hash
+    assert record['data_set_version'] is None
 
 
 @pytest.mark.asyncio
-async def test_open_data_set(data_set_id, translation_result, manager):
-    file_path = await manager.save(data_set_id, translation_result)
-    with open(file_path, 'rb') as fd:
-        data = fd.read()
-        assert data.decode() == '\n'.join(translation_result)
+async def test_save_multi_provider(data_set_id, translation_result, manager):
+    second = dict(translation_result, service={'provider': {'id': 'second.provider'}})
+    broken = {'status': 'error', 'service': {'provider': {'id': 'broken.provider'}}}
+    record_ids = await manager.save(data_set_id, [translation_result, broken, second])
+    assert len(record_ids) == 2
+    assert [(await manager.read_result(record_id))['result'] for record_id in record_ids] == \
+        [translation_result, second]
+    assert manager.results_store.query('broken.provider', data_set_id) == []
 
 
 @pytest.mark.asyncio
@@ -30,3 +49,189 @@ async def test_data_set_handling(create_data_set, manager, data_set_id, data_set
     original, translation = data_set[0].split('\t')
     assert original in opend_data_set.original[0]
     assert translation in opend_data_set.translation[0]
+
+
+@pytest.mark.asyncio
+async def test_data_set_cache_hit(create_data_set, manager, data_set_id):
+    first = await manager.get_data_set(data_set_id)
+    second = await manager.get_data_set(data_set_id)
+    assert first is second
+    assert first.reference_ngrams is not None
+    assert len(first.reference_ngrams) == len(first.translation)
+    stats = manager.data_set_cache.stats()
+    assert stats['hits'] == 1
+    assert stats['misses'] == 1
+
+
+@pytest.mark.asyncio
+async def test_data_set_cache_invalidated_on_change(create_data_set, manager, data_set_id,
+                                                    data_set):
+    first = await manager.get_data_set(data_set_id)
+    create_data_set.write('\n'.join(data_set + data_set).encode())
+    second = await manager.get_data_set(data_set_id)
+    assert second is not first
+    assert len(second.original) == 2 * len(first.original)
+
+
+@pytest.mark.asyncio
+async def test_data_set_cache_eviction(create_data_set, create_storage, data_set_id, data_set,
+                                       tmpdir):
+    other_id = data_set_id + 1
+    tmpdir.mkdir(str(other_id)).join('en-de.txt').write('\n'.join(data_set).encode())
+    manager = Manager(storage=create_storage, cache_max_lines=len(data_set))
+
+    await manager.preload([data_set_id, other_id])
+    stats = manager.data_set_cache.stats()
+    assert stats['entries'] == 1
+    assert stats['evictions'] == 1
+    assert (await manager.get_data_set(other_id)).lang_to == 'de'
+    assert manager.data_set_cache.hits == 1
+
+
+@pytest.mark.asyncio
+async def test_compiled_data_set_is_preferred(create_data_set, create_storage, manager,
+                                              data_set_id):
+    from_text = await manager.get_data_set(data_set_id)
+    compiled_path = create_storage.compile(data_set_id)
+    assert compiled_path.endswith('en-ru.bin')
+    assert create_storage.get_file_name(data_set_id) == 'en-ru.bin'
+
+    compiled = await manager.get_data_set(data_set_id)
+    assert compiled is not from_text
+    assert list(compiled.original) == from_text.original
+    assert list(compiled.translation) == from_text.translation
+    assert (compiled.lang_from, compiled.lang_to) == ('en', 'ru')
+
+
+def test_compile_in_progress_is_ignored(create_data_set, create_storage, data_set_id, tmpdir):
+    # written by a compile which is running, or was interrupted
+    tmpdir.join(str(data_set_id), '.en-ru.bin.tmp').write_binary(b'partial')
+    tmpdir.join(str(data_set_id), 'en-ru.bin.tmp').write_binary(b'partial')
+    assert create_storage.get_file_name(data_set_id) == 'en-ru.txt'
+    create_storage.compile(data_set_id)
+    assert create_storage.get_file_name(data_set_id) == 'en-ru.bin'
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('ext, compress', [('.txt', bytes), ('.txt.gz', compress_gzip),
+                                           ('.txt.zst', compress_zstd)])
+async def test_compressed_data_set_chunks(create_storage, manager, tmpdir, data_set_id,
+                                          numbered_lines, ext, compress):
+    data = '\n'.join(numbered_lines).encode()
+    tmpdir.mkdir(str(data_set_id)).join('en-ru' + ext).write_binary(compress(data))
+    pairs = [tuple(line.split('\t')) for line in numbered_lines]
+
+    chunks = list(create_storage.iter_chunks(data_set_id, 100))
+    assert chunks == split(pairs, 100)
+    assert [len(chunk) for chunk in chunks] == [100, 100, 50]
+    assert manager.get_from_to_languages(data_set_id) == ('en', 'ru')
+    assert create_storage.estimate_lines(data_set_id) == len(numbered_lines)
+    # extrapolated from the size of the decompressed content
+    assert create_storage.estimate_lines(data_set_id, sample_size=1000) == \
+        pytest.approx(len(numbered_lines), rel=0.1)
+
+    data_set = await manager.get_data_set(data_set_id)
+    assert list(zip(data_set.original, data_set.translation)) == pairs
+    compiled_path = create_storage.compile(data_set_id)
+    assert compiled_path.endswith('en-ru.bin')
+    assert list(create_storage.iter_pairs(data_set_id)) == pairs
+
+
+@pytest.mark.asyncio
+async def test_open_data_set_streams_chunks(manager, tmpdir, data_set_id, numbered_lines):
+    tmpdir.mkdir(str(data_set_id)).join('en-ru.txt').write('\n'.join(numbered_lines).encode())
+
+    stream = await manager.open_data_set(data_set_id, 100)
+    assert isinstance(stream, DataSetStream)
+    assert (stream.lang_from, stream.lang_to, stream.estimated_lines) == ('en', 'ru', 250)
+    chunks = [chunk async for chunk in stream.chunks()]
+    assert [len(chunk) for chunk in chunks] == [100, 100, 50]
+    data_set = await stream.data_set()
+    assert data_set.original == [source for chunk in chunks for source, _ in chunk]
+    assert len(data_set.reference_ngrams) == 250
+    # the data set read by the stream is cached
+    assert await manager.open_data_set(data_set_id, 100) is data_set
+
+
+@pytest.mark.asyncio
+async def test_open_data_set_stream_fails(manager, tmpdir, data_set_id):
+    tmpdir.mkdir(str(data_set_id)).join('en-ru.txt').write(b'source\treference\nno tab')
+    stream = await manager.open_data_set(data_set_id, 1)
+    with pytest.raises(IndexError):
+        [chunk async for chunk in stream.chunks()]
+
+
+def test_upload(create_storage, tmpdir, data_set_id, numbered_lines):
+    tmpdir.mkdir(str(data_set_id)).join('en-de.txt.gz').write_binary(gzip.compress(b'a\tb'))
+    # two gzip members, received in small pieces
+    data = '\n'.join(numbered_lines).encode()
+    body = gzip.compress(data[:1000]) + gzip.compress(data[1000:])
+    upload = create_storage.create_upload(data_set_id, 'en', 'ru', 'gzip')
+    for start in range(0, len(body), 100):
+        upload.write(body[start:start + 100])
+    assert upload.commit() == len(numbered_lines)
+
+    assert sorted(tmpdir.join(str(data_set_id)).listdir()) == \
+        [tmpdir.join(str(data_set_id), name) for name in ('en-ru.bin', 'en-ru.txt')]
+    assert create_storage.get_file_name(data_set_id) == 'en-ru.bin'
+    assert [len(chunk) for chunk in create_storage.iter_chunks(data_set_id, 100)] == [100, 100, 50]
+    assert tmpdir.join('.uploads').listdir() == []
+
+
+@pytest.mark.parametrize('body, message', [
+    (b'source\treference\nsource only\n', 'line 2: expected a source and a reference'),
+    (b'source\t\n', 'line 1: expected a source and a reference'),
+    (b'\xff\tb\n', 'line 1: not valid UTF-8'),
+    (b'', 'empty data set'),
+])
+def test_upload_not_valid(create_storage, tmpdir, data_set_id, body, message):
+    upload = create_storage.create_upload(data_set_id, 'en', 'ru')
+    with pytest.raises(ValueError) as excinfo:
+        upload.write(body)
+        upload.commit()
+    assert message in str(excinfo.value)
+    upload.abort()
+    assert not tmpdir.join(str(data_set_id)).exists()
+    assert tmpdir.join('.uploads').listdir() == []
+
+
+@pytest.mark.asyncio
+async def test_data_set_version(create_data_set, manager, data_set_id, data_set,
+                                translation_result):
+    version = await manager.get_data_set_version(data_set_id)
+    assert version.hashes.tolist() == line_hashes(*zip(*[line.split('\t')
+                                                         for line in data_set])).tolist()
+    assert version is await manager.get_data_set_version(data_set_id)
+    record_id = await manager.save(data_set_id, translation_result, version)
+    assert (await manager.read_result(record_id))['data_set_version'] == version.version
+
+    evaluated = await manager.get_data_set(data_set_id)
+    assert await manager.get_version_of(data_set_id, evaluated) is version
+    create_data_set.write('\n'.join(data_set[:1]).encode())
+    data_set_changed, changed = await manager.get_versioned_data_set(data_set_id)
+    assert len(data_set_changed.original) == len(changed.hashes) == 1
+    assert changed.version != version.version
+    # the data set evaluated before the change keeps its version
+    assert (await manager.get_version_of(data_set_id, evaluated)).version == version.version
+
+
+def test_snapshot(create_storage, data_set_id, provider_id):
+    assert create_storage.load_snapshot(data_set_id, provider_id) is None
+    references = ['a cat sat on the mat', 'ein hund']
+    translations = ['a cat sat on a mat', 'ein hund']
+    hashes = line_hashes(['source'] * 2, references)
+    stats = compute_statistics(references, translations, ['bleu', 'ter'])
+    create_storage.save_snapshot(data_set_id, provider_id, Snapshot(
+        version=data_set_version(hashes), hashes=hashes, translations=translations,
+        envelope={'service': {'provider': {'id': provider_id}}}, stats=stats
+    ))
+    snapshot = create_storage.load_snapshot(data_set_id, provider_id)
+    assert snapshot.version == data_set_version(hashes)
+    assert snapshot.translations == translations
+    assert snapshot.envelope == {'service': {'provider': {'id': provider_id}}}
+    assert set(snapshot.stats) == {'bleu', 'ter'}
+    for name, value in stats.items():
+        assert type(snapshot.stats[name]) is type(value)
+        for field, array in zip(snapshot.stats[name], value):
+            np.testing.assert_array_equal(field, array)
+    assert create_storage.load_snapshot(data_set_id, 'other.provider') is None
@@ -0,0 +1,106 @@
+import multiprocessing
+import os
+import signal
+import time
+
+import pytest
+
+from supervisor import Supervisor, notify_ready
+
+
+def wait_until(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return
+        time.sleep(0.02)
+    raise AssertionError('timed out')
+
+
+def run_until_terminated(directory, role):
+    # records its start and, after a short drain, its exit
+    stopped = []
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopped.append(True))
+    path = os.path.join(directory, '{}-{}'.format(role, os.getpid()))
+    with open(path, 'w'):
+        pass
+    while not stopped:
+        time.sleep(0.01)
+    time.sleep(0.05)
+    with open(path, 'w') as fd:
+        fd.write(str(time.monotonic()))
+
+
+def run_ready_after(directory, delay):
+    time.sleep(delay)
+    with open(os.path.join(directory, 'ready-{}'.format(os.getpid())), 'w') as fd:
+        fd.write(str(time.monotonic()))
+    notify_ready()
+    run_until_terminated(directory, 'worker')
+
+
+def processes(directory, role, finished=None):
+    names = [name for name in os.listdir(str(directory)) if name.startswith(role)]
+    if finished is None:
+        return names
+    return [name for name in names if bool(directory.join(name).read()) == finished]
+
+
+@pytest.fixture
+def supervisor(tmpdir):
+    supervisor = Supervisor(lambda: run_until_terminated(str(tmpdir), 'worker'), 2,
+                            lambda: run_until_terminated(str(tmpdir), 'scoring'),
+                            drain_timeout=5)
+    process = multiprocessing.Process(target=supervisor.run)
+    process.start()
+    wait_until(lambda: len(processes(tmpdir, 'worker')) == 2 and processes(tmpdir, 'scoring'))
+    yield process
+    if process.is_alive():
+        os.kill(process.pid, signal.SIGKILL)
+    process.join()
+
+
+def test_rolling_restart_and_drain(tmpdir, supervisor):
+    os.kill(supervisor.pid, signal.SIGHUP)
+    # every worker is replaced, the scoring server keeps running
+    wait_until(lambda: len(processes(tmpdir, 'worker', finished=True)) == 2
+               and len(processes(tmpdir, 'worker', finished=False)) == 2)
+    assert processes(tmpdir, 'scoring', finished=True) == []
+
+    os.kill(supervisor.pid, signal.SIGTERM)
+    supervisor.join(10)
+    assert supervisor.exitcode == 0
+    assert len(processes(tmpdir, 'worker', finished=True)) == 4
+    exits = {name: float(tmpdir.join(name).read()) for name in os.listdir(str(tmpdir))}
+    scoring_exit = exits.pop(processes(tmpdir, 'scoring')[0])
+    # the scoring server is stopped after the workers drained
+    assert scoring_exit > max(exits.values())
+
+
+def test_rolling_restart_waits_until_ready(tmpdir):
+    supervisor = Supervisor(lambda: run_ready_after(str(tmpdir), 0.3), 1, drain_timeout=5,
+                            ready_timeout=5)
+    process = multiprocessing.Process(target=supervisor.run)
+    process.start()
+    try:
+        wait_until(lambda: processes(tmpdir, 'worker'))
+        os.kill(process.pid, signal.SIGHUP)
+        wait_until(lambda: processes(tmpdir, 'worker', finished=True) and
+                   len(processes(tmpdir, 'ready')) == 2)
+        old = processes(tmpdir, 'worker', finished=True)[0]
+        new = processes(tmpdir, 'worker', finished=False)[0]
+        # the old process was stopped once the new one was ready, not when it started
+        ready = float(tmpdir.join(new.replace('worker', 'ready')).read())
+        assert float(tmpdir.join(old).read()) > ready
+
+        os.kill(process.pid, signal.SIGTERM)
+        process.join(10)
+        assert process.exitcode == 0
+    finally:
+        if process.is_alive():
+            # the supervisor stops its workers
+            os.kill(process.pid, signal.SIGTERM)
+            process.join(10)
+        if process.is_alive():
+            os.kill(process.pid, signal.SIGKILL)
+        process.join()
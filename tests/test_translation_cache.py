@@ -0,0 +1,52 @@
+import time
+
+import pytest
+
+from translation_cache import TranslationCache
+
+
+@pytest.fixture
+def keys():
+    return [TranslationCache.make_key('provider', 'ru', text) for text in ['one', 'two', None]]
+
+
+def test_keys_depend_on_provider_and_language():
+    key = TranslationCache.make_key('provider', 'ru', 'text')
+    assert key == TranslationCache.make_key('provider', 'ru', 'text')
+    assert key != TranslationCache.make_key('other', 'ru', 'text')
+    assert key != TranslationCache.make_key('provider', 'de', 'text')
+    assert key != TranslationCache.make_key('provider', 'ru', None)
+
+
+@pytest.mark.asyncio
+async def test_memory_and_disk_tiers(translation_cache, keys, tmpdir):
+    assert await translation_cache.get_many(keys) == [None, None, None]
+    await translation_cache.put_many({keys[0]: 'один', keys[2]: '{}'})
+    assert await translation_cache.get_many(keys) == ['один', None, '{}']
+    assert translation_cache.memory_hits == 2
+
+    other_process = TranslationCache(path=translation_cache.path)
+    assert await other_process.get_many(keys) == ['один', None, '{}']
+    assert other_process.disk_hits == 2
+    assert other_process.stats()['hit_rate'] == pytest.approx(2 / 3)
+
+
+@pytest.mark.asyncio
+async def test_expired_entries_are_misses(translation_cache, keys, monkeypatch):
+    await translation_cache.put_many({keys[0]: 'один'})
+    later = time.time() + translation_cache.ttl + 1
+    monkeypatch.setattr(time, 'time', lambda: later)
+    reader = TranslationCache(path=translation_cache.path)
+    assert await reader.get_many(keys[:1]) == [None]
+
+
+@pytest.mark.asyncio
+async def test_size_eviction(tmpdir):
+    cache = TranslationCache(path=str(tmpdir.join('translations.sqlite')),
+                             memory_entries=1, max_bytes=10)
+    cache.EVICTION_INTERVAL = 1
+    keys = [TranslationCache.make_key('provider', 'ru', str(idx)) for idx in range(4)]
+    for key in keys:
+        await cache.put_many({key: 'x' * 4})
+    reader = TranslationCache(path=cache.path)
+    assert await reader.get_many(keys) == [None, None, 'xxxx', 'xxxx']
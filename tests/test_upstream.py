@@ -0,0 +1,180 @@
+import pytest
+import tornado.escape
+import tornado.gen
+import tornado.httpserver
+import tornado.testing
+import tornado.web
+from tornado.httpclient import HTTPClientError, HTTPRequest
+
+from upstream import UpstreamClient
+
+
+class SlowHandler(tornado.web.RequestHandler):
+
+    async def get(self):
+        self.application.concurrent += 1
+        self.application.max_concurrent = max(self.application.max_concurrent,
+                                              self.application.concurrent)
+        await tornado.gen.sleep(float(self.get_argument('delay', '0.05')))
+        self.application.concurrent -= 1
+        self.application.accept_encoding.append(self.request.headers.get('Accept-Encoding'))
+        self.write('ok' * 1000)
+
+
+class BatchHandler(tornado.web.RequestHandler):
+    """
+    Echoes the texts; rejects more than ``max_items`` of them and the batches which
+    start with a text of ``failed``, and throttles the batches which start with a
+    text of ``throttled``, as many times as it says.
+    """
+
+    def post(self):
+        texts = tornado.escape.json_decode(self.request.body)
+        self.application.batches.append(texts)
+        if len(texts) > self.application.max_items:
+            raise tornado.web.HTTPError(413)
+        if texts[0] in self.application.failed:
+            raise tornado.web.HTTPError(400)
+        if self.application.throttled.get(texts[0]):
+            self.application.throttled[texts[0]] -= 1
+            self.set_status(429)
+            self.set_header('Retry-After', '0')
+            return
+        self.write({'results': texts})
+
+
+@pytest.fixture
+async def batch_url():
+    application = tornado.web.Application([('/', BatchHandler)])
+    application.batches = []
+    application.max_items = 100
+    application.throttled = {}
+    application.failed = set()
+    sock, port = tornado.testing.bind_unused_port()
+    server = tornado.httpserver.HTTPServer(application)
+    server.add_sockets([sock])
+    yield application, 'http://127.0.0.1:{}/'.format(port)
+    server.stop()
+
+
+@pytest.fixture
+async def slow_url():
+    application = tornado.web.Application([('/', SlowHandler)], compress_response=True)
+    application.concurrent = application.max_concurrent = 0
+    application.accept_encoding = []
+    sock, port = tornado.testing.bind_unused_port()
+    server = tornado.httpserver.HTTPServer(application)
+    server.add_sockets([sock])
+    yield application, 'http://127.0.0.1:{}/'.format(port)
+    server.stop()
+
+
+@pytest.fixture
+def upstream_client():
+    client = UpstreamClient(max_in_flight=2, max_clients=10, request_timeout=5, gzip=True)
+    yield client
+    client.close()
+
+
+@pytest.mark.asyncio
+async def test_max_in_flight_per_provider(slow_url, upstream_client):
+    application, url = slow_url
+    responses = await tornado.gen.multi([
+        upstream_client.fetch('slow', HTTPRequest(url)) for _ in range(6)
+    ])
+    assert all(response.body == b'ok' * 1000 for response in responses)
+    assert application.max_concurrent == 2
+    assert application.accept_encoding == ['gzip'] * 6
+
+    stats = upstream_client.stats()['providers']['slow']
+    assert stats['requests'] == 6
+    assert stats['in_flight'] == stats['waiting'] == 0
+    assert stats['max_wait_time'] > 0
+
+
+@pytest.mark.asyncio
+async def test_providers_have_separate_pools(slow_url, upstream_client):
+    application, url = slow_url
+    await tornado.gen.multi([
+        upstream_client.fetch(provider_id, HTTPRequest(url))
+        for provider_id in ['first', 'first', 'second', 'second']
+    ])
+    assert application.max_concurrent == 4
+    assert upstream_client.get_pool('first') is not upstream_client.get_pool('second')
+
+
+@pytest.mark.asyncio
+async def test_request_timeout(slow_url):
+    application, url = slow_url
+    client = UpstreamClient(request_timeout=0.01)
+    with pytest.raises(HTTPClientError):
+        await client.fetch('slow', HTTPRequest(url + '?delay=0.5'))
+    assert client.stats()['providers']['slow']['errors'] == 1
+    client.close()
+
+
+async def fetch_batches(client, url, texts, items):
+    batches = await client.fetch_batches(
+        'batch', texts,
+        lambda batch: HTTPRequest(url, method='POST', body=tornado.escape.json_encode(batch)),
+        items
+    )
+    return [(list(batch), tornado.escape.json_decode(response.body)['results'])
+            for batch, response in batches]
+
+
+@pytest.mark.asyncio
+async def test_fetch_batches(batch_url, upstream_client):
+    application, url = batch_url
+    texts = ['text {}'.format(idx) for idx in range(10)]
+    batches = await fetch_batches(upstream_client, url, texts, 4)
+    assert [texts for texts, _ in batches] == [texts[:4], texts[4:8], texts[8:]]
+    assert all(texts == results for texts, results in batches)
+    # answered fast, the batches grow
+    assert upstream_client.get_planner('batch').items > 4
+
+
+@pytest.mark.asyncio
+async def test_fetch_batches_too_large_and_throttled(batch_url, upstream_client):
+    application, url = batch_url
+    application.max_items = 2
+    application.throttled = {'text 2': 1}
+    texts = ['text {}'.format(idx) for idx in range(5)]
+    batches = await fetch_batches(upstream_client, url, texts, 5)
+    # split in halves until the provider accepts them, the throttled one is sent again
+    assert [results for _, results in batches] == [texts[:2], texts[2:3], texts[3:]]
+    assert sorted(map(len, application.batches)) == [1, 1, 2, 2, 3, 5]
+    stats = upstream_client.stats()
+    assert stats['retried'] == 1
+    assert stats['batches']['batch']['max_items'] == 1
+    assert stats['batches']['batch']['too_large'] == 2
+    assert stats['batches']['batch']['throttled'] == 1
+
+
+@pytest.mark.asyncio
+async def test_fetch_batches_gives_up(batch_url):
+    application, url = batch_url
+    application.throttled = {'text': 10}
+    client = UpstreamClient(retries=2)
+    with pytest.raises(HTTPClientError) as excinfo:
+        await fetch_batches(client, url, ['text'], 1)
+    assert excinfo.value.code == 429
+    assert len(application.batches) == 3
+    client.close()
+
+
+@pytest.mark.asyncio
+async def test_failed_batch_cancels_the_others(batch_url):
+    application, url = batch_url
+    application.failed = {'failed'}
+    application.throttled = {'throttled': 1000}
+    client = UpstreamClient(retries=1000)
+    with pytest.raises(HTTPClientError) as excinfo:
+        await fetch_batches(client, url, ['throttled', 'failed'], 1)
+    assert excinfo.value.code == 400
+    # the throttled batch stops retrying with the failed one
+    await tornado.gen.sleep(0.05)
+    sent = len(application.batches)
+    await tornado.gen.sleep(0.1)
+    assert len(application.batches) == sent
+    client.close()
@@ -1,9 +1,19 @@
+import gzip
+
 import pytest
 import tornado.escape
+import tornado.gen
 import tornado.web
 
-from app import EvaluateProviderHandler, ProxyRequestMixin, ValidationMixin
-from tornado.httpclient import HTTPRequest
+import tornado.httpserver
+import tornado.testing
+
+from app import (EVALUATE_URL, READY_URL, App, EvaluateProviderHandler, ProxyRequestMixin,
+                 ValidationMixin, warm_up)
+from scoring import ScoringEngine
+from settings import app_settings
+from upstream import UpstreamClient
+from tornado.httpclient import AsyncHTTPClient, HTTPClientError, HTTPRequest
 from urllib.parse import urlsplit
 
 
@@ -82,4 +92,510 @@ def test_create_payload(data_set_parsed_from_en_to_ru, request_json):
                                                          request_json)
     assert new_payload['context']['to'] == 'ru'
     assert new_payload['service'] is not None
+    assert 'data_set_id' not in new_payload['context']
+    # the request payload is not changed
+    assert request_json['context'] == {'data_set_id': '1', 'score_type': 'bleu'}
+
+
+@pytest.fixture
+def identity_data_set(tmpdir, data_set_id, data_set_name):
+    # the fake upstream echoes the text, so the translation equals the source
+    lines = ['the quick brown fox jumps over the lazy dog number {}'.format(idx)
+             for idx in range(5)]
+    full_path = tmpdir.mkdir(str(data_set_id)).join('{}.txt'.format(data_set_name))
+    full_path.write('\n'.join('{0}\t{0}'.format(line) for line in lines).encode())
+    return lines
+
+
+@pytest.mark.asyncio
+async def test_evaluate(app_url, identity_data_set, request_json, monkeypatch):
+    monkeypatch.setattr(EvaluateProviderHandler, 'CHUNK_SIZE', 2)
+    response = await AsyncHTTPClient().fetch(
+        app_url + EVALUATE_URL, method='POST', body=tornado.escape.json_encode(request_json)
+    )
+    response_data = tornado.escape.json_decode(response.body)
+    assert response_data['results'] == identity_data_set
+    assert response_data['score'] == {'type': 'bleu', 'value': 1.0}
+
+
+@pytest.mark.asyncio
+async def test_evaluate_empty_data_set(app_url, upstream, tmpdir, data_set_id, data_set_name,
+                                       request_json):
+    tmpdir.mkdir(str(data_set_id)).join('{}.txt'.format(data_set_name)).write(b'')
+    response = await AsyncHTTPClient().fetch(
+        app_url + EVALUATE_URL, method='POST', body=tornado.escape.json_encode(request_json)
+    )
+    response_data = tornado.escape.json_decode(response.body)
+    assert response_data['results'] == []
+    assert upstream.requests == []
+
+
+@pytest.mark.asyncio
+async def test_evaluate_several_score_types(app_url, identity_data_set, request_json,
+                                            monkeypatch):
+    monkeypatch.setattr(EvaluateProviderHandler, 'CHUNK_SIZE', 2)
+    request_json['context']['score_type'] = ['bleu', 'chrf', 'ter']
+    expected = [{'type': 'bleu', 'value': 1.0}, {'type': 'chrf', 'value': 1.0},
+                {'type': 'ter', 'value': 0.0}]
+    response = await AsyncHTTPClient().fetch(
+        app_url + EVALUATE_URL, method='POST', body=tornado.escape.json_encode(request_json)
+    )
+    assert tornado.escape.json_decode(response.body)['score'] == expected
+
+    request_json['context']['stream'] = True
+    response = await AsyncHTTPClient().fetch(
+        app_url + EVALUATE_URL, method='POST', body=tornado.escape.json_encode(request_json)
+    )
+    records = [tornado.escape.json_decode(line) for line in response.body.splitlines()]
+    assert records[-1]['score'] == expected
+
+
+@pytest.mark.asyncio
+async def test_evaluate_segment_scores(app_url, tmpdir, data_set_id, data_set_name, request_json,
+                                       monkeypatch):
+    sources = ['the quick brown fox jumps over the lazy dog number {}'.format(idx)
+               for idx in range(5)]
+    references = list(sources)
+    references[3] = 'a slow red fox sleeps'
+    full_path = tmpdir.mkdir(str(data_set_id)).join('{}.txt'.format(data_set_name))
+    full_path.write('\n'.join(map('\t'.join, zip(sources, references))).encode())
+    request_json['context'].update(score_type=['ter', 'bleu'], segments=True, worst=2)
+
+    async def evaluate():
+        response = await AsyncHTTPClient().fetch(
+            app_url + EVALUATE_URL, method='POST', body=tornado.escape.json_encode(request_json)
+        )
+        return tornado.escape.json_decode(response.body)['segments']
+
+    segments = await evaluate()
+    assert segments['scores']['ter'][:3] == [0.0, 0.0, 0.0]
+    assert segments['scores']['ter'][3] > 0
+    assert len(segments['scores']['bleu']) == 5
+    assert len(segments['worst']) == 2
+    assert segments['worst'][0] == {
+        'index': 3, 'source': sources[3], 'reference': references[3], 'hypothesis': sources[3],
+        'scores': {'ter': segments['scores']['ter'][3], 'bleu': segments['scores']['bleu'][3]},
+    }
+
+    # larger results keep the scores of their segments with the stored result
+    monkeypatch.setitem(app_settings, 'segment_scores_inline_max', 2)
+    detached = await evaluate()
+    assert 'scores' not in detached
+    assert detached['worst'] == segments['worst']
+    response = await AsyncHTTPClient().fetch(
+        app_url + '/results/{}'.format(detached['result_id'])
+    )
+    assert tornado.escape.json_decode(response.body)['segments'] == segments
+
+
+async def fetch_job(app_url, job_id, method='GET', states=('done', 'failed', 'cancelled')):
+    for _ in range(200):
+        response = await AsyncHTTPClient().fetch(app_url + '/jobs/{}'.format(job_id),
+                                                 method=method)
+        state = tornado.escape.json_decode(response.body)
+        if state['state'] in states:
+            return state
+        method = 'GET'
+        await tornado.gen.sleep(0.01)
+    raise AssertionError('job is {}'.format(state['state']))
+
+
+@pytest.mark.asyncio
+async def test_evaluate_job(app_url, upstream, identity_data_set, request_json, monkeypatch):
+    monkeypatch.setattr(EvaluateProviderHandler, 'CHUNK_SIZE', 2)
+    request_json['context'].update(job=True, priority=3)
+    response = await AsyncHTTPClient().fetch(
+        app_url + EVALUATE_URL, method='POST', body=tornado.escape.json_encode(request_json)
+    )
+    assert response.code == 202
+    job = tornado.escape.json_decode(response.body)
+    assert response.headers['Location'] == '/jobs/{}'.format(job['id'])
+    assert job['priority'] == 3
+
+    state = await fetch_job(app_url, job['id'])
+    assert state['state'] == 'done'
+    assert (state['completed_chunks'], state['total_chunks'], state['progress']) == (3, 3, 1.0)
+    assert state['result']['results'] == identity_data_set
+    assert state['result']['score'] == {'type': 'bleu', 'value': 1.0}
+    assert all('job' not in payload['context'] for payload in upstream.requests)
+
+    with pytest.raises(HTTPClientError) as excinfo:
+        await AsyncHTTPClient().fetch(app_url + '/jobs/0123abcd')
+    assert excinfo.value.code == 404
+
+
+@pytest.mark.asyncio
+async def test_cancel_job(app_url, identity_data_set, request_json, monkeypatch):
+    cancelled = []
+
+    async def slow_fetch(self, provider_id, proxy_request):
+        try:
+            await tornado.gen.sleep(10)
+        except BaseException:
+            cancelled.append(provider_id)
+            raise
+    monkeypatch.setattr(UpstreamClient, 'fetch', slow_fetch)
+    monkeypatch.setattr(EvaluateProviderHandler, 'CHUNK_SIZE', 2)
+    request_json['context']['job'] = True
+    response = await AsyncHTTPClient().fetch(
+        app_url + EVALUATE_URL, method='POST', body=tornado.escape.json_encode(request_json)
+    )
+    job_id = tornado.escape.json_decode(response.body)['id']
+    await fetch_job(app_url, job_id, states=('running',))
+    await tornado.gen.sleep(0.05)
+
+    state = await fetch_job(app_url, job_id, method='DELETE')
+    assert state['state'] == 'cancelled'
+    # the chunks in flight upstream are cancelled with the job
+    assert len(cancelled) == 3
+
+
+@pytest.mark.asyncio
+async def test_evaluate_streaming(app_url, upstream, identity_data_set, request_json,
+                                  monkeypatch):
+    monkeypatch.setattr(EvaluateProviderHandler, 'CHUNK_SIZE', 2)
+    request_json['context']['stream'] = True
+    response = await AsyncHTTPClient().fetch(
+        app_url + EVALUATE_URL, method='POST', body=tornado.escape.json_encode(request_json)
+    )
+    assert response.headers['Content-Type'] == 'application/x-ndjson'
+    records = [tornado.escape.json_decode(line) for line in response.body.splitlines()]
+    assert [record['type'] for record in records] == ['chunk'] * 3 + ['result']
+    assert sorted(record['index'] for record in records[:-1]) == [0, 1, 2]
+    translations = [None] * len(identity_data_set)
+    for record in records[:-1]:
+        translations[record['start']:record['start'] + len(record['results'])] = record['results']
+    assert translations == identity_data_set
+    assert records[-1]['score'] == {'type': 'bleu', 'value': 1.0}
+    assert 'results' not in records[-1]
+    assert all('stream' not in payload['context'] for payload in upstream.requests)
+
+
+@pytest.mark.asyncio
+async def test_evaluate_translation_cache(app_url, upstream, identity_data_set, request_json):
+    async def evaluate(cache_mode=None):
+        payload = dict(request_json, context=dict(request_json['context']))
+        if cache_mode:
+            payload['context']['cache'] = cache_mode
+        response = await AsyncHTTPClient().fetch(
+            app_url + EVALUATE_URL, method='POST', body=tornado.escape.json_encode(payload)
+        )
+        return tornado.escape.json_decode(response.body)
+
+    first = await evaluate('bypass')
+    assert len(upstream.requests) == 1
+    assert (await evaluate())['results'] == first['results']
+    assert len(upstream.requests) == 2
+    # the translations are written in the background
+    await tornado.gen.sleep(0.1)
+
+    cached = await evaluate()
+    assert len(upstream.requests) == 2
+    assert cached['results'] == identity_data_set
+    assert cached['service'] == first['service']
+    assert cached['score'] == first['score']
+
+    await evaluate('refresh')
+    assert len(upstream.requests) == 3
+    assert 'cache' not in upstream.requests[-1]['context']
+
+
+@pytest.mark.asyncio
+async def test_evaluate_multi_provider(app_url, upstream, identity_data_set, request_json,
+                                       manager, monkeypatch):
+    monkeypatch.setattr(EvaluateProviderHandler, 'CHUNK_SIZE', 2)
+    providers = ['first.provider', 'broken.provider', 'second.provider']
+    request_json['service']['provider'] = providers
+    response = await AsyncHTTPClient().fetch(
+        app_url + EVALUATE_URL, method='POST', body=tornado.escape.json_encode(request_json)
+    )
+    response_data = tornado.escape.json_decode(response.body)
+    assert [item['service']['provider']['id'] for item in response_data] == providers
+    assert all(item['wall_time'] > 0 for item in response_data)
+
+    first, broken, second = response_data
+    assert broken['status'] == 'error'
+    for item in (first, second):
+        assert item['results'] == identity_data_set
+        assert item['score'] == {'type': 'bleu', 'value': 1.0}
+    # three chunks for each provider
+    assert len(upstream.requests) == 9
+
+    await tornado.gen.sleep(0.1)
+    store = manager.results_store
+    assert [record['result']['service'] for record in store.query('first.provider', 1)] == \
+        [first['service']]
+    assert len(store.query('second.provider', 1)) == 1
+    assert store.query('broken.provider', 1) == []
+
+
+@pytest.mark.asyncio
+async def test_evaluate_overloaded(app_url, admission_controller, identity_data_set, request_json):
+    admission_controller.max_queue = 0
+    await admission_controller.acquire(admission_controller.capacity)
+    with pytest.raises(HTTPClientError) as excinfo:
+        await AsyncHTTPClient().fetch(app_url + EVALUATE_URL, method='POST',
+                                      body=tornado.escape.json_encode(request_json))
+    assert excinfo.value.code == 503
+    assert excinfo.value.response.headers['Retry-After'] == str(admission_controller.retry_after)
+    assert admission_controller.stats()['rejected'] == 1
+
+
+@pytest.mark.asyncio
+async def test_identical_requests_are_coalesced(app_url, upstream, identity_data_set,
+                                                request_json):
+    body = tornado.escape.json_encode(request_json)
+    responses = await tornado.gen.multi([
+        AsyncHTTPClient().fetch(app_url + EVALUATE_URL, method='POST', body=body,
+                                headers={'apikey': 'SOMEKEY'})
+        for _ in range(3)
+    ])
+    assert len({response.body for response in responses}) == 1
+    assert len(upstream.requests) == 1
+
+    stats = tornado.escape.json_decode(
+        (await AsyncHTTPClient().fetch(app_url + '/stats')).body
+    )['coalescing']
+    assert stats['executed'] == 1
+    assert stats['coalesced'] == 2
+
+
+@pytest.mark.asyncio
+async def test_results_endpoints(app_url, manager, translation_result, data_set_id,
+                                 create_data_set):
+    provider_id = translation_result['service']['provider']['id']
+    for value in (0.25, 0.5):
+        await manager.save(data_set_id, dict(translation_result,
+                                             score={'type': 'bleu', 'value': value}))
+
+    async def get(path):
+        response = await AsyncHTTPClient().fetch(app_url + path)
+        return tornado.escape.json_decode(response.body)
+
+    history = await get('/results/history?provider={}&data_set_id={}&limit=1'.format(
+        provider_id, data_set_id
+    ))
+    assert [item['score'] for item in history['items']] == [0.25]
+    assert history['next_offset'] == 1
+
+    latest = await get('/results/latest?data_set_id={}'.format(data_set_id))
+    assert [item['score'] for item in latest['items']] == [0.5]
+    assert latest['next_offset'] is None
+
+    leaderboard = await get('/results/leaderboard?lang_from=en&lang_to=ru')
+    assert leaderboard['items'][0]['provider'] == provider_id
+
+    for path in ('/results/latest?limit=0',
+                 '/results/leaderboard?lang_from=en&lang_to=ru&score_type=unknown'):
+        with pytest.raises(HTTPClientError) as excinfo:
+            await get(path)
+        assert excinfo.value.code == 400
+
+
+@pytest.mark.asyncio
+async def test_metrics(app_url, upstream, identity_data_set, request_json):
+    await AsyncHTTPClient().fetch(app_url + EVALUATE_URL, method='POST',
+                                  body=tornado.escape.json_encode(request_json))
+    response = await AsyncHTTPClient().fetch(app_url + '/metrics')
+    assert response.headers['Content-Type'].startswith('text/plain; version=0.0.4')
+    body = response.body.decode()
+    for stage in ('data_set', 'admission', 'upstream', 'scoring', 'total'):
+        assert 'evaluation_stage_seconds_count{{stage="{}"}}'.format(stage) in body
+    assert 'upstream_request_seconds_bucket{provider="' in body
+    assert 'scoring_queue_seconds_count' in body
+    assert 'cache_lookups_total{cache="translation",result="miss"}' in body
+
+
+@pytest.mark.asyncio
+async def test_evaluate_invalid_field(app_url, request_json):
+    request_json['context']['score_type'] = 'unknown'
+    with pytest.raises(HTTPClientError) as excinfo:
+        await AsyncHTTPClient().fetch(app_url + EVALUATE_URL, method='POST',
+                                      body=tornado.escape.json_encode(request_json))
+    assert excinfo.value.code == 400
+    detail = tornado.escape.json_decode(excinfo.value.response.body)['detail']
+    assert detail == ('Not valid data structure, context.score_type: '
+                      'expected one of bleu, chrf, sentence_bleu, ter')
+
+
+@pytest.mark.asyncio
+async def test_upload_data_set(app_url, upstream, data_set_id, request_json, monkeypatch):
+    monkeypatch.setattr(EvaluateProviderHandler, 'CHUNK_SIZE', 2)
+    lines = ['the quick brown fox number {}'.format(idx) for idx in range(5)]
+    body = gzip.compress('\n'.join('{0}\t{0}'.format(line) for line in lines).encode())
+    response = await AsyncHTTPClient().fetch(
+        app_url + '/data_sets/{}?lang_from=en&lang_to=de'.format(data_set_id), method='PUT',
+        body=body, headers={'Content-Encoding': 'gzip'}
+    )
+    assert response.code == 201
+    assert tornado.escape.json_decode(response.body) == {
+        'data_set_id': data_set_id, 'lang_from': 'en', 'lang_to': 'de', 'lines': 5,
+    }
+
+    response = await AsyncHTTPClient().fetch(
+        app_url + EVALUATE_URL, method='POST', body=tornado.escape.json_encode(request_json)
+    )
+    assert tornado.escape.json_decode(response.body)['results'] == lines
+    # the chunks are fetched concurrently, in any order
+    assert sorted(len(payload['context']['text']) for payload in upstream.requests) == [1, 2, 2]
+    assert {payload['context']['to'] for payload in upstream.requests} == {'de'}
+
+    with pytest.raises(HTTPClientError) as excinfo:
+        await AsyncHTTPClient().fetch(
+            app_url + '/data_sets/{}?lang_from=en&lang_to=de'.format(data_set_id),
+            method='PUT', body=b'source\treference\nsource only\n'
+        )
+    assert excinfo.value.code == 400
+    detail = tornado.escape.json_decode(excinfo.value.response.body)['detail']
+    assert detail == ('Not valid data set, '
+                      'line 2: expected a source and a reference separated by a tab')
+    # the data set is left as it was
+    response = await AsyncHTTPClient().fetch(
+        app_url + EVALUATE_URL, method='POST', body=tornado.escape.json_encode(request_json)
+    )
+    assert tornado.escape.json_decode(response.body)['results'] == lines
+
+
+@pytest.mark.asyncio
+async def test_evaluate_sequential(app_url, upstream, tmpdir, data_set_id, data_set_name,
+                                   request_json, monkeypatch):
+    monkeypatch.setattr(EvaluateProviderHandler, 'CHUNK_SIZE', 2)
+    lines = ['the quick brown fox number {}'.format(idx) for idx in range(40)]
+    tmpdir.mkdir(str(data_set_id)).join('{}.txt'.format(data_set_name)).write(
+        '\n'.join('{0}\t{0}'.format(line) for line in lines).encode()
+    )
+    request_json['context'].update(sequential=True, max_lines=10, seed=1)
+    response = await AsyncHTTPClient().fetch(
+        app_url + EVALUATE_URL, method='POST', body=tornado.escape.json_encode(request_json)
+    )
+    response_data = tornado.escape.json_decode(response.body)
+    assert response_data['sequential']['stopped'] == 'budget'
+    assert response_data['sequential']['lines'] == 10
+    assert response_data['sequential']['fraction'] == 0.25
+    assert response_data['sequential']['interval'] == [1.0, 1.0]
+    assert response_data['score'] == {'type': 'bleu', 'value': 1.0}
+    translated = [idx for idx, line in enumerate(response_data['results']) if line is not None]
+    assert [lines[idx] for idx in translated] == [response_data['results'][idx]
+                                                  for idx in translated]
+    assert len(translated) == 10 and len(upstream.requests) == 5
+    # the chunks come from every part of the data set
+    assert {idx // 10 for idx in translated} == {0, 1, 2, 3}
+    assert all('sequential' not in payload['context'] for payload in upstream.requests)
+
+    # two providers are compared on the same chunks
+    upstream.requests.clear()
+    del request_json['context']['max_lines']
+    request_json['context']['ci_width'] = 0.5
+    request_json['service']['provider'] = ['first.provider', 'second.provider']
+    response = await AsyncHTTPClient().fetch(
+        app_url + EVALUATE_URL, method='POST', body=tornado.escape.json_encode(request_json)
+    )
+    first, second = tornado.escape.json_decode(response.body)
+    assert first['sequential']['stopped'] == 'interval'
+    assert first['sequential']['chunks'] == app_settings['sequential_min_chunks']
+    assert first['sequential']['difference'] == {'provider': 'second.provider',
+                                                 'interval': [0.0, 0.0]}
+    assert second['sequential']['difference']['provider'] == 'first.provider'
+    assert first['results'] == second['results']
+
+    request_json['service']['provider'].append('third.provider')
+    with pytest.raises(HTTPClientError) as excinfo:
+        await AsyncHTTPClient().fetch(app_url + EVALUATE_URL, method='POST',
+                                      body=tornado.escape.json_encode(request_json))
+    assert excinfo.value.code == 400
+
+
+@pytest.mark.asyncio
+async def test_evaluate_incremental(app_url, upstream, manager, identity_data_set, tmpdir,
+                                    data_set_id, data_set_name, request_json):
+    request_json['context'].update(incremental=True, score_type=['bleu', 'ter'])
+
+    async def evaluate():
+        response = await AsyncHTTPClient().fetch(
+            app_url + EVALUATE_URL, method='POST', body=tornado.escape.json_encode(request_json)
+        )
+        return tornado.escape.json_decode(response.body)
+
+    first = await evaluate()
+    assert first['results'] == identity_data_set
+    assert first['incremental']['translated'] == 5
+    assert first['incremental']['previous_version'] is None
+
+    # a line is fixed and another one is added in front
+    lines = ['a new line in front'] + identity_data_set
+    lines[3] = 'the fixed line'
+    tmpdir.join(str(data_set_id), '{}.txt'.format(data_set_name)).write(
+        '\n'.join('{0}\t{1}'.format(line, identity_data_set[0]) if idx == 3
+                  else '{0}\t{0}'.format(line) for idx, line in enumerate(lines)).encode()
+    )
+    upstream.requests.clear()
+    second = await evaluate()
+    assert second['results'] == lines
+    assert [payload['context']['text'] for payload in upstream.requests] == \
+        [['a new line in front', 'the fixed line']]
+    assert second['incremental']['previous_version'] == first['incremental']['data_set_version']
+    assert second['incremental']['translated'] == second['incremental']['scored'] == 2
+    # the same scores as a full evaluation
+    del request_json['context']['incremental']
+    request_json['context']['cache'] = 'bypass'
+    assert (await evaluate())['score'] == second['score']
+
+    await tornado.gen.sleep(0.1)
+    provider_id = request_json['service']['provider']
+    history = await manager.results_history(
+        provider_id, data_set_id, data_set_version=second['incremental']['data_set_version']
+    )
+    assert [item['score_type'] for item in history] == ['bleu', 'ter'] * 2
+
+    request_json['context'].update(incremental=True, stream=True)
+    with pytest.raises(HTTPClientError) as excinfo:
+        await evaluate()
+    assert excinfo.value.code == 400
+
+
+@pytest.mark.asyncio
+async def test_evaluate_batches(app_url, upstream, identity_data_set, request_json, monkeypatch):
+    monkeypatch.setitem(app_settings, 'upstream_retry_backoff', 0.01)
+    monkeypatch.setitem(app_settings['upstream_batch_limits'], 'flaky.provider',
+                        {'max_chars': 2 * len(identity_data_set[0])})
+    request_json['service']['provider'] = 'flaky.provider'
+    response = await AsyncHTTPClient().fetch(
+        app_url + EVALUATE_URL, method='POST', body=tornado.escape.json_encode(request_json)
+    )
+    response_data = tornado.escape.json_decode(response.body)
+    assert response_data['results'] == identity_data_set
+    # two lines a request, the one which failed is sent again
+    texts = [payload['context']['text'] for payload in upstream.requests]
+    assert sorted(map(len, texts)) == [1, 2, 2, 2]
+    assert len([batch for batch in texts if batch == texts[0]]) == 2
+
+
+@pytest.mark.asyncio
+async def test_ready_after_warm_up(manager, upstream, create_data_set, data_set_id, monkeypatch):
+    monkeypatch.setitem(app_settings, 'preload_data_sets', [str(data_set_id)])
+    monkeypatch.setitem(app_settings, 'warm_up_providers', ['fake.provider'])
+    application = App(manager=manager, scoring_engine=ScoringEngine(max_workers=1),
+                      upstream_client=UpstreamClient())
+    sock, port = tornado.testing.bind_unused_port()
+    server = tornado.httpserver.HTTPServer(application)
+    server.add_sockets([sock])
+    url = 'http://127.0.0.1:{}{}'.format(port, READY_URL)
+
+    with pytest.raises(HTTPClientError) as excinfo:
+        await AsyncHTTPClient().fetch(url)
+    assert excinfo.value.code == 503
 
+    await warm_up(application)
+    response = await AsyncHTTPClient().fetch(url)
+    body = tornado.escape.json_decode(response.body)
+    assert body['ready'] is True
+    assert body['warm_up']['data_sets'] == 1
+    assert body['warm_up']['scoring_workers'] == 1
+    assert body['warm_up']['upstream_connections'] == 1
+    assert body['warm_up']['seconds'] > 0
+    assert manager.data_set_cache.stats()['entries'] == 1
+    # the connection is opened without translating anything
+    assert upstream.requests == []
+    assert 'fake.provider' in application.upstream_client.pools
+    server.stop()
+    application.close()
@@ -0,0 +1,179 @@
+import collections
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from tornado import concurrent
+
+from settings import app_settings
+
+CACHE_USE = 'use'
+CACHE_BYPASS = 'bypass'
+CACHE_REFRESH = 'refresh'
+CACHE_MODES = (CACHE_USE, CACHE_BYPASS, CACHE_REFRESH)
+
+
+class TranslationCache:
+    """
+    Translations of single segments, keyed by provider, target language and text.
+
+    An in-process LRU sits in front of a SQLite file shared by the server
+    processes. Disk entries expire after ``ttl`` seconds and the least recently
+    used ones are dropped once the file holds more than ``max_bytes`` of text.
+    """
+    EVICTION_INTERVAL = 1000
+
+    def __init__(self, *args, **kwargs):
+        self.path = kwargs.get('path', app_settings['translation_cache_path'])
+        self.memory_entries = kwargs.get('memory_entries',
+                                         app_settings['translation_cache_memory_entries'])
+        self.ttl = kwargs.get('ttl', app_settings['translation_cache_ttl'])
+        self.max_bytes = kwargs.get('max_bytes', app_settings['translation_cache_max_bytes'])
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._memory = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._connection = None
+        self._puts_since_eviction = 0
+
+    @staticmethod
+    def make_key(provider_id, lang_to, text):
+        """
+        :type text: str or None
+        :param text: segment, None for the response envelope of the provider
+        """
+        raw = json.dumps([provider_id, lang_to, text], ensure_ascii=False).encode()
+        return hashlib.sha1(raw).hexdigest()
+
+    def _connect(self):
+        # opened lazily, so every forked process gets its own connection
+        if self._connection is None:
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory, exist_ok=True)
+            self._connection = sqlite3.connect(self.path, timeout=30)
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS translations ('
+                'key TEXT PRIMARY KEY, value TEXT, size INTEGER, created REAL, accessed REAL)'
+            )
+            self._connection.execute(
+                'CREATE INDEX IF NOT EXISTS translations_accessed ON translations (accessed)'
+            )
+        return self._connection
+
+    def _remember(self, key, value):
+        with self._lock:
+            self._memory[key] = value
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+    @concurrent.run_on_executor
+    def _read_disk(self, keys):
+        connection = self._connect()
+        now = time.time()
+        found = {}
+        for start in range(0, len(keys), 500):
+            batch = keys[start:start + 500]
+            rows = connection.execute(
+                'SELECT key, value FROM translations WHERE created > ? AND key IN ({})'.format(
+                    ','.join('?' * len(batch))
+                ),
+                [now - self.ttl] + batch
+            )
+            found.update(rows)
+        if found:
+            with connection:
+                connection.executemany('UPDATE translations SET accessed = ? WHERE key = ?',
+                                       [(now, key) for key in found])
+        return found
+
+    @concurrent.run_on_executor
+    def _write_disk(self, items):
+        connection = self._connect()
+        now = time.time()
+        with connection:
+            connection.executemany(
+                'INSERT OR REPLACE INTO translations VALUES (?, ?, ?, ?, ?)',
+                [(key, value, len(value), now, now) for key, value in items.items()]
+            )
+        self._puts_since_eviction += len(items)
+        if self._puts_since_eviction >= self.EVICTION_INTERVAL:
+            self._puts_since_eviction = 0
+            self._evict(connection, now)
+
+    def _evict(self, connection, now):
+        with connection:
+            connection.execute('DELETE FROM translations WHERE created <= ?', (now - self.ttl,))
+            total = connection.execute('SELECT COALESCE(SUM(size), 0) FROM translations')
+            excess = total.fetchone()[0] - self.max_bytes
+            while excess > 0:
+                rows = connection.execute(
+                    'SELECT key, size FROM translations ORDER BY accessed LIMIT 1000'
+                ).fetchall()
+                if not rows:
+                    break
+                evicted = []
+                for key, size in rows:
+                    evicted.append((key,))
+                    excess -= size
+                    if excess <= 0:
+                        break
+                connection.executemany('DELETE FROM translations WHERE key = ?', evicted)
+
+    async def get_many(self, keys):
+        """
+        :type keys: list
+        :return: cached value of every key, None for misses
+        """
+        result = [None] * len(keys)
+        missing = []
+        with self._lock:
+            for idx, key in enumerate(keys):
+                value = self._memory.get(key)
+                if value is None:
+                    missing.append(idx)
+                else:
+                    self._memory.move_to_end(key)
+                    result[idx] = value
+        self.memory_hits += len(keys) - len(missing)
+
+        if missing:
+            found = await self._read_disk(list({keys[idx] for idx in missing}))
+            for idx in missing:
+                value = found.get(keys[idx])
+                if value is None:
+                    self.misses += 1
+                else:
+                    self.disk_hits += 1
+                    result[idx] = value
+                    self._remember(keys[idx], value)
+        return result
+
+    async def put_many(self, items):
+        """
+        :type items: dict
+        :param items: values by key
+        """
+        if not items:
+            return
+        for key, value in items.items():
+            self._remember(key, value)
+        await self._write_disk(items)
+
+    def stats(self):
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            'memory_entries': len(self._memory),
+            'memory_hits': self.memory_hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'hit_rate': (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,264 @@
+import asyncio
+import logging
+import time
+
+from tornado import gen, locks
+from tornado.httpclient import AsyncHTTPClient, HTTPError, HTTPRequest
+
+from batching import (RETRY_STATUSES, TOO_LARGE, TOO_MANY_REQUESTS, BatchPlanner,
+                      parse_retry_after, retry_delay)
+from metrics import UPSTREAM_CHUNK_BYTES, UPSTREAM_SECONDS, UPSTREAM_WAIT_SECONDS
+from settings import app_settings
+
+
+async def _gather_or_cancel(*aws):
+    """
+    ``asyncio.gather`` which cancels the others when one of ``aws`` fails, so no
+    batch of a failed chunk keeps sending or retrying.
+
+    :rtype: list
+    """
+    futures = [asyncio.ensure_future(aw) for aw in aws]
+    try:
+        return await asyncio.gather(*futures)
+    finally:
+        for future in futures:
+            if not future.done():
+                future.cancel()
+
+
+class ProviderPool:
+    """
+    HTTP client of a single provider with a limit on requests in flight.
+    """
+
+    def __init__(self, client, max_in_flight, budget=None, provider_id=None):
+        self.client = client
+        self.provider_id = provider_id
+        self.max_in_flight = max_in_flight
+        self.semaphore = locks.Semaphore(max_in_flight)
+        # shared by all providers
+        self.budget = budget
+        self.in_flight = 0
+        self.waiting = 0
+        self.requests = 0
+        self.errors = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+
+    async def fetch(self, request):
+        self.waiting += 1
+        started = time.monotonic()
+        try:
+            await self.semaphore.acquire()
+            if self.budget is not None:
+                try:
+                    await self.budget.acquire()
+                except BaseException:
+                    self.semaphore.release()
+                    raise
+        finally:
+            self.waiting -= 1
+        waited = time.monotonic() - started
+        self.wait_time += waited
+        self.max_wait_time = max(self.max_wait_time, waited)
+        UPSTREAM_WAIT_SECONDS.observe(waited, self.provider_id)
+        UPSTREAM_CHUNK_BYTES.observe(len(request.body or b''), self.provider_id)
+
+        self.in_flight += 1
+        self.requests += 1
+        status = 'ok'
+        started = time.monotonic()
+        try:
+            return await self.client.fetch(request)
+        except Exception:
+            self.errors += 1
+            status = 'error'
+            raise
+        finally:
+            UPSTREAM_SECONDS.observe(time.monotonic() - started, self.provider_id, status)
+            self.in_flight -= 1
+            if self.budget is not None:
+                self.budget.release()
+            self.semaphore.release()
+
+    def stats(self):
+        return {
+            'max_in_flight': self.max_in_flight,
+            'in_flight': self.in_flight,
+            'waiting': self.waiting,
+            'requests': self.requests,
+            'errors': self.errors,
+            'wait_time': self.wait_time,
+            'max_wait_time': self.max_wait_time,
+            'mean_wait_time': self.wait_time / self.requests if self.requests else 0.0,
+        }
+
+
+class UpstreamClient:
+    """
+    Upstream HTTP layer: one connection pool per provider, so a slow provider
+    only queues its own requests.
+
+    The curl backend keeps connections alive between requests, the simple
+    client of tornado opens a connection per request.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.backend = kwargs.get('backend', app_settings['upstream_backend'])
+        self.max_clients = kwargs.get('max_clients', app_settings['upstream_max_clients'])
+        self.max_in_flight = kwargs.get('max_in_flight', app_settings['upstream_max_in_flight'])
+        self.connect_timeout = kwargs.get('connect_timeout',
+                                          app_settings['upstream_connect_timeout'])
+        self.request_timeout = kwargs.get('request_timeout',
+                                          app_settings['upstream_request_timeout'])
+        self.gzip = kwargs.get('gzip', app_settings['upstream_gzip'])
+        self.max_in_flight_total = kwargs.get('max_in_flight_total',
+                                              app_settings['upstream_max_in_flight_total'])
+        self.batch_limits = kwargs.get('batch_limits', app_settings['upstream_batch_limits'])
+        self.retries = kwargs.get('retries', app_settings['upstream_retries'])
+        self.retried = 0
+        self.budget = None
+        self.pools = {}
+        self.planners = {}
+
+    def _client_class(self):
+        if self.backend == 'curl':
+            try:
+                from tornado.curl_httpclient import CurlAsyncHTTPClient
+                return CurlAsyncHTTPClient
+            except ImportError:
+                logging.warning('pycurl is not installed, using the simple http client')
+                self.backend = 'simple'
+        return AsyncHTTPClient
+
+    def get_pool(self, provider_id):
+        # pools are created on first use, in the process and IOLoop which use them
+        pool = self.pools.get(provider_id)
+        if pool is None:
+            if self.budget is None:
+                self.budget = locks.Semaphore(self.max_in_flight_total)
+            client = self._client_class()(force_instance=True, max_clients=self.max_clients)
+            pool = self.pools[provider_id] = ProviderPool(client, self.max_in_flight, self.budget,
+                                                          provider_id)
+        return pool
+
+    def get_planner(self, provider_id, items=None):
+        """
+        :param items: batch size the planner starts with, when it is created
+        :rtype: BatchPlanner
+        """
+        planner = self.planners.get(provider_id)
+        if planner is None:
+            planner = self.planners[provider_id] = BatchPlanner(
+                provider_id, items=items, **self.batch_limits.get(provider_id, {})
+            )
+        return planner
+
+    def prepare(self, request):
+        request.connect_timeout = self.connect_timeout
+        request.request_timeout = self.request_timeout
+        request.decompress_response = self.gzip
+        if self.gzip:
+            request.headers['Accept-Encoding'] = 'gzip'
+        return request
+
+    async def fetch(self, provider_id, request):
+        """
+        :type provider_id: str
+        :type request: tornado.httpclient.HTTPRequest
+        :rtype: tornado.httpclient.HTTPResponse
+        """
+        return await self.get_pool(provider_id).fetch(self.prepare(request))
+
+    async def _fetch_batch(self, provider_id, texts, render, planner):
+        attempt = 0
+        while True:
+            try:
+                response = await self.fetch(provider_id, render(texts))
+            except HTTPError as exc:
+                if exc.code == TOO_LARGE and len(texts) > 1:
+                    planner.too_large(len(texts))
+                    half = len(texts) // 2
+                    first, second = await _gather_or_cancel(
+                        self._fetch_batch(provider_id, texts[:half], render, planner),
+                        self._fetch_batch(provider_id, texts[half:], render, planner),
+                    )
+                    return first + second
+                if exc.code not in RETRY_STATUSES or attempt >= self.retries:
+                    raise
+                if exc.code == TOO_MANY_REQUESTS:
+                    planner.throttled()
+                delay = retry_delay(attempt, parse_retry_after(exc.response))
+                logging.info('retrying a batch of %s for %s in %.2fs: %s', len(texts),
+                             provider_id, delay, exc)
+                self.retried += 1
+                attempt += 1
+                await gen.sleep(delay)
+                continue
+            planner.completed(len(texts), response.request_time)
+            return [(texts, response)]
+
+    async def fetch_batches(self, provider_id, texts, render, items=None):
+        """
+        Send ``texts`` in the batches the planner of the provider plans, all at once.
+
+        Only a batch which fails is sent again: after a backoff, up to ``retries``
+        times, when the status is worth a retry, and split in halves when the
+        provider rejects it as too large.
+
+        :type texts: list
+        :param render: makes the request of a list of texts
+        :param items: batch size of a new planner
+        :rtype: list
+        :return: (texts, response) of every batch sent, in the order of the texts
+        """
+        planner = self.get_planner(provider_id, items)
+        # cancelled with the chunk they belong to, or when one of them fails
+        batches = await _gather_or_cancel(*[
+            self._fetch_batch(provider_id, texts[start:stop], render, planner)
+            for start, stop in planner.plan(texts)
+        ])
+        return [batch for sent in batches for batch in sent]
+
+    async def warm_up(self, provider_ids, url):
+        """
+        Create the pools of ``provider_ids`` and open a connection of each to ``url``
+        with a HEAD request, so the first evaluation does not pay for DNS, TCP and
+        TLS; the curl backend keeps the connections for the next requests.
+
+        :type provider_ids: list
+        :return: number of providers whose connection was opened, whatever the status
+        """
+        async def connect(provider_id):
+            request = self.prepare(HTTPRequest(url, method='HEAD'))
+            try:
+                # not counted as a request of the provider
+                await self.get_pool(provider_id).client.fetch(request)
+            except HTTPError as exc:
+                # 599 is a connection which failed, any other status an answer
+                if exc.code == 599:
+                    logging.warning('cannot connect to %s for %s: %s', url, provider_id, exc)
+                    return False
+            except OSError as exc:
+                logging.warning('cannot connect to %s for %s: %s', url, provider_id, exc)
+                return False
+            return True
+
+        return sum(await gen.multi([connect(provider_id) for provider_id in provider_ids]))
+
+    def close(self):
+        for pool in self.pools.values():
+            pool.client.close()
+        self.pools = {}
+
+    def stats(self):
+        return {
+            'backend': self.backend,
+            'max_in_flight_total': self.max_in_flight_total,
+            'in_flight': sum(pool.in_flight for pool in self.pools.values()),
+            'retried': self.retried,
+            'providers': {provider_id: pool.stats() for provider_id, pool in self.pools.items()},
+            'batches': {provider_id: planner.stats()
+                        for provider_id, planner in self.planners.items()},
+        }
@@ -1,16 +1,34 @@
+import collections
+import functools
 import hashlib
+import itertools
+import math
 import random
 import string
 import logging
 import time
 
-import nltk
-from nltk.translate.bleu_score import SmoothingFunction
-from multiprocessing import Pool
+import numpy as np
 
 LOGGING_FORMAT = '%(asctime)s - %(message)s'
 logging.basicConfig(level=logging.INFO, format=LOGGING_FORMAT)
 
+BLEU_MAX_ORDER = 4
+# ``k`` of nltk ``SmoothingFunction``, used by method4
+BLEU_SMOOTHING_K = 5
+
+CHRF_MAX_ORDER = 6
+# recall is weighted ``beta`` times as much as precision
+CHRF_BETA = 2
+# segments whose edit distances are computed together
+EDIT_DISTANCE_BATCH = 1024
+
+BleuStats = collections.namedtuple('BleuStats', ['matches', 'totals', 'hyp_lengths', 'ref_lengths'])
+ChrfStats = collections.namedtuple('ChrfStats', ['matches', 'hyp_totals', 'ref_totals'])
+TerStats = collections.namedtuple('TerStats', ['edits', 'ref_lengths'])
+# sentence scores of groups of segments, for the mean of the sentence scores
+MeanStats = collections.namedtuple('MeanStats', ['sums', 'counts'])
+
 
 def generate_hash(name):
     salt = ''.join([random.choice(string.printable) for i in range(16)])
@@ -28,50 +46,799 @@ def split(arr, size):
     return arrs
 
 
-def run_single_corpus_bleu(pair):
+def tokenize(sentences):
+    return [sentence.split(' ') for sentence in sentences]
+
+
+def _lookup(table, values):
     """
-    >>> hyp1 = "It is a guide to action which ensures that the military always obeys the commands of the party"
-    >>> ref1 = "It is a guide to action that ensures that the military will forever heed Party commands"
-    >>> hyp2 = "he read the book because he was interested in world history"
-    >>> ref2 = "he was interested in world history because he read the book"
+    Indexes of ``values`` in the sorted ``table``, -1 for values which are not there.
+    """
+    result = np.full(len(values), -1, dtype=np.int64)
+    if not len(table) or not len(values):
+        return result
+    # searching sorted values keeps the binary searches cache friendly
+    order = np.argsort(values)
+    sorted_values = values[order]
+    idx = np.minimum(np.searchsorted(table, sorted_values), len(table) - 1)
+    result[order] = np.where(table[idx] == sorted_values, idx, -1)
+    return result
 
-    >>> score_translation([ref1, ref2], [hyp1, hyp2])
-    0.1523009076658375
 
-    >>> score_translation([ref1, ref2], [ref1, ref2])
-    0.1523009076658375
+def _ngram_keys(ids, lengths, vocab_size, tables=None, max_order=BLEU_MAX_ORDER):
+    """
+    Give every n-gram starting at every token position an integer key.
+
+    Keys of order ``n`` are indexes in ``tables[n]``, the sorted unique values of
+    ``key(n - 1) * vocab_size + id``. Without ``tables`` they are built from ``ids``,
+    otherwise n-grams which are not in the tables (and tokens with id -1) get -1.
+
+    :rtype: (list, list)
+    """
+    total = len(ids)
+    ends = np.repeat(np.cumsum(lengths), lengths)
+    positions = np.arange(total, dtype=np.int64)
+    build = tables is None
+    if build:
+        tables = [None, None]
+
+    keys = [None, ids]
+    key = ids
+    for n in range(2, max_order + 1):
+        last = positions + n - 1
+        valid = last < ends
+        next_ids = ids[np.minimum(last, total - 1)] if total else ids
+        valid &= (key >= 0) & (next_ids >= 0)
+        combined = key[valid] * vocab_size + next_ids[valid]
+        key = np.full(total, -1, dtype=np.int64)
+        if build:
+            table, key[valid] = np.unique(combined, return_inverse=True)
+            tables.append(table)
+        else:
+            key[valid] = _lookup(tables[n], combined)
+        keys.append(key)
+    return keys, tables
+
+
+def _count_ngrams(keys, lengths, size):
+    """
+    :return: sorted unique ``sentence * size + key`` values and their counts
+    """
+    sentences = np.repeat(np.arange(len(lengths), dtype=np.int64), lengths)
+    mask = keys >= 0
+    return np.unique(sentences[mask] * size + keys[mask], return_counts=True)
+
+
+class ReferenceNgrams:
+    """
+    Tokenized references with their n-gram counts, one reference per segment.
+
+    Built once per corpus and sliced per shard; hypotheses are matched against it
+    by ``bleu_statistics``.
+    """
+
+    def __init__(self, references, max_order=BLEU_MAX_ORDER):
+        """
+        :type references: list
+        :param references: list of token lists
+        """
+        lengths = np.fromiter((len(ref) for ref in references), dtype=np.int64,
+                              count=len(references))
+        tokens = list(itertools.chain.from_iterable(references))
+        # dict.fromkeys keeps the first occurrence order, which gives dense ids
+        vocab = {token: idx for idx, token in enumerate(dict.fromkeys(tokens))}
+        ids = np.fromiter(map(vocab.__getitem__, tokens), dtype=np.int64, count=len(tokens))
+        self._build(ids, lengths, list(vocab), max_order)
+
+    @classmethod
+    def from_ids(cls, ids, lengths, tokens, max_order=BLEU_MAX_ORDER):
+        """
+        :param ids: token ids of all references, one after another
+        :param lengths: number of tokens of every reference
+        :param tokens: token of every id
+        """
+        self = cls.__new__(cls)
+        self._build(np.asarray(ids, dtype=np.int64), np.asarray(lengths, dtype=np.int64),
+                    tokens, max_order)
+        return self
+
+    def _build(self, ids, lengths, tokens, max_order):
+        self.max_order = max_order
+        self.tokens = tokens
+        self.vocab = {token: idx for idx, token in enumerate(tokens)}
+        self.ids = ids
+        self.lengths = lengths
+        # position of the first token of every reference in ``ids``
+        self.offsets = np.cumsum(lengths) - lengths
+        keys, self.tables = _ngram_keys(ids, lengths, len(tokens), max_order=max_order)
+        self.sizes = [None, len(tokens)] + [len(table) for table in self.tables[2:]]
+        self.counts = [None] + [
+            _count_ngrams(keys[n], lengths, self.sizes[n]) for n in range(1, max_order + 1)
+        ]
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def slice(self, start, stop):
+        """
+        Self-contained references of segments ``start:stop``.
+
+        The vocabulary and n-gram tables are cut down to what the segments use, so
+        a slice is cheap to send to a scoring worker.
+        """
+        start, stop, _ = slice(start, stop).indices(len(self))
+        sentences, used, keys, counts = [None], [None], [None], [None]
+        for n in range(1, self.max_order + 1):
+            size = self.sizes[n]
+            pairs, pair_counts = self.counts[n]
+            low, high = np.searchsorted(pairs, [start * size, stop * size])
+            pairs = pairs[low:high] - start * size
+            sentences.append(pairs // size)
+            used_keys, new_keys = np.unique(pairs % size, return_inverse=True)
+            used.append(used_keys)
+            keys.append(new_keys)
+            counts.append(pair_counts[low:high])
+
+        piece = ReferenceNgrams.__new__(ReferenceNgrams)
+        piece.max_order = self.max_order
+        piece.tokens = [self.tokens[idx] for idx in used[1].tolist()]
+        piece.vocab = {token: idx for idx, token in enumerate(piece.tokens)}
+        piece.lengths = self.lengths[start:stop]
+        first = self.offsets[start] if start < stop else 0
+        piece.offsets = self.offsets[start:stop] - first
+        piece.ids = np.searchsorted(used[1], self.ids[first:first + piece.lengths.sum()])
+        vocab_size = len(piece.tokens)
+        piece.tables = [None, None]
+        for n in range(2, self.max_order + 1):
+            # renumbering by rank keeps the tables sorted
+            combined = self.tables[n][used[n]]
+            prefix = np.searchsorted(used[n - 1], combined // self.sizes[1])
+            last = np.searchsorted(used[1], combined % self.sizes[1])
+            piece.tables.append(prefix * vocab_size + last)
+        piece.sizes = [None, vocab_size] + [len(table) for table in piece.tables[2:]]
+        piece.counts = [None]
+        for n in range(1, self.max_order + 1):
+            piece.counts.append((sentences[n] * piece.sizes[n] + keys[n], counts[n]))
+        return piece
+
+
+def _hypothesis_ids(hypotheses, references):
+    """
+    Ids of the hypothesis tokens in the vocabulary of the references, -1 for
+    unknown tokens, and the length of every hypothesis.
+    """
+    lengths = np.fromiter((len(hyp) for hyp in hypotheses), dtype=np.int64,
+                          count=len(hypotheses))
+    tokens = itertools.chain.from_iterable(hypotheses)
+    ids = np.fromiter(map(references.vocab.get, tokens, itertools.repeat(-1)),
+                      dtype=np.int64, count=int(lengths.sum()))
+    return ids, lengths
+
+
+def clipped_matches(ids, lengths, references):
+    """
+    N-gram matches of every hypothesis, clipped by the counts in its reference.
+
+    :param ids: token ids of all hypotheses, from ``_hypothesis_ids``
+    :type references: ReferenceNgrams
+    :rtype: numpy.ndarray
+    :return: one row per segment, one column per order
+    """
+    max_order = references.max_order
+    keys, _ = _ngram_keys(ids, lengths, len(references.vocab), references.tables, max_order)
+    segments = len(lengths)
+    matches = np.zeros((segments, max_order), dtype=np.int64)
+    for n in range(1, max_order + 1):
+        size = references.sizes[n]
+        hyp_keys, hyp_counts = _count_ngrams(keys[n], lengths, size)
+        ref_keys, ref_counts = references.counts[n]
+        if not len(hyp_keys) or not len(ref_keys):
+            continue
+        idx = np.minimum(np.searchsorted(ref_keys, hyp_keys), len(ref_keys) - 1)
+        clipped = np.where(ref_keys[idx] == hyp_keys, np.minimum(hyp_counts, ref_counts[idx]), 0)
+        matches[:, n - 1] = np.bincount(hyp_keys // size, weights=clipped, minlength=segments)
+    return matches
+
+
+def _bleu_stats(matches, hyp_lengths, references):
+    orders = np.arange(references.max_order, dtype=np.int64)
+    # like nltk, the denominator of every segment is at least 1
+    totals = np.maximum(1, hyp_lengths[:, None] - orders[None, :])
+    return BleuStats(matches=matches, totals=totals,
+                     hyp_lengths=hyp_lengths, ref_lengths=references.lengths.copy())
+
+
+def bleu_statistics(hypotheses, references):
+    """
+    Clipped n-gram matches, n-gram totals and lengths of every segment.
+
+    :type hypotheses: list
+    :param hypotheses: list of token lists
+    :type references: ReferenceNgrams
+    :rtype: BleuStats
+    """
+    ids, hyp_lengths = _hypothesis_ids(hypotheses, references)
+    return _bleu_stats(clipped_matches(ids, hyp_lengths, references), hyp_lengths, references)
+
+
+def merge_bleu_stats(stats):
+    """
+    Concatenate statistics of consecutive shards, their sums give the corpus statistics.
+
+    :type stats: list
+    :rtype: BleuStats
+    """
+    return BleuStats(*[np.concatenate(field) for field in zip(*stats)])
+
+
+def _smoothed_log_precisions(matches, totals, hyp_lengths):
+    """
+    Vectorized ``SmoothingFunction().method4`` of nltk: the i-th order without
+    matches gets ``log(hyp_len) / (2 ** i * k)`` matches.
+    """
+    matches = matches.astype(np.float64)
+    zero = matches == 0
+    hyp_lengths = hyp_lengths.astype(np.float64)[:, None]
+    smoothable = zero & (hyp_lengths > 1)
+    increment = np.cumsum(smoothable, axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        smoothed = np.log(hyp_lengths) / (2.0 ** increment * BLEU_SMOOTHING_K)
+        numerators = np.where(smoothable, smoothed, matches)
+        precisions = numerators / totals
+        return np.where(precisions > 0, np.log(precisions), 0.0)
+
+
+def _brevity_penalty(ref_lengths, hyp_lengths):
+    ref_lengths = np.asarray(ref_lengths, dtype=np.float64)
+    hyp_lengths = np.asarray(hyp_lengths, dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        penalty = np.exp(1 - ref_lengths / hyp_lengths)
+    return np.where(hyp_lengths > ref_lengths, 1.0, np.where(hyp_lengths == 0, 0.0, penalty))
+
+
+def corpus_bleu_from_stats(stats):
+    """
+    Same value as nltk ``corpus_bleu`` with ``SmoothingFunction().method4``.
+
+    :type stats: BleuStats
+    :rtype: float
+    """
+    matches = stats.matches.sum(axis=0)
+    if matches[0] == 0:
+        return 0
+    totals = stats.totals.sum(axis=0)
+    hyp_length = stats.hyp_lengths.sum()
+    log_precisions = _smoothed_log_precisions(matches[None, :], totals[None, :],
+                                              np.array([hyp_length]))[0]
+    weight = 1 / len(matches)
+    bp = _brevity_penalty(stats.ref_lengths.sum(), hyp_length)
+    return float(bp * math.exp(math.fsum(weight * log_precisions)))
+
+
+def sentence_bleu_from_stats(stats):
+    """
+    Same values as nltk ``sentence_bleu`` with ``SmoothingFunction().method4``,
+    for every segment at once.
+
+    :type stats: BleuStats
+    :rtype: numpy.ndarray
+    """
+    log_precisions = _smoothed_log_precisions(stats.matches, stats.totals, stats.hyp_lengths)
+    weight = 1 / stats.matches.shape[1]
+    scores = _brevity_penalty(stats.ref_lengths, stats.hyp_lengths) * np.exp(
+        weight * log_precisions.sum(axis=1)
+    )
+    return np.where(stats.matches[:, 0] == 0, 0.0, scores)
+
+
+def _pad(ids, lengths, offsets, rows, fill):
+    """
+    Token ids of the segments ``rows`` as a matrix, one padded row per segment.
+    """
+    row_lengths = lengths[rows]
+    matrix = np.full((len(rows), int(row_lengths.max(initial=0))), fill, dtype=np.int64)
+    total = int(row_lengths.sum())
+    row_idx = np.repeat(np.arange(len(rows)), row_lengths)
+    starts = np.cumsum(row_lengths) - row_lengths
+    col_idx = np.arange(total) - np.repeat(starts, row_lengths)
+    matrix[row_idx, col_idx] = ids[np.repeat(offsets[rows], row_lengths) + col_idx]
+    return matrix
+
+
+def edit_distances(hyp_ids, hyp_lengths, ref_ids, ref_lengths):
+    """
+    Levenshtein distance of every hypothesis to its reference, in tokens.
+
+    Segments of similar length are processed together, a row of the dynamic
+    programming matrix of all of them at a time.
+
+    :rtype: numpy.ndarray
+    """
+    segments = len(hyp_lengths)
+    distances = np.zeros(segments, dtype=np.int64)
+    hyp_offsets = np.cumsum(hyp_lengths) - hyp_lengths
+    ref_offsets = np.cumsum(ref_lengths) - ref_lengths
+    order = np.argsort(hyp_lengths + ref_lengths, kind='stable')
+    for batch in range(0, segments, EDIT_DISTANCE_BATCH):
+        rows = order[batch:batch + EDIT_DISTANCE_BATCH]
+        hyp = _pad(hyp_ids, hyp_lengths, hyp_offsets, rows, -2)
+        ref = _pad(ref_ids, ref_lengths, ref_offsets, rows, -3)
+        columns = np.arange(ref.shape[1] + 1)
+        previous = np.tile(columns, (len(rows), 1))
+        active_lengths = hyp_lengths[rows][:, None]
+        for i in range(1, hyp.shape[1] + 1):
+            current = np.empty_like(previous)
+            current[:, 0] = i
+            current[:, 1:] = np.minimum(previous[:, :-1] + (hyp[:, i - 1:i] != ref),
+                                        previous[:, 1:] + 1)
+            # insertions: current[j] = min(current[j], current[j - 1] + 1)
+            current = np.minimum.accumulate(current - columns, axis=1) + columns
+            previous = np.where(i <= active_lengths, current, previous)
+        distances[rows] = previous[np.arange(len(rows)), ref_lengths[rows]]
+    return distances
+
+
+class SegmentPass:
+    """
+    Hypotheses of a shard with what the metrics have in common: the tokenization,
+    the token ids in the reference vocabulary and the clipped n-gram matches are
+    computed once, on first use, whatever the number of metrics.
+    """
+
+    def __init__(self, references, hypotheses):
+        """
+        :type references: ReferenceNgrams
+        :type hypotheses: list
+        :param hypotheses: hypothesis sentences
+        """
+        self.references = references
+        self.hypotheses = hypotheses
+
+    @functools.cached_property
+    def tokens(self):
+        return tokenize(self.hypotheses)
+
+    @functools.cached_property
+    def word_ids(self):
+        return _hypothesis_ids(self.tokens, self.references)
+
+    @functools.cached_property
+    def bleu_stats(self):
+        ids, lengths = self.word_ids
+        return _bleu_stats(clipped_matches(ids, lengths, self.references), lengths,
+                           self.references)
+
+    @functools.cached_property
+    def char_references(self):
+        # characters without the spaces between the tokens
+        references = self.references
+        tokens = references.tokens
+        sentences = [''.join(map(tokens.__getitem__, ids.tolist()))
+                     for ids in np.split(references.ids, references.offsets[1:])
+                     ] if len(references) else []
+        return ReferenceNgrams(sentences, max_order=CHRF_MAX_ORDER)
+
+    @functools.cached_property
+    def char_ids(self):
+        return _hypothesis_ids([''.join(tokens) for tokens in self.tokens], self.char_references)
+
+
+class Scorer:
+    """
+    A metric computed from statistics of every segment.
+
+    ``statistics`` returns a namedtuple of arrays with one row per segment, so the
+    statistics of consecutive shards are merged by concatenation and the corpus
+    score only needs their sums: a registered scorer is sharded over the scoring
+    pool like BLEU.
+    """
+    name = None
+    stats_type = None
+    lower_is_better = False
+
+    def statistics(self, segments):
+        """
+        :type segments: SegmentPass
+        """
+        raise NotImplementedError
+
+    def merge(self, stats):
+        return self.stats_type(*[np.concatenate(field) for field in zip(*stats)])
+
+    def corpus_score(self, stats):
+        """
+        :rtype: float
+        """
+        raise NotImplementedError
+
+    def sentence_scores(self, stats):
+        """
+        :rtype: numpy.ndarray
+        """
+        raise NotImplementedError
+
+    def group(self, stats):
+        """
+        One row of statistics for a group of segments, which the bootstrap
+        resamples as a whole: the sums of their statistics.
+        """
+        return self.stats_type(*[field.sum(axis=0, keepdims=True) for field in stats])
+
+    def resampled_scores(self, groups, weights):
+        """
+        Corpus scores of resamples of the groups. The segment formula applied
+        to summed statistics is the corpus formula.
+
+        :param groups: ``group`` rows, concatenated
+        :type weights: numpy.ndarray
+        :param weights: (resamples, groups), how often each group is drawn
+        :rtype: numpy.ndarray
+        """
+        return self.sentence_scores(self.stats_type(*[weights @ field for field in groups]))
+
+
+SCORERS = {}
+
+
+def register_scorer(scorer_class):
+    """
+    Class decorator which makes a ``Scorer`` available as a score type.
     """
-    list_of_references, hypotheses = pair
-    return nltk.translate.bleu_score.corpus_bleu(list_of_references, hypotheses,
-                                                 smoothing_function=SmoothingFunction().method4)
+    SCORERS[scorer_class.name] = scorer_class()
+    return scorer_class
+
+
+def get_scorer(name):
+    try:
+        return SCORERS[name]
+    except (KeyError, TypeError):
+        raise ValueError('Not acceptable type: {}'.format(name))
+
+
+@register_scorer
+class BleuScorer(Scorer):
+    name = 'bleu'
+    stats_type = BleuStats
+
+    def statistics(self, segments):
+        return segments.bleu_stats
+
+    def corpus_score(self, stats):
+        return corpus_bleu_from_stats(stats)
+
+    def sentence_scores(self, stats):
+        return sentence_bleu_from_stats(stats)
+
+
+@register_scorer
+class SentenceBleuScorer(BleuScorer):
+    """
+    Mean of the sentence level BLEU scores.
+    """
+    name = 'sentence_bleu'
+
+    def corpus_score(self, stats):
+        scores = self.sentence_scores(stats)
+        return float(scores.mean()) if len(scores) else 0.0
+
+    def group(self, stats):
+        scores = self.sentence_scores(stats)
+        return MeanStats(sums=np.array([scores.sum()]), counts=np.array([len(scores)]))
+
+    def resampled_scores(self, groups, weights):
+        counts = weights @ groups.counts
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(counts > 0, (weights @ groups.sums) / counts, 0.0)
+
+
+@register_scorer
+class ChrfScorer(Scorer):
+    """
+    chrF: F-score of character n-grams up to ``CHRF_MAX_ORDER``, spaces removed,
+    with precision and recall averaged over the orders; between 0 and 1.
+    """
+    name = 'chrf'
+    stats_type = ChrfStats
+
+    def statistics(self, segments):
+        ids, lengths = segments.char_ids
+        references = segments.char_references
+        orders = np.arange(CHRF_MAX_ORDER, dtype=np.int64)
+        return ChrfStats(matches=clipped_matches(ids, lengths, references),
+                         hyp_totals=np.maximum(0, lengths[:, None] - orders[None, :]),
+                         ref_totals=np.maximum(0, references.lengths[:, None] - orders[None, :]))
+
+    @staticmethod
+    def _f_score(matches, hyp_totals, ref_totals):
+        matches = matches.astype(np.float64)
+        # orders longer than the hypothesis or the reference are left out
+        present = (hyp_totals > 0) & (ref_totals > 0)
+        orders = present.sum(axis=-1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            precision = np.where(present, matches / hyp_totals, 0.0).sum(axis=-1) / orders
+            recall = np.where(present, matches / ref_totals, 0.0).sum(axis=-1) / orders
+            beta2 = CHRF_BETA ** 2
+            score = (1 + beta2) * precision * recall / (beta2 * precision + recall)
+        return np.where((orders > 0) & (precision + recall > 0), score, 0.0)
+
+    def corpus_score(self, stats):
+        return float(self._f_score(stats.matches.sum(axis=0), stats.hyp_totals.sum(axis=0),
+                                   stats.ref_totals.sum(axis=0)))
+
+    def sentence_scores(self, stats):
+        return self._f_score(stats.matches, stats.hyp_totals, stats.ref_totals)
+
+
+@register_scorer
+class TerScorer(Scorer):
+    """
+    Translation edit rate without block shifts: word insertions, deletions and
+    substitutions per reference word, so never below TER with shifts. Lower is better.
+    """
+    name = 'ter'
+    stats_type = TerStats
+    lower_is_better = True
+
+    def statistics(self, segments):
+        ids, lengths = segments.word_ids
+        references = segments.references
+        return TerStats(edits=edit_distances(ids, lengths, references.ids, references.lengths),
+                        ref_lengths=references.lengths.copy())
+
+    @staticmethod
+    def _rate(edits, ref_lengths):
+        edits = np.asarray(edits, dtype=np.float64)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(ref_lengths > 0, edits / ref_lengths, np.where(edits > 0, 1.0, 0.0))
+
+    def corpus_score(self, stats):
+        return float(self._rate(stats.edits.sum(), stats.ref_lengths.sum()))
+
+    def sentence_scores(self, stats):
+        return self._rate(stats.edits, stats.ref_lengths)
+
+
+def compute_statistics(references, hypothesis, score_types=('bleu',)):
+    """
+    Statistics of every requested metric from one pass over the segments.
+
+    :type references: list or ReferenceNgrams
+    :param references: reference sentences or their precomputed n-grams
+    :type hypothesis: list
+    :param hypothesis: hypothesis sentences
+    :rtype: dict
+    :return: statistics by score type
+    """
+    scorers = [get_scorer(name) for name in score_types]
+    if not isinstance(references, ReferenceNgrams):
+        references = ReferenceNgrams(tokenize(references))
+    segments = SegmentPass(references, hypothesis)
+    return {scorer.name: scorer.statistics(segments) for scorer in scorers}
+
+
+def merge_statistics(stats):
+    """
+    :type stats: list
+    :param stats: results of ``compute_statistics`` for consecutive shards
+    :rtype: dict
+    """
+    return {name: get_scorer(name).merge([shard[name] for shard in stats]) for name in stats[0]}
+
+
+def corpus_scores(stats):
+    """
+    :type stats: dict
+    :return: corpus score by score type
+    """
+    return {name: get_scorer(name).corpus_score(value) for name, value in stats.items()}
+
+
+def segment_scores(stats):
+    """
+    :type stats: dict
+    :return: array of the scores of every segment by score type
+    """
+    return {name: get_scorer(name).sentence_scores(value) for name, value in stats.items()}
+
+
+def worst_segments(scores, count, lower_is_better=False):
+    """
+    Indexes of the ``count`` worst segments, worst first.
+
+    >>> worst_segments(np.array([0.5, 0.1, 0.9, 0.3]), 2).tolist()
+    [1, 3]
+
+    :type scores: numpy.ndarray
+    :rtype: numpy.ndarray
+    """
+    count = min(count, len(scores))
+    if not count:
+        return np.zeros(0, dtype=np.int64)
+    keys = -scores if lower_is_better else scores
+    # only the worst ones are sorted
+    candidates = np.argpartition(keys, count - 1)[:count]
+    return candidates[np.lexsort((candidates, keys[candidates]))]
+
+
+def concatenate_rows(rows):
+    """
+    :type rows: list
+    :param rows: namedtuples of arrays of the same type, like ``Scorer.group`` rows
+    """
+    return type(rows[0])(*[np.concatenate(field) for field in zip(*rows)])
+
+
+def add_statistics(totals, stats):
+    """
+    Running sums of the statistics of shards, in ``Scorer.group`` rows: every
+    shard is added once, whatever the number of shards before it.
+
+    :type totals: dict or None
+    :param totals: sums of the previous shards, None before the first one
+    :type stats: dict
+    :rtype: dict
+    """
+    sums = {}
+    for name, value in stats.items():
+        row = get_scorer(name).group(value)
+        if totals is not None:
+            row = type(row)(*[total + field for total, field in zip(totals[name], row)])
+        sums[name] = row
+    return sums
+
+
+def summed_scores(totals):
+    """
+    :type totals: dict
+    :param totals: result of ``add_statistics``
+    :return: corpus score by score type
+    """
+    # the corpus is the one resample which draws the single row once
+    once = np.ones((1, 1))
+    return {name: float(get_scorer(name).resampled_scores(value, once)[0])
+            for name, value in totals.items()}
+
+
+def bootstrap_weights(groups, samples, rng):
+    """
+    How often each of ``groups`` groups is drawn by ``samples`` resamples with
+    replacement; paired comparisons use the same weights for both sides.
+
+    :type rng: numpy.random.Generator
+    :rtype: numpy.ndarray
+    """
+    return rng.multinomial(groups, np.full(groups, 1 / groups), size=samples).astype(np.float64)
+
+
+def percentile_interval(scores, confidence):
+    """
+    >>> percentile_interval(np.arange(101), 0.5)
+    (25.0, 75.0)
+    """
+    low, high = np.quantile(scores, [(1 - confidence) / 2, (1 + confidence) / 2])
+    return float(low), float(high)
+
+
+def stratified_order(count, strata, rng):
+    """
+    A random order of ``count`` consecutive chunks which takes one chunk of each
+    of ``strata`` equal parts in turn, so that every prefix is spread over the
+    whole corpus.
+
+    >>> order = stratified_order(10, 2, np.random.default_rng(0))
+    >>> sorted(order.tolist()), sorted(idx // 5 for idx in order[:2].tolist())
+    ([0, 1, 2, 3, 4, 5, 6, 7, 8, 9], [0, 1])
+
+    :rtype: numpy.ndarray
+    """
+    strata = max(1, min(strata, count))
+    stratum = np.arange(count) * strata // count
+    # a random rank within the stratum, then the strata in a random order in every round
+    shuffled = np.lexsort((rng.random(count), stratum))
+    rank = np.empty(count, dtype=np.int64)
+    rank[shuffled] = np.arange(count) - np.searchsorted(stratum, stratum[shuffled])
+    return np.lexsort((rng.random(count), rank))
+
+
+def take_statistics(stats, rows):
+    """
+    :type stats: dict
+    :type rows: numpy.ndarray
+    :return: statistics of the segments ``rows``, in their order
+    """
+    return {name: type(value)(*[field[rows] for field in value]) for name, value in stats.items()}
+
+
+def line_hashes(original, translation):
+    """
+    64 bit content hash of every line, from its source and reference.
+
+    >>> hashes = line_hashes(['a', 'b', 'a'], ['x', 'y', 'x'])
+    >>> hashes.dtype.name, bool(hashes[0] == hashes[2]), bool(hashes[0] == hashes[1])
+    ('uint64', True, False)
+
+    :rtype: numpy.ndarray
+    """
+    digests = b''.join(
+        hashlib.blake2b('{}\t{}'.format(source, reference).encode(), digest_size=8).digest()
+        for source, reference in zip(original, translation)
+    )
+    return np.frombuffer(digests, dtype='<u8').astype(np.uint64)
+
+
+def data_set_version(hashes):
+    """
+    Identifies the content of a data set by the hashes of its lines, in order.
+
+    :type hashes: numpy.ndarray
+    :rtype: str
+    """
+    return hashlib.sha1(np.ascontiguousarray(hashes, dtype='<u8').tobytes()).hexdigest()[:16]
+
+
+def match_lines(hashes, previous):
+    """
+    Where every line is found in a previous version, wherever it moved.
+
+    >>> match_lines(np.array([3, 1, 4, 1], dtype=np.uint64),
+    ...             np.array([1, 5, 3], dtype=np.uint64)).tolist()
+    [2, 0, -1, 0]
+
+    :type hashes: numpy.ndarray
+    :type previous: numpy.ndarray
+    :rtype: numpy.ndarray
+    :return: index of every line in ``previous``, -1 for added or changed lines
+    """
+    if not len(previous):
+        return np.full(len(hashes), -1, dtype=np.int64)
+    sorter = np.argsort(previous, kind='stable')
+    positions = np.minimum(np.searchsorted(previous, hashes, sorter=sorter), len(previous) - 1)
+    matched = sorter[positions]
+    return np.where(previous[matched] == hashes, matched, -1).astype(np.int64)
+
+
+def compute_bleu_statistics(references, hypothesis):
+    """
+    :type references: list or ReferenceNgrams
+    :param references: reference sentences or their precomputed n-grams
+    :type hypothesis: list
+    :param hypothesis: hypothesis sentences
+    :rtype: BleuStats
+    """
+    return compute_statistics(references, hypothesis, ['bleu'])['bleu']
 
 
 def score_translation(references, hypothesis, type_='bleu'):
     """
+    Score in the current process, see ``scoring.ScoringEngine`` for the pooled version.
+
+    >>> hyp1 = ("It is a guide to action which ensures that the military always obeys "
+    ...         "the commands of the party")
+    >>> ref1 = ("It is a guide to action that ensures that the military will forever "
+    ...         "heed Party commands")
+    >>> hyp2 = "he read the book because he was interested in world history"
+    >>> ref2 = "he was interested in world history because he read the book"
+
+    >>> round(score_translation([ref1, ref2], [hyp1, hyp2]), 4)
+    0.5314
+
+    >>> score_translation([ref1, ref2], [ref1, ref2])
+    1.0
+
+    >>> scores = score_translation([ref1, ref2], [hyp1, hyp2], ['bleu', 'ter'])
+    >>> round(scores['bleu'], 4), round(scores['ter'], 4)
+    (0.5314, 0.6667)
+
     :type references: list
     :type hypothesis: list
-    :type type_: str
-    :rtype: float
+    :type type_: str or list
+    :rtype: float or dict
+    :return: the score, or the scores by type for a list of types
     """
-    list_of_hypotheses = [input_sentence.split(' ') for input_sentence in hypothesis]
-    list_of_references = [ref_sentence.split(' ') for ref_sentence in references]
-
-    if not type_ == 'bleu':
-        raise Exception('Not acceptable type')
+    score_types = [type_] if isinstance(type_, str) else list(type_)
 
     logging.info('starting score calculation: %s', type_)
-    #
-    number_threshold = 40
-    # split in pairs if size more than number_threshold
-    list_of_sublists_ref = split(list_of_references, number_threshold)
-    list_of_sublists_hyp = split(list_of_hypotheses, number_threshold)
-    pairs = zip(list_of_sublists_ref, list_of_sublists_hyp)
-
-    # run in parallel
-    with Pool() as pool:
-        result = pool.map(run_single_corpus_bleu, pairs)
-    bleu = sum(result)/len(result)
-    #
+    scores = corpus_scores(compute_statistics(references, hypothesis, score_types))
     logging.info('finishing score calculation: %s', type_)
 
-    return bleu
+    return scores[type_] if isinstance(type_, str) else scores